@@ -0,0 +1,112 @@
+'''
+Counts sound card deadline misses with the audio devices running on threads in the
+intercom's process versus in a dedicated engine process, while other threads in the
+intercom's process keep the GIL busy the way pymumble, aiohttp and logging do.
+
+The sound card is simulated by FakeDevices, which counts a miss whenever the speaker
+would have run dry or the microphone buffer would have overflowed.  Sound is the real
+one, playing a synthetic talker.
+
+    python benchmarks/engine_deadlines.py --seconds 20 --contenders 3
+'''
+import argparse
+import functools
+import logging
+import os
+import sys
+import time
+from threading import Event, Thread
+from types import SimpleNamespace
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(__file__, "..", "..")))
+from rpi_intercom.config import Config
+from rpi_intercom.control import Control
+from rpi_intercom.engine import ProcessDevices
+from rpi_intercom.fake_devices import FakeDevices
+from rpi_intercom.logger import CONSOLE
+from rpi_intercom.sound import Sound
+
+FRAME = 960
+AUDIO_DATA_TYPE = np.dtype(np.int16).newbyteorder('<')
+
+
+class FakeMumble:
+    def __init__(self):
+        self._sound_callback = None
+
+    def transmit(self, chunk, held=False):
+        pass
+
+
+def busy(stop: Event):
+    while not stop.is_set():
+        total = 0
+        for i in range(5000):
+            total += i * i
+
+
+def chatty(stop: Event):
+    log = logging.getLogger("benchmark.chatty")
+    log.propagate = False
+    log.addHandler(logging.StreamHandler(open(os.devnull, "w")))
+    while not stop.is_set():
+        log.warning("Some message %s", time.time())
+        time.sleep(0.001)
+
+
+def run(name: str, devices, seconds: float, contenders: int):
+    config = Config(chunk_size=512)
+    mumble = FakeMumble()
+    sound = Sound(devices, mumble, Control(config), config)
+    stop = Event()
+    frame = (np.sin(np.arange(FRAME) / 10) * 10000).astype(AUDIO_DATA_TYPE).tobytes()
+
+    def talk():
+        next_frame = time.perf_counter()
+        while not stop.is_set():
+            mumble._sound_callback({'session': 1, 'name': 'synthetic'}, frame)
+            next_frame += FRAME / 48000
+            time.sleep(max(0, next_frame - time.perf_counter()))
+
+    devices.start()
+    sound.start()
+    # Let things settle before loading up the GIL
+    time.sleep(1)
+    before = dict(devices.stats)
+    threads = [Thread(target=talk, daemon=True), Thread(target=chatty, args=(stop,), daemon=True)]
+    threads += [Thread(target=busy, args=(stop,), daemon=True) for _ in range(contenders)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    after = dict(devices.stats)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    sound.stop()
+    devices.stop()
+
+    def delta(key):
+        return after.get(key, 0) - before.get(key, 0)
+    print(f"{name:<34} {delta('speaker_periods'):>8} {delta('speaker_underruns'):>10} {delta('microphone_overruns'):>9} {delta('speaker_ring_underruns'):>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--contenders", type=int, default=3, help="threads keeping the GIL busy")
+    args = parser.parse_args()
+    CONSOLE.setLevel(logging.WARNING)
+
+    config = Config(chunk_size=512)
+    shutdown = SimpleNamespace(shutting_down=False, shutdown=lambda: None)
+    print(f"{args.seconds:.0f}s with {args.contenders} busy threads and a logging thread, 512 sample periods")
+    print(f"{'engine':<34} {'periods':>8} {'underruns':>10} {'overruns':>9} {'ring gaps':>12}")
+    run("thread, 2 period card buffer", FakeDevices(config, periods=2), args.seconds, args.contenders)
+    run("thread, 6 period card buffer", FakeDevices(config, periods=6), args.seconds, args.contenders)
+    for periods in [4, 6]:
+        run(f"process, 2 + {periods} period ring", ProcessDevices(config, shutdown, factory=functools.partial(FakeDevices, periods=2), periods=periods), args.seconds, args.contenders)
+
+
+if __name__ == '__main__':
+    main()
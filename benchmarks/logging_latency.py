@@ -0,0 +1,98 @@
+'''
+Measures how long a simulated speaker thread spends inside logging calls when logging
+straight to the handlers versus through the queued log writer.  The console is made
+slow the way a busy terminal or journald pipe can be, the web UI handler hands every
+message to an event loop like Server does, and other threads log chatter at the same
+time.
+
+    python benchmarks/logging_latency.py --seconds 10
+'''
+import argparse
+import asyncio
+import os
+import sys
+import time
+from threading import Event, Thread
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(__file__, "..", "..")))
+from rpi_intercom.logger import getLogger, startQueue, stopQueue, CONSOLE, ATTACHABLE
+
+PERIOD = 512 / 48000
+
+
+class SlowStream:
+    '''A console that usually takes 0.2ms per write and every so often stalls for 20ms'''
+    def __init__(self):
+        self._writes = 0
+
+    def write(self, text):
+        self._writes += 1
+        time.sleep(0.02 if self._writes % 50 == 0 else 0.0002)
+
+    def flush(self):
+        pass
+
+
+def chatty(stop: Event):
+    log = getLogger("benchmark.chatty")
+    while not stop.is_set():
+        log.info("Some message from pymumble %s", time.time())
+        time.sleep(0.002)
+
+
+def speaker(stop: Event, durations: list):
+    '''Logs from the hot path every few periods, like "started talking" or an overrun'''
+    log = getLogger("benchmark.speaker")
+    next_period = time.perf_counter()
+    count = 0
+    while not stop.is_set():
+        count += 1
+        if count % 5 == 0:
+            start = time.perf_counter()
+            log.info(f"Talker {count} started talking")
+            durations.append(time.perf_counter() - start)
+        next_period += PERIOD
+        time.sleep(max(0, next_period - time.perf_counter()))
+
+
+def run(seconds: float, contenders: int) -> np.ndarray:
+    stop = Event()
+    durations = []
+    threads = [Thread(target=speaker, args=(stop, durations), daemon=True)]
+    threads += [Thread(target=chatty, args=(stop,), daemon=True) for _ in range(contenders)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return np.array(durations) * 1000000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--contenders", type=int, default=2, help="other threads logging")
+    args = parser.parse_args()
+
+    CONSOLE.setStream(SlowStream())
+    loop = asyncio.new_event_loop()
+    Thread(target=loop.run_forever, daemon=True).start()
+
+    async def deliver(messages):
+        pass
+    ATTACHABLE.attachBatch(lambda messages: asyncio.run_coroutine_threadsafe(deliver(messages), loop))
+
+    print(f"Time the speaker thread spent logging over {args.seconds:.0f}s with {args.contenders} other threads logging")
+    print(f"{'mode':<8} {'calls':>6} {'mean':>9} {'p99':>9} {'max':>10}")
+    for mode in ["direct", "queued"]:
+        if mode == "queued":
+            startQueue()
+        us = run(args.seconds, args.contenders)
+        stopQueue()
+        print(f"{mode:<8} {len(us):>6} {us.mean():>7.1f}us {np.percentile(us, 99):>7.1f}us {us.max():>8.1f}us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+'''
+Measures push-to-talk latency: from a transmit button being pressed to the first frame
+handed to pymumble's sound output, and from it being released to the last one.  Also
+shows how much of what was sent was captured before the press or after the release.
+
+The button is a gpiozero mock pin driven like a real switch, optionally with contact
+bounce, going through Control the same way a real press does.  The microphone is
+FakeDevices, with every period stamped with its index so each sent frame can be traced
+back to when it was captured.  Mumble is the real one, with a stand-in for the pymumble
+connection that records what is sent.
+
+    python benchmarks/ptt_latency.py --presses 20 --bounce 3 --debounce 0.005
+'''
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+from threading import Lock, Thread
+from types import SimpleNamespace
+import numpy as np
+from gpiozero import Device
+from gpiozero.pins.mock import MockFactory
+
+sys.path.insert(0, os.path.abspath(os.path.join(__file__, "..", "..")))
+from rpi_intercom.config import Config, PinConfig
+from rpi_intercom.control import Control
+from rpi_intercom.fake_devices import FakeDevices
+from rpi_intercom.logger import CONSOLE
+from rpi_intercom.mumble import Mumble
+from rpi_intercom.rechunk import AUDIO_DATA_TYPE
+from rpi_intercom.sound import Sound
+
+PIN = "GPIO17"
+
+
+class StampedMicrophone:
+    '''Fills every period with its own index (plus one, so it isn't silence) and remembers when it was captured'''
+    def __init__(self):
+        self.captured = {}
+
+    def __call__(self, samples: int) -> bytes:
+        index = len(self.captured) + 1
+        self.captured[index] = time.perf_counter()
+        return np.full(samples, index, dtype=AUDIO_DATA_TYPE).tobytes()
+
+
+class FakeOutput:
+    '''Stands in for pymumble's SoundOutput, recording when each frame is added'''
+    def __init__(self, audio_per_packet: float):
+        self.encoder = SimpleNamespace(bitrate=None, complexity=None)
+        self.bandwidth = None
+        self._audio_per_packet = audio_per_packet
+        self._lock = Lock()
+        self.sent = []
+
+    def add_sound(self, frame: bytes):
+        with self._lock:
+            self.sent.append((time.perf_counter(), np.frombuffer(frame, dtype=AUDIO_DATA_TYPE)[0]))
+
+    def get_buffer_size(self) -> float:
+        return 0
+
+    def clear_buffer(self):
+        pass
+
+    def get_audio_per_packet(self) -> float:
+        return self._audio_per_packet
+
+    def set_audio_per_packet(self, audio_per_packet: float):
+        self._audio_per_packet = audio_per_packet
+
+    def take(self):
+        with self._lock:
+            sent = self.sent
+            self.sent = []
+        return sent
+
+
+def bounce(pin, count: int):
+    '''Chatters the contact like a cheap switch does before it settles'''
+    for _ in range(count):
+        pin.drive_low()
+        time.sleep(random.uniform(0.0002, 0.001))
+        pin.drive_high()
+        time.sleep(random.uniform(0.0002, 0.001))
+
+
+def run(args):
+    config = Config(chunk_size=args.chunk_size, pins={PIN: PinConfig.ACTION_HOLD_TO_TRANSMIT.value}, button_debounce=args.debounce, adaptive_bitrate=False)
+    microphone = StampedMicrophone()
+    devices = FakeDevices(config, source=microphone)
+    control = Control(config)
+    mumble = Mumble(control, config, SimpleNamespace(shutting_down=False))
+    output = FakeOutput(config.opus_frame_duration / 1000)
+    # Connected, as far as the transmit loop can tell
+    mumble._mumble = SimpleNamespace(sound_output=output, server_max_bandwidth=None)
+    mumble._connected = True
+    transmit_thread = Thread(target=mumble._transmit_loop, daemon=True)
+    transmit_thread.start()
+    sound = Sound(devices, mumble, control, config)
+    pin = Device.pin_factory.pin(PIN)
+    control.start()
+    devices.start()
+    sound.start()
+
+    results = []
+    time.sleep(0.5)
+    output.take()
+    for _ in range(args.presses):
+        # Presses land anywhere within a period
+        time.sleep(random.uniform(0, 0.02))
+        bounce(pin, args.bounce)
+        pressed = time.perf_counter()
+        pin.drive_low()
+        time.sleep(args.hold)
+        bounce(pin, args.bounce)
+        released = time.perf_counter()
+        pin.drive_high()
+        time.sleep(args.gap)
+        sent = output.take()
+        if len(sent) == 0:
+            results.append(None)
+            continue
+        first_sent, first_index = sent[0]
+        last_sent, last_index = sent[-1]
+        # A period's stamp is when capturing it finished, so it started a period earlier
+        period = devices.chunk_size / 48000
+        first_captured = microphone.captured[first_index] - period
+        last_captured = microphone.captured[last_index]
+        results.append((first_sent - pressed, first_captured - pressed, last_sent - released, last_captured - released))
+
+    sound.stop()
+    devices.stop()
+    control.stop()
+    mumble._stopping = True
+    transmit_thread.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--presses", type=int, default=20)
+    parser.add_argument("--hold", type=float, default=0.5, help="seconds the button is held")
+    parser.add_argument("--gap", type=float, default=1.0, help="seconds between presses")
+    parser.add_argument("--bounce", type=int, default=0, help="contact bounces before each edge settles")
+    parser.add_argument("--debounce", type=float, default=None, help="button_debounce to configure")
+    parser.add_argument("--chunk_size", type=int, default=512)
+    args = parser.parse_args()
+    CONSOLE.setLevel(logging.WARNING)
+    Device.pin_factory = MockFactory()
+
+    results = run(args)
+    missed = sum(1 for result in results if result is None)
+    results = np.array([result for result in results if result is not None]) * 1000
+    print(f"{args.presses} presses held {args.hold:.2f}s, {args.bounce} bounces per edge, button_debounce {args.debounce}, {args.chunk_size} sample periods")
+    if missed > 0:
+        print(f"{missed} presses sent nothing at all")
+    if len(results) == 0:
+        return
+    print(f"{'':<34} {'mean':>8} {'min':>8} {'max':>8}")
+    names = [
+        "press to first frame sent",
+        "first frame captured vs press",
+        "release to last frame sent",
+        "last frame captured vs release",
+    ]
+    for i, name in enumerate(names):
+        column = results[:, i]
+        print(f"{name:<34} {column.mean():>6.1f}ms {column.min():>6.1f}ms {column.max():>6.1f}ms")
+    print("(captured times are negative when the audio was captured before the edge)")
+
+
+if __name__ == '__main__':
+    main()
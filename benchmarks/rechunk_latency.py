@@ -0,0 +1,132 @@
+'''
+Measures how long microphone audio waits at each hop between capture and being
+encoded by pymumble, with and without re-chunking capture periods into opus frames.
+
+pymumble's SoundOutput is simulated with a virtual clock, following the logic of
+add_sound() and send_audio() in pymumble_py3/soundoutput.py, so this runs anywhere.
+
+    python benchmarks/rechunk_latency.py
+'''
+import argparse
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(__file__, "..", "..")))
+from rpi_intercom.rechunk import Rechunker, RATE
+
+LOOP_RATE = 0.01  # pymumble's main loop period (PYMUMBLE_LOOP_RATE)
+
+
+class SimulatedSoundOutput:
+    '''Tracks the capture time of every sample through pymumble's send buffer'''
+    def __init__(self, audio_per_packet: float):
+        self.audio_per_packet = audio_per_packet
+        self.frame = int(audio_per_packet * RATE)
+        self.pcm = []
+        self.sequence_last_time = -1
+        self.buffer_waits = []
+        self.total_waits = []
+        self.padding = 0
+        self.sent = 0
+
+    def add_sound(self, times: np.ndarray, now: float):
+        # Each sample is tracked as (capture time, time it was handed to pymumble)
+        samples = np.stack((times, np.full(len(times), now)))
+        offset = 0
+        if len(self.pcm) and self.pcm[-1].shape[1] < self.frame:
+            offset = self.frame - self.pcm[-1].shape[1]
+            self.pcm[-1] = np.concatenate((self.pcm[-1], samples[:, :offset]), axis=1)
+        for i in range(offset, len(times), self.frame):
+            self.pcm.append(samples[:, i:i + self.frame])
+
+    def send_audio(self, now: float):
+        while len(self.pcm) > 0 and self.sequence_last_time + self.audio_per_packet <= now:
+            if self.sequence_last_time + self.audio_per_packet * 2 <= now:
+                self.sequence_last_time = now
+            else:
+                self.sequence_last_time += self.audio_per_packet
+            encoded = 0
+            while len(self.pcm) > 0 and encoded < self.audio_per_packet:
+                chunk = self.pcm.pop(0)
+                # Partial frames get padded with silence
+                self.padding += self.frame - chunk.shape[1]
+                self.total_waits.extend(now - chunk[0])
+                self.buffer_waits.extend(now - chunk[1])
+                self.sent += self.frame
+                encoded += self.audio_per_packet
+
+    def backlog(self) -> float:
+        return sum(chunk.shape[1] for chunk in self.pcm) / RATE
+
+
+def simulate(period: int, frame_ms: int, rechunk: bool, seconds: float, seed: int):
+    rng = np.random.default_rng(seed)
+    output = SimulatedSoundOutput(frame_ms / 1000)
+    rechunker = Rechunker(output.frame, RATE)
+    pending = np.zeros(0)
+    period_seconds = period / RATE
+    # pymumble's loop runs on its own clock, at a random phase to the sound card
+    next_loop = rng.uniform(0, LOOP_RATE)
+    next_capture = period_seconds
+    captured = 0
+    capture_waits = []
+    rechunk_waits = []
+    backlogs = []
+    while next_capture < seconds:
+        if next_loop < next_capture:
+            output.send_audio(next_loop)
+            backlogs.append(output.backlog())
+            # select() wakes up a little late now and then
+            next_loop += LOOP_RATE + rng.exponential(0.0005)
+            continue
+        now = next_capture
+        times = (captured + np.arange(period)) / RATE
+        captured += period
+        capture_waits.extend(now - times)
+        if rechunk:
+            pending = np.concatenate((pending, times))
+            for _ in rechunker.push(np.zeros(period, dtype=np.int16).tobytes()):
+                frame, pending = pending[:output.frame], pending[output.frame:]
+                rechunk_waits.extend(now - frame)
+                output.add_sound(frame, now)
+        else:
+            rechunk_waits.extend(now - times)
+            output.add_sound(times, now)
+        next_capture += period_seconds
+
+    total = np.array(output.total_waits)
+    return {
+        'capture_ms': np.mean(capture_waits) * 1000,
+        'rechunk_ms': (np.mean(rechunk_waits) - np.mean(capture_waits)) * 1000,
+        'pymumble_ms': np.mean(output.buffer_waits) * 1000,
+        'total_ms': total.mean() * 1000,
+        'total_max_ms': total.max() * 1000,
+        'padding_pct': output.padding / max(1, output.sent) * 100,
+        'backlog_jitter_ms': np.std(backlogs) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=60)
+    parser.add_argument("--frame", type=int, default=20, help="opus frame duration in ms")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    frame = int(args.frame * RATE / 1000)
+    cases = [
+        ("512 sample periods, unaligned", 512, False),
+        ("512 sample periods, rechunked", 512, True),
+        (f"{frame} sample periods, unaligned", frame, False),
+    ]
+    print(f"{args.frame}ms opus frames, {args.seconds:.0f}s of audio.  Mean wait per hop:")
+    print(f"{'case':<32} {'capture':>8} {'rechunk':>8} {'pymumble':>9} {'total':>8} {'max':>8} {'jitter':>8} {'padding':>8}")
+    for name, period, rechunk in cases:
+        r = simulate(period, args.frame, rechunk, args.seconds, args.seed)
+        print(f"{name:<32} {r['capture_ms']:>6.2f}ms {r['rechunk_ms']:>6.2f}ms {r['pymumble_ms']:>7.2f}ms {r['total_ms']:>6.2f}ms "
+              f"{r['total_max_ms']:>6.2f}ms {r['backlog_jitter_ms']:>6.2f}ms {r['padding_pct']:>7.2f}%")
+
+
+if __name__ == '__main__':
+    main()
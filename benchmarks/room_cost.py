@@ -0,0 +1,154 @@
+'''
+Measures what each room costs when one intercom serves several: threads, memory and CPU
+time with 1 up to --rooms endpoints running side by side in one process.
+
+Every room is a real Endpoint (Control, Sound and Mumble's transmit path, sharing the
+device and indicator workers the way Intercom does) on FakeDevices.  Its microphone
+picks up noise for the VAD-free transmit path and someone is always talking to it, so
+capture, mixing, playback and transmitting all run.  pymumble's connection is a
+stand-in, so opus encoding and the network aren't included.  Neither is the audio engine
+process that audio_engine: process starts for every room, which doesn't share one.
+
+    python benchmarks/room_cost.py --rooms 4 --seconds 10
+'''
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from threading import Event, Thread
+from types import SimpleNamespace
+import numpy as np
+import psutil
+from gpiozero import Device
+from gpiozero.pins.mock import MockFactory
+
+sys.path.insert(0, os.path.abspath(os.path.join(__file__, "..", "..")))
+from rpi_intercom.config import Config
+from rpi_intercom.endpoint import Endpoint
+from rpi_intercom.fake_devices import FakeDevices
+from rpi_intercom.logger import CONSOLE
+from rpi_intercom.rechunk import AUDIO_DATA_TYPE
+from rpi_intercom.worker import Worker
+
+FRAME = 960
+
+
+class FakeOutput:
+    '''Stands in for pymumble's SoundOutput, counting what would have been sent'''
+    def __init__(self, audio_per_packet: float):
+        self.encoder = SimpleNamespace(bitrate=None, complexity=None)
+        self.bandwidth = None
+        self._audio_per_packet = audio_per_packet
+        self.frames = 0
+
+    def add_sound(self, frame: bytes):
+        self.frames += 1
+
+    def get_buffer_size(self) -> float:
+        return 0
+
+    def clear_buffer(self):
+        pass
+
+    def get_audio_per_packet(self) -> float:
+        return self._audio_per_packet
+
+    def set_audio_per_packet(self, audio_per_packet: float):
+        self._audio_per_packet = audio_per_packet
+
+
+def noise(samples: int) -> bytes:
+    return np.random.randint(-3000, 3000, samples, dtype=AUDIO_DATA_TYPE).tobytes()
+
+
+def talk(endpoints, stop: Event):
+    '''Someone in mumble talking to every room, a frame every 20ms'''
+    frame = np.random.randint(-3000, 3000, FRAME, dtype=AUDIO_DATA_TYPE).tobytes()
+    user = {'session': 1, 'name': "talker"}
+    next_frame = time.perf_counter()
+    while not stop.is_set():
+        for endpoint in endpoints:
+            endpoint.sound._play(user, frame)
+        next_frame += FRAME / 48000
+        time.sleep(max(0, next_frame - time.perf_counter()))
+
+
+def measure(rooms: int, seconds: float, chunk_size: int):
+    config = Config(chunk_size=chunk_size, adaptive_bitrate=False, endpoints=[{"name": f"room{i}"} for i in range(rooms)])
+    shutdown = SimpleNamespace(shutting_down=False)
+    device_worker = Worker("Device Check")
+    indicator_worker = Worker("Indicators")
+    device_worker.start()
+    indicator_worker.start()
+    endpoints = []
+    for endpoint_config in config.endpointConfigs():
+        endpoint = Endpoint(endpoint_config, shutdown, device_worker, indicator_worker, devices=FakeDevices(endpoint_config, source=noise))
+        # Connected, as far as the transmit loop can tell
+        endpoint.mumble._mumble = SimpleNamespace(sound_output=FakeOutput(endpoint_config.opus_frame_duration / 1000), server_max_bandwidth=None)
+        endpoint.mumble._connected = True
+        endpoints.append(endpoint)
+    transmit_threads = [Thread(target=endpoint.mumble._transmit_loop, daemon=True) for endpoint in endpoints]
+    for endpoint, thread in zip(endpoints, transmit_threads):
+        endpoint.control.start()
+        endpoint.devices.start()
+        endpoint.sound.start()
+        thread.start()
+    stop = Event()
+    talker = Thread(target=talk, args=(endpoints, stop), daemon=True)
+    talker.start()
+
+    # Let everything settle before measuring
+    time.sleep(1)
+    process = psutil.Process()
+    threads = threading.active_count()
+    start_cpu = process.cpu_times()
+    start = time.perf_counter()
+    time.sleep(seconds)
+    elapsed = time.perf_counter() - start
+    end_cpu = process.cpu_times()
+    rss = process.memory_info().rss
+    cpu = (end_cpu.user + end_cpu.system - start_cpu.user - start_cpu.system) / elapsed
+    missed = sum(endpoint.devices.stats['microphone_overruns'] + endpoint.devices.stats['speaker_underruns'] for endpoint in endpoints)
+    sent = sum(endpoint.mumble._mumble.sound_output.frames for endpoint in endpoints)
+
+    stop.set()
+    talker.join()
+    for endpoint, thread in zip(endpoints, transmit_threads):
+        endpoint.sound.stop()
+        endpoint.devices.stop()
+        endpoint.control.stop()
+        endpoint.mumble._stopping = True
+        thread.join()
+    device_worker.stop()
+    indicator_worker.stop()
+    return threads, rss, cpu, missed, sent
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rooms", type=int, default=4, help="measure 1 up to this many rooms")
+    parser.add_argument("--seconds", type=float, default=10, help="seconds to measure each count for")
+    parser.add_argument("--chunk_size", type=int, default=512)
+    args = parser.parse_args()
+    CONSOLE.setLevel(logging.WARNING)
+    Device.pin_factory = MockFactory()
+
+    print(f"{args.seconds:.0f}s per measurement, {args.chunk_size} sample periods, {psutil.cpu_count()} CPUs")
+    print(f"{'rooms':>5} {'threads':>8} {'RSS':>9} {'CPU':>7} {'+threads':>9} {'+RSS':>9} {'+CPU':>7} {'misses':>7} {'sent':>7}")
+    previous = None
+    for rooms in range(1, args.rooms + 1):
+        threads, rss, cpu, missed, sent = measure(rooms, args.seconds, args.chunk_size)
+        line = f"{rooms:>5} {threads:>8} {rss / 2**20:>7.1f}MB {cpu * 100:>6.1f}%"
+        if previous is not None:
+            line += f" {threads - previous[0]:>9} {(rss - previous[1]) / 2**20:>7.1f}MB {(cpu - previous[2]) * 100:>6.1f}%"
+        else:
+            line += f" {'':>9} {'':>9} {'':>7}"
+        print(line + f" {missed:>7} {sent:>7}")
+        previous = (threads, rss, cpu)
+    print("(+ columns are the cost of that room over one fewer, RSS only grows as memory is reused)")
+
+
+if __name__ == '__main__':
+    main()
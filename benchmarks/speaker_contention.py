@@ -0,0 +1,116 @@
+'''
+Compares how long the speaker thread spends in Speaker.read() with the old locked
+buffer against the lock-free SpscBuffer, while a simulated pymumble thread buffers
+audio and other threads keep the GIL busy decoding and logging.
+
+    python benchmarks/speaker_contention.py --seconds 10 --contenders 2
+'''
+import argparse
+import logging
+import os
+import sys
+import time
+from threading import Event, Lock, Thread
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(__file__, "..", "..")))
+from rpi_intercom.circular_buffer import Buffer
+from rpi_intercom.speaker import Speaker
+from rpi_intercom.logger import CONSOLE
+
+RATE = 48000
+PERIOD = 512
+FRAME = 960  # pymumble hands over 20ms of decoded audio at a time
+AUDIO_DATA_TYPE = np.dtype(np.int16).newbyteorder('<')
+
+
+class LockedSpeaker:
+    '''The previous Speaker implementation, where both threads share one lock'''
+    def __init__(self, max_buffer, ideal_buffer):
+        self._buffer = Buffer(max_buffer)
+        self._lock = Lock()
+        self._ideal_buffer = ideal_buffer
+        self._missed = True
+
+    def buffer(self, data: bytes):
+        with self._lock:
+            self._buffer.push(np.frombuffer(data, dtype=AUDIO_DATA_TYPE).astype(float) / 32768)
+            if self._buffer.length >= self._ideal_buffer:
+                self._missed = False
+
+    def read(self, size):
+        with self._lock:
+            if not self._missed and self._buffer.length > 0:
+                ret = self._buffer.pop(size)
+                if len(ret) < size:
+                    ret = np.concatenate((ret, np.zeros(size - len(ret))), axis=None)
+                return ret
+            self._missed = True
+            return None
+
+
+def busy(stop: Event):
+    '''Pure python work, like opus decoding callbacks or the web server'''
+    while not stop.is_set():
+        total = 0
+        for i in range(2000):
+            total += i * i
+
+
+def chatty(stop: Event):
+    log = logging.getLogger("benchmark.chatty")
+    log.propagate = False
+    log.addHandler(logging.StreamHandler(open(os.devnull, "w")))
+    log.setLevel(logging.INFO)
+    while not stop.is_set():
+        log.info("Some message %s", time.time())
+        time.sleep(0.0005)
+
+
+def run(speaker, seconds: float, contenders: int):
+    stop = Event()
+    frame = (np.sin(np.arange(FRAME) / 10) * 10000).astype(AUDIO_DATA_TYPE).tobytes()
+
+    def produce():
+        next_frame = time.perf_counter()
+        while not stop.is_set():
+            speaker.buffer(frame)
+            next_frame += FRAME / RATE
+            time.sleep(max(0, next_frame - time.perf_counter()))
+
+    threads = [Thread(target=produce, daemon=True), Thread(target=chatty, args=(stop,), daemon=True)]
+    threads += [Thread(target=busy, args=(stop,), daemon=True) for _ in range(contenders)]
+    for thread in threads:
+        thread.start()
+
+    durations = []
+    end = time.perf_counter() + seconds
+    next_period = time.perf_counter()
+    while time.perf_counter() < end:
+        start = time.perf_counter()
+        speaker.read(PERIOD)
+        durations.append(time.perf_counter() - start)
+        next_period += PERIOD / RATE
+        time.sleep(max(0, next_period - time.perf_counter()))
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return np.array(durations) * 1000000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--contenders", type=int, default=2, help="threads keeping the GIL busy")
+    args = parser.parse_args()
+    CONSOLE.setLevel(logging.WARNING)
+
+    print(f"Time spent in Speaker.read() over {args.seconds:.0f}s with {args.contenders} busy threads and a logging thread")
+    print(f"{'buffer':<10} {'reads':>7} {'mean':>9} {'p99':>9} {'max':>9} {'>1ms':>6}")
+    for name, speaker in [("locked", LockedSpeaker(PERIOD * 10, PERIOD * 5)), ("spsc", Speaker("benchmark", PERIOD * 10, PERIOD * 5))]:
+        us = run(speaker, args.seconds, args.contenders)
+        print(f"{name:<10} {len(us):>7} {us.mean():>7.1f}us {np.percentile(us, 99):>7.1f}us {us.max():>7.1f}us {np.sum(us > 1000):>6}")
+
+
+if __name__ == '__main__':
+    main()
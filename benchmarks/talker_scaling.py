@@ -0,0 +1,164 @@
+'''
+Finds how many people can talk at once before the receive path (Sound._speaker_loop
+reading each talker's Speaker and _mix()ing them) misses the sound card's deadlines.
+
+K synthetic mumble users each send 20ms of audio through Sound._play() from one thread,
+like pymumble's, with every frame delayed by random network jitter.  The speaker thread
+plays into FakeDevices, which counts underruns a real card would have had.  For each K
+it reports:
+
+    underruns  periods the speaker thread was too late for
+    work       time the speaker thread spent per period, against the period it had
+    latency    how long the newest buffered audio waits before it's heard
+    gaps       audio missing from talkers because jitter emptied their buffer
+    CPU        of the speaker and receiving threads together, per talker
+
+The capacity is the most talkers with no underruns and the p99 work within --headroom
+of the period.  With --require N the exit status is 1 when the capacity is below N, so
+it can gate a build on the hardware it's run on:
+
+    python benchmarks/talker_scaling.py --seconds 10 --require 16
+
+This measures one room with the audio threads in this process.  With several rooms each
+one's speaker thread does this work for its own talkers, and with audio_engine: process
+each room also has an audio engine process of its own, which isn't included here.
+'''
+import argparse
+import heapq
+import logging
+import os
+import random
+import sys
+import time
+from threading import Event, Thread
+from types import SimpleNamespace
+from typing import List
+import numpy as np
+import psutil
+
+sys.path.insert(0, os.path.abspath(os.path.join(__file__, "..", "..")))
+from rpi_intercom.config import Config
+from rpi_intercom.fake_devices import FakeDevices
+from rpi_intercom.logger import CONSOLE
+from rpi_intercom.rechunk import AUDIO_DATA_TYPE, RATE
+from rpi_intercom.sound import Sound
+
+FRAME = 960  # pymumble hands over 20ms of decoded audio at a time
+
+
+class TimedDevices(FakeDevices):
+    '''FakeDevices that also times the speaker thread's work between writes'''
+    def __init__(self, config: Config, on_play):
+        super().__init__(config, on_play=on_play)
+        self.work: List[float] = []
+        self._written = None
+
+    def speaker_write(self, data) -> None:
+        start = time.perf_counter()
+        if self._written is not None:
+            self.work.append(start - self._written)
+        super().speaker_write(data)
+        self._written = time.perf_counter()
+
+
+def receive(sound: Sound, talkers: int, jitter: float, stop: Event):
+    '''
+    Delivers every talker's frames on one thread, each frame arriving up to `jitter`
+    seconds late (but never before that talker's previous one)
+    '''
+    frames = [(np.sin(np.arange(FRAME) * (i + 1) / 50) * 3000).astype(AUDIO_DATA_TYPE).tobytes() for i in range(talkers)]
+    users = [{'session': i + 1, 'name': f"talker{i}"} for i in range(talkers)]
+    frame_time = FRAME / RATE
+    start = time.perf_counter()
+    # Talkers don't start in step with each other
+    arrivals = [(start + random.uniform(0, frame_time), i, 0) for i in range(talkers)]
+    heapq.heapify(arrivals)
+    while not stop.is_set():
+        when, i, sent = heapq.heappop(arrivals)
+        delay = when - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        sound._play(users[i], frames[i])
+        nominal = start + (sent + 1) * frame_time
+        heapq.heappush(arrivals, (max(when, nominal + random.uniform(0, jitter)), i, sent + 1))
+
+
+def measure(talkers: int, seconds: float, jitter: float, chunk_size: int, priority: int):
+    config = Config(chunk_size=chunk_size, max_talkers=talkers, realtime_priority=priority)
+    latencies = []
+    control = SimpleNamespace(deafened=False, recieving=False)
+
+    def on_play(data, when):
+        # The newest audio each talker has buffered plays after this chunk and everything before it
+        now = time.perf_counter()
+        queued = when - now + sound._devices.chunk_size / RATE
+        for speaker in sound._talkers.active():
+            latencies.append(queued + speaker.length / RATE)
+
+    devices = TimedDevices(config, on_play)
+    sound = Sound(devices, SimpleNamespace(), control, config)
+    stop = Event()
+    receiver = Thread(target=receive, args=(sound, talkers, jitter, stop), name="Receiver", daemon=True)
+    sound._running = True
+    speaker = Thread(target=sound._speaker_loop, name="Speaker Thread", daemon=True)
+    receiver.start()
+    speaker.start()
+
+    # Wait for everyone's buffers to fill before counting anything
+    time.sleep(1)
+    devices.stats['speaker_underruns'] = 0
+    devices.work.clear()
+    latencies.clear()
+    gaps_before = sum(s.buffer_stats[1] for s in sound._talkers._talkers.values())
+    ids = {speaker.native_id, receiver.native_id}
+    process = psutil.Process()
+    start_cpu = sum(t.user_time + t.system_time for t in process.threads() if t.id in ids)
+    start = time.perf_counter()
+    time.sleep(seconds)
+    elapsed = time.perf_counter() - start
+    cpu = (sum(t.user_time + t.system_time for t in process.threads() if t.id in ids) - start_cpu) / elapsed
+    gaps = sum(s.buffer_stats[1] for s in sound._talkers._talkers.values()) - gaps_before
+    work = np.array(devices.work) * 1000
+    underruns = devices.stats['speaker_underruns']
+    latency = np.array(latencies) * 1000
+
+    stop.set()
+    sound._running = False
+    receiver.join()
+    speaker.join()
+    return underruns, work, latency, gaps / RATE * 1000 / talkers, cpu, devices.chunk_size / RATE * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--talkers", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64], help="numbers of people talking at once to try")
+    parser.add_argument("--seconds", type=float, default=10, help="seconds to measure each number for")
+    parser.add_argument("--jitter", type=float, default=10, help="most a frame can arrive late, in ms")
+    parser.add_argument("--chunk_size", type=int, default=512)
+    parser.add_argument("--priority", type=int, default=0, help="realtime_priority for the speaker thread")
+    parser.add_argument("--headroom", type=float, default=0.5, help="share of the period the p99 work may use")
+    parser.add_argument("--require", type=int, default=None, help="exit with status 1 unless this many talkers fit")
+    args = parser.parse_args()
+    CONSOLE.setLevel(logging.WARNING)
+
+    print(f"{args.seconds:.0f}s per measurement, {args.chunk_size} sample periods, up to {args.jitter:.0f}ms jitter, {psutil.cpu_count()} CPUs")
+    print(f"{'talkers':>7} {'underruns':>9} {'work p50':>9} {'work p99':>9} {'of period':>9} {'latency':>9} {'p99':>9} {'gaps':>9} {'CPU/talker':>10}")
+    capacity = 0
+    fits = True
+    for talkers in sorted(args.talkers):
+        underruns, work, latency, gaps, cpu, period = measure(talkers, args.seconds, args.jitter / 1000, args.chunk_size, args.priority)
+        p99 = np.percentile(work, 99)
+        print(f"{talkers:>7} {underruns:>9} {np.percentile(work, 50):>7.2f}ms {p99:>7.2f}ms {p99 / period * 100:>8.0f}%"
+              f" {latency.mean():>7.1f}ms {np.percentile(latency, 99):>7.1f}ms {gaps:>7.1f}ms {cpu / talkers * 100:>9.2f}%")
+        if underruns > 0 or p99 > period * args.headroom:
+            fits = False
+        if fits:
+            capacity = talkers
+    print(f"Capacity: {capacity} talkers (no underruns, p99 work within {args.headroom * 100:.0f}% of the {period:.1f}ms period)")
+    if args.require is not None and capacity < args.require:
+        print(f"FAIL: fewer than the {args.require} talkers required")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
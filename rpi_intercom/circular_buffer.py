@@ -9,17 +9,20 @@ class Buffer:
     which should be fast.  Or maybe I'm pre-optimizing.  Its not like I ran
     benchmarks.  
     """
-    def __init__(self, length: int):
+    def __init__(self, length: int, dtype=float):
         self.max_length: int = length
-        self.arr = np.zeros(self.max_length, dtype=np.float)
+        self.arr = np.zeros(self.max_length, dtype=dtype)
         self.start: int = 0
         self.length: int = 0
+        # Samples thrown away to make room for newer ones
+        self.overflowed_samples: int = 0
 
     def push(self, data: np.ndarray):
         from_start = 0
         from_length = len(data)
         if from_length >= self.max_length:
             # easy case, fill the whole array and reset
+            self.overflowed_samples += self.length + from_length - self.max_length
             self.arr[0:self.max_length] = data[-self.max_length:]
             self.start = 0
             self.length = self.max_length
@@ -28,6 +31,7 @@ class Buffer:
         # We might truncate from the end if we add all these items.  If so, adjust the array
         truncate = from_length + self.length - self.max_length
         if truncate > 0:
+            self.overflowed_samples += truncate
             self.length -= truncate
             self.start = (self.start + truncate) % self.max_length
 
@@ -45,7 +49,7 @@ class Buffer:
     def read(self, amount: int) -> np.ndarray:
         if amount > self.length:
             amount = self.length
-        ret = np.zeros(amount)
+        ret = np.zeros(amount, dtype=self.arr.dtype)
         first_end = amount + self.start
         first_length = amount
         if first_end > self.max_length:
@@ -1,13 +1,21 @@
 from dataclasses import dataclass
 from enum import Enum
-from typing import Any, Dict, List, Union
+from threading import Lock
+import copy
+from typing import Any, Dict, List, Set, Union
 from numpy import fromfile
-from schema import Schema, Optional, Or
+from schema import Schema, Optional, Or, And, Regex
+from .logger import getLogger
 import yaml
+import os
+import re
 import sys
+import tempfile
 import uuid
 import argparse
 
+logger = getLogger(__name__)
+
 class Options(Enum):
     SERVER = "server"
     PORT = "port"
@@ -24,6 +32,35 @@ class Options(Enum):
     SPEAKER = "speaker"
     MICROPHONE = "microphone"
     VOLUME = "volume"
+    OPUS_BITRATE = "opus_bitrate"
+    OPUS_FRAME_DURATION = "opus_frame_duration"
+    OPUS_COMPLEXITY = "opus_complexity"
+    OPUS_APPLICATION = "opus_application"
+    ADAPTIVE_BITRATE = "adaptive_bitrate"
+    MAX_TALKERS = "max_talkers"
+    AUDIO_ENGINE = "audio_engine"
+    REALTIME_PRIORITY = "realtime_priority"
+    REALTIME_POLICY = "realtime_policy"
+    AUDIO_CPUS = "audio_cpus"
+    PROCESS_CPUS = "process_cpus"
+    LOCK_MEMORY = "lock_memory"
+    STATUS_ENCODER = "status_encoder"
+    LOG_MODE = "log_mode"
+    LOG_HISTORY_FILE = "log_history_file"
+    LOG_HISTORY_SIZE = "log_history_size"
+    RECEIVING_HOLD = "receiving_hold"
+    RECEIVING_BLINK = "receiving_blink"
+    BUTTON_DEBOUNCE = "button_debounce"
+    PREROLL = "preroll"
+    PREROLL_CATCHUP = "preroll_catchup"
+    UDP_VOICE = "udp_voice"
+    WEB_PORT = "web_port"
+    ENDPOINTS = "endpoints"
+    RECORD_DIR = "record_dir"
+    RECORD_SEGMENT = "record_segment"
+    RECORD_MAX_SIZE = "record_max_size"
+    RECORD_MAX_AGE = "record_max_age"
+    RECORD_FSYNC = "record_fsync"
 
 class PinConfig(Enum):
     ACTION_TOOGLE_TRANSMIT = "toggle_transmit"
@@ -40,7 +77,7 @@ class PinConfig(Enum):
 PIN_SCHEMA = Schema(
     Or(*[value.value for value in PinConfig._member_map_.values()]))
 
-CONFIG_SCHEMA = Schema({
+OPTION_SCHEMAS = {
     Options.SERVER.value: str,
     Optional(Options.PORT.value): int,
     Optional(Options.NICKNAME.value): str,
@@ -56,6 +93,67 @@ CONFIG_SCHEMA = Schema({
     Optional(Options.SPEAKER.value): Or(int, str),
     Optional(Options.MICROPHONE.value): Or(int, str),
     Optional(Options.VOLUME.value): int,
+    Optional(Options.OPUS_BITRATE.value): int,
+    Optional(Options.OPUS_FRAME_DURATION.value): Or(10, 20, 40, 60),
+    Optional(Options.OPUS_COMPLEXITY.value): And(int, lambda n: 0 <= n <= 10),
+    Optional(Options.OPUS_APPLICATION.value): Or("voip", "audio", "restricted_lowdelay"),
+    Optional(Options.ADAPTIVE_BITRATE.value): bool,
+    Optional(Options.MAX_TALKERS.value): And(int, lambda n: n > 0),
+    Optional(Options.AUDIO_ENGINE.value): Or("thread", "process"),
+    Optional(Options.REALTIME_PRIORITY.value): And(int, lambda n: 0 <= n <= 99),
+    Optional(Options.REALTIME_POLICY.value): Or("fifo", "rr"),
+    Optional(Options.AUDIO_CPUS.value): str,
+    Optional(Options.PROCESS_CPUS.value): str,
+    Optional(Options.LOCK_MEMORY.value): bool,
+    Optional(Options.STATUS_ENCODER.value): Or("json", "orjson"),
+    Optional(Options.LOG_MODE.value): Or("queued", "direct"),
+    Optional(Options.LOG_HISTORY_FILE.value): str,
+    Optional(Options.LOG_HISTORY_SIZE.value): And(int, lambda n: n >= 4096),
+    Optional(Options.RECEIVING_HOLD.value): And(Or(int, float), lambda n: n >= 0),
+    Optional(Options.RECEIVING_BLINK.value): And(Or(int, float), lambda n: n >= 0),
+    Optional(Options.BUTTON_DEBOUNCE.value): Or(None, And(Or(int, float), lambda n: n >= 0)),
+    Optional(Options.PREROLL.value): And(Or(int, float), lambda n: 0 <= n <= 2),
+    Optional(Options.PREROLL_CATCHUP.value): And(Or(int, float), lambda n: 1 < n <= 1.5),
+    Optional(Options.UDP_VOICE.value): bool,
+    Optional(Options.WEB_PORT.value): And(int, lambda n: 0 < n < 65536),
+    Optional(Options.RECORD_DIR.value): str,
+    Optional(Options.RECORD_SEGMENT.value): And(Or(int, float), lambda n: n > 0),
+    Optional(Options.RECORD_MAX_SIZE.value): And(int, lambda n: n > 0),
+    Optional(Options.RECORD_MAX_AGE.value): And(Or(int, float), lambda n: n > 0),
+    Optional(Options.RECORD_FSYNC.value): bool,
+}
+
+# Options that belong to the whole process rather than to one endpoint
+PROCESS_OPTIONS = {
+    Options.RESTART_SECONDS,
+    Options.PROCESS_CPUS,
+    Options.LOCK_MEMORY,
+    Options.STATUS_ENCODER,
+    Options.LOG_MODE,
+    Options.LOG_HISTORY_FILE,
+    Options.LOG_HISTORY_SIZE,
+    Options.WEB_PORT,
+    Options.ENDPOINTS,
+}
+
+# An endpoint can set any option of its own, and has to be named
+# Endpoint names go into file names (eg recordings) and URLs, so keep them to safe characters
+ENDPOINT_NAME = Regex(r"^[A-Za-z0-9_][A-Za-z0-9_.-]*$", error="endpoint names can only have letters, numbers, '_', '.' and '-', and can't start with '.' or '-'")
+
+ENDPOINT_SCHEMA = Schema({
+    "name": And(str, ENDPOINT_NAME),
+    **{Optional(getattr(key, "schema", key)): value for key, value in OPTION_SCHEMAS.items() if Options(getattr(key, "schema", key)) not in PROCESS_OPTIONS},
+})
+
+
+def _uniqueNames(endpoints: List[Dict[str, Any]]) -> bool:
+    names = [endpoint["name"] for endpoint in endpoints]
+    return len(set(names)) == len(names)
+
+
+CONFIG_SCHEMA = Schema({
+    **OPTION_SCHEMAS,
+    Optional(Options.ENDPOINTS.value): And([ENDPOINT_SCHEMA], Schema(_uniqueNames, error="endpoints need unique names")),
 })
 
 DEFAULTS = {
@@ -74,11 +172,105 @@ DEFAULTS = {
     Options.SPEAKER: "default",
     Options.MICROPHONE: "default",
     Options.VOLUME: None,
+    Options.OPUS_BITRATE: 32000,
+    Options.OPUS_FRAME_DURATION: 20,
+    Options.OPUS_COMPLEXITY: None,
+    Options.OPUS_APPLICATION: "audio",
+    Options.ADAPTIVE_BITRATE: False,
+    Options.MAX_TALKERS: 16,
+    Options.AUDIO_ENGINE: "thread",
+    Options.REALTIME_PRIORITY: 0,
+    Options.REALTIME_POLICY: "fifo",
+    Options.AUDIO_CPUS: None,
+    Options.PROCESS_CPUS: None,
+    Options.LOCK_MEMORY: False,
+    Options.STATUS_ENCODER: "json",
+    Options.LOG_MODE: "queued",
+    Options.LOG_HISTORY_FILE: None,
+    Options.LOG_HISTORY_SIZE: 1 << 20,
+    Options.RECEIVING_HOLD: 0.3,
+    Options.RECEIVING_BLINK: 0,
+    Options.BUTTON_DEBOUNCE: None,
+    Options.PREROLL: 0.2,
+    Options.PREROLL_CATCHUP: 1.1,
+    Options.UDP_VOICE: True,
+    Options.WEB_PORT: 8000,
+    Options.ENDPOINTS: [],
+    Options.RECORD_DIR: None,
+    Options.RECORD_SEGMENT: 900,
+    Options.RECORD_MAX_SIZE: 1 << 30,
+    Options.RECORD_MAX_AGE: 7,
+    Options.RECORD_FSYNC: False,
+}
+
+# The name of the only endpoint when none are configured
+DEFAULT_ENDPOINT = "default"
+
+# Options that only take effect when the intercom is restarted, the rest are applied as
+# soon as the config is reloaded
+RESTART_OPTIONS = {
+    Options.SERVER,
+    Options.PORT,
+    Options.NICKNAME,
+    Options.PASSWORD,
+    Options.CERT_FILE,
+    Options.KEY_FILE,
+    Options.TOKENS,
+    Options.RESTART_SECONDS,
+    Options.CHUNK_SIZE,
+    Options.MAX_TALKERS,
+    Options.AUDIO_ENGINE,
+    Options.REALTIME_PRIORITY,
+    Options.REALTIME_POLICY,
+    Options.AUDIO_CPUS,
+    Options.PROCESS_CPUS,
+    Options.LOCK_MEMORY,
+    Options.STATUS_ENCODER,
+    Options.LOG_MODE,
+    Options.LOG_HISTORY_FILE,
+    Options.LOG_HISTORY_SIZE,
+    Options.UDP_VOICE,
+    Options.WEB_PORT,
+    Options.RECORD_DIR,
+    Options.RECORD_SEGMENT,
+    Options.RECORD_MAX_SIZE,
+    Options.RECORD_MAX_AGE,
+    Options.RECORD_FSYNC,
 }
 
+# Options the web UI changes, which are saved back to the config file
+SAVED_OPTIONS = (Options.VOLUME, Options.SPEAKER, Options.MICROPHONE)
+
+_SAVE_LOCK = Lock()
+
+
+def _setYamlValue(text: str, key: str, value: Any) -> str:
+    '''Replaces a top level key's value in YAML text, keeping any comment after it'''
+    line = yaml.safe_dump({key: value}, default_flow_style=True, width=1000)[1:-2]
+    pattern = re.compile(r"^" + re.escape(key) + r":[^#\n]*?(\s+#.*)?$", re.MULTILINE)
+    if pattern.search(text) is None:
+        return text + ("" if text.endswith("\n") or len(text) == 0 else "\n") + line + "\n"
+    return pattern.sub(lambda match: line + (match.group(1) or ""), text, count=1)
+
+
+def _writeAtomically(path: str, text: str):
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temporary = tempfile.mkstemp(prefix="." + os.path.basename(path), dir=directory)
+    try:
+        with os.fdopen(descriptor, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        # It may have a password in it, keep its permissions
+        os.chmod(temporary, os.stat(path).st_mode & 0o7777)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
 
 class Config:
-    def __init__(self, server: str = None, port: int = None, nickname: str = None, password:str = None, cert_file: str = None, key_file: str = None, channel: str = None, send_buffer_latency:float = None, tokens: List[str] = None, pins: Dict[str, PinConfig] = None, restart_seconds:int=None, chunk_size: int=None, speaker:Union[str, int]=None, microphone:Union[str, int]=None, volume:int=None):
+    def __init__(self, server: str = None, port: int = None, nickname: str = None, password:str = None, cert_file: str = None, key_file: str = None, channel: str = None, send_buffer_latency:float = None, tokens: List[str] = None, pins: Dict[str, PinConfig] = None, restart_seconds:int=None, chunk_size: int=None, speaker:Union[str, int]=None, microphone:Union[str, int]=None, volume:int=None, opus_bitrate:int=None, opus_frame_duration:int=None, opus_complexity:int=None, opus_application:str=None, adaptive_bitrate:bool=None, max_talkers:int=None, audio_engine:str=None, realtime_priority:int=None, realtime_policy:str=None, audio_cpus:str=None, process_cpus:str=None, lock_memory:bool=None, status_encoder:str=None, log_mode:str=None, log_history_file:str=None, log_history_size:int=None, receiving_hold:float=None, receiving_blink:float=None, button_debounce:float=None, preroll:float=None, preroll_catchup:float=None, udp_voice:bool=None, web_port:int=None, endpoints:List[Dict[str, Any]]=None, record_dir:str=None, record_segment:float=None, record_max_size:int=None, record_max_age:float=None, record_fsync:bool=None):
         self._server = server if server is not None else DEFAULTS[Options.SERVER]
         self._port = port if port is not None else DEFAULTS[Options.PORT]
         self._nickname = nickname if nickname is not None else DEFAULTS[Options.NICKNAME]
@@ -94,16 +286,164 @@ class Config:
         self._microphone = microphone if microphone is not None else DEFAULTS[Options.MICROPHONE]
         self._speaker = speaker if speaker is not None else DEFAULTS[Options.SPEAKER]
         self._volume = volume if volume is not None else DEFAULTS[Options.VOLUME]
+        self._opus_bitrate = opus_bitrate if opus_bitrate is not None else DEFAULTS[Options.OPUS_BITRATE]
+        self._opus_frame_duration = opus_frame_duration if opus_frame_duration is not None else DEFAULTS[Options.OPUS_FRAME_DURATION]
+        self._opus_complexity = opus_complexity if opus_complexity is not None else DEFAULTS[Options.OPUS_COMPLEXITY]
+        self._opus_application = opus_application if opus_application is not None else DEFAULTS[Options.OPUS_APPLICATION]
+        self._adaptive_bitrate = adaptive_bitrate if adaptive_bitrate is not None else DEFAULTS[Options.ADAPTIVE_BITRATE]
+        self._max_talkers = max_talkers if max_talkers is not None else DEFAULTS[Options.MAX_TALKERS]
+        self._audio_engine = audio_engine if audio_engine is not None else DEFAULTS[Options.AUDIO_ENGINE]
+        self._realtime_priority = realtime_priority if realtime_priority is not None else DEFAULTS[Options.REALTIME_PRIORITY]
+        self._realtime_policy = realtime_policy if realtime_policy is not None else DEFAULTS[Options.REALTIME_POLICY]
+        self._audio_cpus = audio_cpus if audio_cpus is not None else DEFAULTS[Options.AUDIO_CPUS]
+        self._process_cpus = process_cpus if process_cpus is not None else DEFAULTS[Options.PROCESS_CPUS]
+        self._lock_memory = lock_memory if lock_memory is not None else DEFAULTS[Options.LOCK_MEMORY]
+        self._status_encoder = status_encoder if status_encoder is not None else DEFAULTS[Options.STATUS_ENCODER]
+        self._log_mode = log_mode if log_mode is not None else DEFAULTS[Options.LOG_MODE]
+        self._log_history_file = log_history_file if log_history_file is not None else DEFAULTS[Options.LOG_HISTORY_FILE]
+        self._log_history_size = log_history_size if log_history_size is not None else DEFAULTS[Options.LOG_HISTORY_SIZE]
+        self._receiving_hold = receiving_hold if receiving_hold is not None else DEFAULTS[Options.RECEIVING_HOLD]
+        self._receiving_blink = receiving_blink if receiving_blink is not None else DEFAULTS[Options.RECEIVING_BLINK]
+        self._button_debounce = button_debounce if button_debounce is not None else DEFAULTS[Options.BUTTON_DEBOUNCE]
+        self._preroll = preroll if preroll is not None else DEFAULTS[Options.PREROLL]
+        self._preroll_catchup = preroll_catchup if preroll_catchup is not None else DEFAULTS[Options.PREROLL_CATCHUP]
+        self._udp_voice = udp_voice if udp_voice is not None else DEFAULTS[Options.UDP_VOICE]
+        self._web_port = web_port if web_port is not None else DEFAULTS[Options.WEB_PORT]
+        self._endpoints = endpoints if endpoints is not None else DEFAULTS[Options.ENDPOINTS]
+        self._name = None
+        self._record_dir = record_dir if record_dir is not None else DEFAULTS[Options.RECORD_DIR]
+        self._record_segment = record_segment if record_segment is not None else DEFAULTS[Options.RECORD_SEGMENT]
+        self._record_max_size = record_max_size if record_max_size is not None else DEFAULTS[Options.RECORD_MAX_SIZE]
+        self._record_max_age = record_max_age if record_max_age is not None else DEFAULTS[Options.RECORD_MAX_AGE]
+        self._record_fsync = record_fsync if record_fsync is not None else DEFAULTS[Options.RECORD_FSYNC]
+        self._path = None
+        self._mtime = None
+        # The config an endpoint's config was made from, which is the one that's reloaded
+        self._parent: 'Config' = None
+
+    @property
+    def path(self) -> str:
+        '''The file this was loaded from, if any'''
+        return self._path
+
+    @property
+    def mtime(self) -> int:
+        '''When the file was last modified, as of loading or saving it'''
+        return self._mtime
+
+    def set_mtime(self, value: int):
+        self._mtime = value
+
+    def diff(self, other: 'Config') -> Set[Options]:
+        '''The options whose values differ between this config and another'''
+        return {option for option in Options if getattr(self, option.value) != getattr(other, option.value)}
+
+    def update(self, other: 'Config', options: Set[Options]):
+        '''Takes the given options' values from another config'''
+        for option in options:
+            setattr(self, "_" + option.value, getattr(other, option.value))
 
     def dirty(self):
-        # TODO: save the config back
-        pass
+        '''
+        Saves the settings that can be changed from the web UI back to the config file, if
+        there is one.  The file is replaced atomically so a crash can't leave it half
+        written, and only the changed lines are rewritten so comments are kept.
+        '''
+        if self._path is None:
+            return
+        with _SAVE_LOCK:
+            try:
+                with open(self._path) as f:
+                    text = f.read()
+                data = yaml.safe_load(text) or {}
+                values = {option.value: getattr(self, option.value) for option in SAVED_OPTIONS if getattr(self, option.value) is not None}
+                section = self._savedSection(data)
+                if section is None or all(section.get(key) == value for key, value in values.items()):
+                    return
+                section.update(values)
+                if section is data:
+                    for key, value in values.items():
+                        text = _setYamlValue(text, key, value)
+                if section is not data or yaml.safe_load(text) != data:
+                    # Too unusual, or too deeply nested, to edit line by line
+                    text = yaml.safe_dump(data, sort_keys=False)
+                _writeAtomically(self._path, text)
+                self._mtime = os.stat(self._path).st_mtime_ns
+                if self._parent is not None:
+                    self._parent._saved(self._name if section is not data else None, values, self._mtime)
+            except (OSError, yaml.YAMLError) as e:
+                logger.error(f"Unable to save settings to {self._path}: {e}")
+
+    def _saved(self, endpoint: str, values: Dict[str, Any], mtime: int):
+        '''Keeps up with an endpoint's save, so it isn't mistaken for the file being edited'''
+        if endpoint is None:
+            for key, value in values.items():
+                setattr(self, "_" + key, value)
+        else:
+            self._endpoints = [dict(entry, **values) if entry.get("name") == endpoint else entry for entry in self._endpoints]
+        self._mtime = mtime
+
+    def _savedSection(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        '''Where this config's settings go in the file'''
+        endpoints = data.get(Options.ENDPOINTS.value) or []
+        for endpoint in endpoints:
+            if endpoint.get("name") == self._name:
+                return endpoint
+        return data if len(endpoints) == 0 else None
 
     @classmethod
-    def fromFile(cls, path):
+    def fromFile(cls, path: str) -> 'Config':
         with open(path) as f:
+            mtime = os.fstat(f.fileno()).st_mtime_ns
             config = yaml.safe_load(f)
-        return Config(config)
+        CONFIG_SCHEMA.validate(config)
+        loaded = Config(server=config.get(Options.SERVER.value), 
+                        port=config.get(Options.PORT.value), 
+                        nickname=config.get(Options.NICKNAME.value), 
+                        password=config.get(Options.PASSWORD.value), 
+                        cert_file=config.get(Options.CERT_FILE.value), 
+                        key_file=config.get(Options.KEY_FILE.value), 
+                        channel=config.get(Options.CHANNEL.value),
+                        send_buffer_latency=config.get(Options.SEND_BUFFER_LATENCY.value),
+                        pins=config.get(Options.PINS.value), 
+                        tokens=config.get(Options.TOKENS.value),
+                        restart_seconds=config.get(Options.RESTART_SECONDS.value),
+                        chunk_size=config.get(Options.CHUNK_SIZE.value),
+                        microphone=config.get(Options.MICROPHONE.value),
+                        speaker=config.get(Options.SPEAKER.value),
+                        volume=config.get(Options.VOLUME.value),
+                        opus_bitrate=config.get(Options.OPUS_BITRATE.value),
+                        opus_frame_duration=config.get(Options.OPUS_FRAME_DURATION.value),
+                        opus_complexity=config.get(Options.OPUS_COMPLEXITY.value),
+                        opus_application=config.get(Options.OPUS_APPLICATION.value),
+                        adaptive_bitrate=config.get(Options.ADAPTIVE_BITRATE.value),
+                        max_talkers=config.get(Options.MAX_TALKERS.value),
+                        audio_engine=config.get(Options.AUDIO_ENGINE.value),
+                        realtime_priority=config.get(Options.REALTIME_PRIORITY.value),
+                        realtime_policy=config.get(Options.REALTIME_POLICY.value),
+                        audio_cpus=config.get(Options.AUDIO_CPUS.value),
+                        process_cpus=config.get(Options.PROCESS_CPUS.value),
+                        lock_memory=config.get(Options.LOCK_MEMORY.value),
+                        status_encoder=config.get(Options.STATUS_ENCODER.value),
+                        log_mode=config.get(Options.LOG_MODE.value),
+                        log_history_file=config.get(Options.LOG_HISTORY_FILE.value),
+                        log_history_size=config.get(Options.LOG_HISTORY_SIZE.value),
+                        receiving_hold=config.get(Options.RECEIVING_HOLD.value),
+                        receiving_blink=config.get(Options.RECEIVING_BLINK.value),
+                        button_debounce=config.get(Options.BUTTON_DEBOUNCE.value),
+                        preroll=config.get(Options.PREROLL.value),
+                        preroll_catchup=config.get(Options.PREROLL_CATCHUP.value),
+                        udp_voice=config.get(Options.UDP_VOICE.value),
+                        web_port=config.get(Options.WEB_PORT.value),
+                        endpoints=config.get(Options.ENDPOINTS.value),
+                        record_dir=config.get(Options.RECORD_DIR.value),
+                        record_segment=config.get(Options.RECORD_SEGMENT.value),
+                        record_max_size=config.get(Options.RECORD_MAX_SIZE.value),
+                        record_max_age=config.get(Options.RECORD_MAX_AGE.value),
+                        record_fsync=config.get(Options.RECORD_FSYNC.value))
+        loaded._path = path
+        loaded._mtime = mtime
+        return loaded
 
     @property
     def server(self):
@@ -174,6 +514,158 @@ class Config:
     def set_volume(self, value: int):
         self._volume = value
 
+    @property
+    def opus_bitrate(self) -> int:
+        return self._opus_bitrate
+
+    @property
+    def opus_frame_duration(self) -> int:
+        return self._opus_frame_duration
+
+    @property
+    def opus_complexity(self) -> int:
+        return self._opus_complexity
+
+    @property
+    def opus_application(self) -> str:
+        return self._opus_application
+
+    @property
+    def adaptive_bitrate(self) -> bool:
+        return self._adaptive_bitrate
+
+    @property
+    def max_talkers(self) -> int:
+        return self._max_talkers
+
+    @property
+    def audio_engine(self) -> str:
+        return self._audio_engine
+
+    @property
+    def realtime_priority(self) -> int:
+        return self._realtime_priority
+
+    @property
+    def realtime_policy(self) -> str:
+        return self._realtime_policy
+
+    @property
+    def audio_cpus(self) -> str:
+        return self._audio_cpus
+
+    @property
+    def process_cpus(self) -> str:
+        return self._process_cpus
+
+    @property
+    def lock_memory(self) -> bool:
+        return self._lock_memory
+
+    @property
+    def status_encoder(self) -> str:
+        return self._status_encoder
+
+    @property
+    def log_mode(self) -> str:
+        return self._log_mode
+
+    @property
+    def log_history_file(self) -> str:
+        return self._log_history_file
+
+    @property
+    def log_history_size(self) -> int:
+        return self._log_history_size
+
+    @property
+    def receiving_hold(self) -> float:
+        return self._receiving_hold
+
+    @property
+    def receiving_blink(self) -> float:
+        return self._receiving_blink
+
+    @property
+    def button_debounce(self) -> float:
+        return self._button_debounce
+
+    @property
+    def preroll(self) -> float:
+        return self._preroll
+
+    @property
+    def preroll_catchup(self) -> float:
+        return self._preroll_catchup
+
+    @property
+    def udp_voice(self) -> bool:
+        return self._udp_voice
+
+    @property
+    def web_port(self) -> int:
+        return self._web_port
+
+    @property
+    def endpoints(self) -> List[Dict[str, Any]]:
+        return self._endpoints
+
+    @property
+    def name(self) -> str:
+        '''Which endpoint this is the config for, None for the top level config'''
+        return self._name
+
+    def endpointConfigs(self) -> List['Config']:
+        '''
+        A config for each endpoint, with the options it sets over the top of this config's.
+        Unless it sets its own nickname it gets this one with its name on the end, since
+        mumble won't let two users have the same one, and unless it sets its own audio_cpus
+        it gets one of this config's, in turn.  Without any endpoints there's just the one,
+        named DEFAULT_ENDPOINT.
+        '''
+        # Imported here since realtime needs this module
+        from .realtime import spreadCpus
+        entries = self._endpoints if len(self._endpoints) > 0 else [{"name": DEFAULT_ENDPOINT}]
+        cpus = [self._audio_cpus] * len(entries)
+        if self._audio_cpus is not None and len(entries) > 1:
+            try:
+                cpus = spreadCpus(str(self._audio_cpus), len(entries))
+            except ValueError:
+                # Realtime will complain about it
+                pass
+        configs = []
+        for entry, audio_cpus in zip(entries, cpus):
+            config = copy.copy(self)
+            config._endpoints = []
+            config._audio_cpus = audio_cpus
+            config._parent = self
+            for key, value in entry.items():
+                setattr(config, "_" + key, value)
+            if len(self._endpoints) > 0 and Options.NICKNAME.value not in entry:
+                config._nickname = f"{self._nickname}_{entry['name']}"
+            configs.append(config)
+        return configs
+
+    @property
+    def record_dir(self) -> str:
+        return self._record_dir
+
+    @property
+    def record_segment(self) -> float:
+        return self._record_segment
+
+    @property
+    def record_max_size(self) -> int:
+        return self._record_max_size
+
+    @property
+    def record_max_age(self) -> float:
+        return self._record_max_age
+
+    @property
+    def record_fsync(self) -> bool:
+        return self._record_fsync
+
     @classmethod
     def fromArgs(cls):
         parser = argparse.ArgumentParser()
@@ -204,30 +696,69 @@ class Config:
         parser.add_argument("--microphone", required=False,
                             help="The microphone device to use for sound input.  Can be either the ALSA device name (a string) or a device index (an integer)", default=None)
         parser.add_argument("--chunk_size", required=False,
-                            help="Size of the chunk in bytes that speaker or microphone output/input is processed.  Must be a power of 2.", default=None)
+                            help="Size of the chunk in samples that speaker or microphone output/input is processed.  Must be a power of 2 or a multiple of 480 (10ms).", type=int, default=None)
         parser.add_argument("--volume", required=False,
                             help="The initial volume, from 0 to 100, to set the speaker to.", default=None)
+        parser.add_argument("--opus_bitrate", required=False, type=int,
+                            help="The bitrate, in bits per second, to encode microphone audio at.", default=None)
+        parser.add_argument("--opus_frame_duration", required=False, type=int, choices=[10, 20, 40, 60],
+                            help="The duration in milliseconds of each encoded audio packet.  Shorter is lower latency, longer uses less bandwidth.", default=None)
+        parser.add_argument("--opus_complexity", required=False, type=int, choices=range(11),
+                            help="Opus encoder complexity from 0 to 10.  Lower values use less CPU, which helps on a Raspberry Pi Zero.", default=None)
+        parser.add_argument("--opus_application", required=False, choices=["voip", "audio", "restricted_lowdelay"],
+                            help="The opus application mode.  'voip' is tuned for speech, 'restricted_lowdelay' has the lowest latency.", default=None)
+        parser.add_argument("--adaptive_bitrate", required=False, action="store_true",
+                            help="Lower the bitrate and send longer packets when audio backs up in the send buffer instead of dropping it.", default=None)
+        parser.add_argument("--max_talkers", required=False, type=int,
+                            help="The most people that can be heard talking at once.", default=None)
+        parser.add_argument("--audio_engine", required=False, choices=["thread", "process"],
+                            help="Where to run the sound devices.  'process' runs them in a dedicated process so they don't compete with the rest of the intercom for the GIL.", default=None)
+        parser.add_argument("--realtime_priority", required=False, type=int, choices=range(100),
+                            help="Real-time priority from 1 to 99 for the audio threads, or 0 to leave them at normal priority.  Needs CAP_SYS_NICE or an RLIMIT_RTPRIO, see install-service.", default=None)
+        parser.add_argument("--realtime_policy", required=False, choices=["fifo", "rr"],
+                            help="The real-time scheduling policy for the audio threads when realtime_priority is set.", default=None)
+        parser.add_argument("--audio_cpus", required=False,
+                            help="CPUs to pin the audio threads to, eg '3' or '2-3'.", default=None)
+        parser.add_argument("--process_cpus", required=False,
+                            help="CPUs to pin the rest of the intercom to, eg '0-2'.", default=None)
+        parser.add_argument("--lock_memory", required=False, action="store_true",
+                            help="Lock the intercom's memory with mlockall so the audio threads never wait on a page fault.", default=None)
+        parser.add_argument("--status_encoder", required=False, choices=["json", "orjson"],
+                            help="How to encode messages to the web UI.  orjson is faster if it's installed.", default=None)
+        parser.add_argument("--log_mode", required=False, choices=["queued", "direct"],
+                            help="'queued' writes logs from a background thread so logging never holds up the audio threads, 'direct' writes them from the thread that logged.", default=None)
+        parser.add_argument("--log_history_file", required=False,
+                            help="A file to keep log history in so it survives restarts.  Kept in memory if not set.", default=None)
+        parser.add_argument("--log_history_size", required=False, type=int,
+                            help="How many bytes of log history to keep.", default=None)
+        parser.add_argument("--receiving_hold", required=False, type=float,
+                            help="How long the receiving LED stays on after audio stops, in seconds", default=None)
+        parser.add_argument("--receiving_blink", required=False, type=float,
+                            help="If set, the receiving LED blinks with this period in seconds instead of staying on", default=None)
+        parser.add_argument("--button_debounce", required=False, type=float,
+                            help="How long a button has to settle before a press or release counts, in seconds", default=None)
+        parser.add_argument("--preroll", required=False, type=float,
+                            help="Seconds of audio from before speech or a transmit press to send when the gate opens, 0 turns it off", default=None)
+        parser.add_argument("--preroll_catchup", required=False, type=float,
+                            help="How much faster than real time pre-rolled audio is sent until it catches up", default=None)
+        parser.add_argument("--udp_voice", required=False, action=argparse.BooleanOptionalAction,
+                            help="Send voice over encrypted UDP when the server can be reached that way, instead of only through the TCP connection.", default=None)
+        parser.add_argument("--web_port", required=False, type=int,
+                            help="The port the web interface listens on", default=None)
+        parser.add_argument("--record_dir", required=False,
+                            help="A directory to record what the intercom sends and plays into", default=None)
+        parser.add_argument("--record_segment", required=False, type=float,
+                            help="Seconds of audio in each recording file", default=None)
+        parser.add_argument("--record_max_size", required=False, type=int,
+                            help="The most bytes of recordings to keep", default=None)
+        parser.add_argument("--record_max_age", required=False, type=float,
+                            help="The most days to keep recordings for", default=None)
+        parser.add_argument("--record_fsync", required=False, action=argparse.BooleanOptionalAction,
+                            help="Sync recordings to disk after every write rather than only when a file is finished", default=None)
         args = parser.parse_args()
 
         if args.config is not None:
-            with open(args.config) as f:
-                config = yaml.safe_load(f)
-                CONFIG_SCHEMA.validate(config)
-                return Config(server=config.get(Options.SERVER.value), 
-                            port=config.get(Options.PORT.value), 
-                            nickname=config.get(Options.NICKNAME.value), 
-                            password=config.get(Options.PASSWORD.value), 
-                            cert_file=config.get(Options.CERT_FILE.value), 
-                            key_file=config.get(Options.KEY_FILE.value), 
-                            channel=config.get(Options.CHANNEL.value),
-                            send_buffer_latency=config.get(Options.SEND_BUFFER_LATENCY.value),
-                            pins=config.get(Options.PINS.value), 
-                            tokens=config.get(Options.TOKENS.value),
-                            restart_seconds=config.get(Options.RESTART_SECONDS.value),
-                            chunk_size=config.get(Options.CHUNK_SIZE.value),
-                            microphone=config.get(Options.MICROPHONE.value),
-                            speaker=config.get(Options.SPEAKER.value),
-                            volume=config.get(Options.VOLUME.value))
+            return cls.fromFile(args.config)
         else:
             return Config(server=args.server, 
                 port=args.port, 
@@ -242,7 +773,35 @@ class Config:
                 chunk_size=args.chunk_size,
                 microphone=args.microphone,
                 speaker=args.speaker,
-                volume=args.volume)
+                volume=args.volume,
+                opus_bitrate=args.opus_bitrate,
+                opus_frame_duration=args.opus_frame_duration,
+                opus_complexity=args.opus_complexity,
+                opus_application=args.opus_application,
+                adaptive_bitrate=args.adaptive_bitrate,
+                max_talkers=args.max_talkers,
+                audio_engine=args.audio_engine,
+                realtime_priority=args.realtime_priority,
+                realtime_policy=args.realtime_policy,
+                audio_cpus=args.audio_cpus,
+                process_cpus=args.process_cpus,
+                lock_memory=args.lock_memory,
+                status_encoder=args.status_encoder,
+                log_mode=args.log_mode,
+                log_history_file=args.log_history_file,
+                log_history_size=args.log_history_size,
+                receiving_hold=args.receiving_hold,
+                receiving_blink=args.receiving_blink,
+                button_debounce=args.button_debounce,
+                preroll=args.preroll,
+                preroll_catchup=args.preroll_catchup,
+                udp_voice=args.udp_voice,
+                web_port=args.web_port,
+                record_dir=args.record_dir,
+                record_segment=args.record_segment,
+                record_max_size=args.record_max_size,
+                record_max_age=args.record_max_age,
+                record_fsync=args.record_fsync)
 
     def get(self, key):
         if key in self.data:
@@ -1,88 +1,106 @@
-from typing import List
-from .config import Config, PinConfig
+from typing import List, Set
+from .config import Config, Options, PinConfig
 from gpiozero import Button, LED, GPIODevice
+from .indicator import Indicator, INDICATOR_INTERVAL_SECONDS
 from .logger import getLogger
+from .status import StatusBus
+from .worker import Worker
 
 logger = getLogger(__name__)
-DEBOUNCE_SECONDS = None
+
+INDICATOR_TASK = "indicators"
 
 class Control:
     '''
     Allows control over the intercom using properties.
     '''
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, status: StatusBus = None, worker: Worker = None):
         self._config = config
+        self._status = status if status is not None else StatusBus()
         self._buttons: List[GPIODevice] = []
         self._transmitting = True
         self._deafened = False
         self._muted = False
         self._connected = False
-        self._recieving = False
 
-        self._transmitting_controls: List[LED] = []
-        self._muted_controls: List[LED] = []
-        self._deafened_controls: List[LED] = []
-        self._connected_controls: List[LED] = []
-        self._recieving_controls: List[LED] = []
+        # LEDs are driven from the indicator task, never the thread that changed the state
+        self._own_worker = worker is None
+        self._worker = worker if worker is not None else Worker("Indicators")
+        self._indicator_task = (INDICATOR_TASK, id(self))
+        self._transmitting_indicator = Indicator("transmitting")
+        self._deafened_indicator = Indicator("deafened")
+        self._connected_indicator = Indicator("connected")
+        self._recieving_indicator = Indicator("receiving", hold=config.receiving_hold, blink=config.receiving_blink, changed=self._receiving_changed)
+        self._indicators = [self._transmitting_indicator, self._deafened_indicator, self._connected_indicator, self._recieving_indicator]
 
     def start(self):
         '''
         Starts listening for events on configured GPIO pins and using
         them control the intercom.
         '''
+        self._bindPins()
+        if self._own_worker:
+            self._worker.start()
+        self._worker.every(INDICATOR_INTERVAL_SECONDS, self._updateIndicators, key=self._indicator_task)
+
+    def reconfigure(self, changed: Set[Options]):
+        '''Applies a reloaded config.  Pins are rebound on the indicator task, between LED updates.'''
+        if Options.RECEIVING_HOLD in changed or Options.RECEIVING_BLINK in changed:
+            self._worker.submit(0, lambda: self._recieving_indicator.configure(self._config.receiving_hold, self._config.receiving_blink))
+        if Options.PINS in changed or Options.BUTTON_DEBOUNCE in changed:
+            self._worker.submit(0, self._rebindPins)
+
+    def _rebindPins(self):
+        logger.info("Rebinding GPIO pins")
+        self._releasePins()
+        # Back to how the intercom behaves without buttons, in case they were removed
+        self.transmitting = True
+        self.deafened = False
+        self._bindPins()
+
+    def _bindPins(self):
         assigments = self._config.pins
+        debounce = self._config.button_debounce
         for pin in assigments:
             value = assigments[pin]
             if value == PinConfig.ACTION_HOLD_TO_TRANSMIT.value:
-                button = Button(pin, bounce_time=DEBOUNCE_SECONDS)
+                button = Button(pin, bounce_time=debounce)
                 button.when_activated = lambda: self.__set_transmitting(True)
                 button.when_deactivated = lambda: self.__set_transmitting(False)
                 self._buttons.append(button)
-                self._transmitting = button.is_active
+                self.transmitting = button.is_active
             elif value == PinConfig.ACTION_TOOGLE_TRANSMIT.value:
-                button = Button(pin, bounce_time=DEBOUNCE_SECONDS)
+                button = Button(pin, bounce_time=debounce)
                 button.when_activated = lambda: self.__set_transmitting(not self.transmitting)
                 self._buttons.append(button)
-                self._transmitting = button.is_active
+                self.transmitting = button.is_active
             elif value == PinConfig.ACTION_HOLD_TO_DEAFEN.value:
-                button = Button(pin, bounce_time=DEBOUNCE_SECONDS)
+                button = Button(pin, bounce_time=debounce)
                 button.when_activated = lambda: self.__set_deafened(True)
                 button.when_deactivated = lambda: self.__set_deafened(False)
                 self._buttons.append(button)
-                self._deafened = button.is_active
+                self.deafened = button.is_active
             elif value == PinConfig.ACTION_TOOGLE_DEAFEN.value:
-                button = Button(pin, bounce_time=DEBOUNCE_SECONDS)
+                button = Button(pin, bounce_time=debounce)
                 button.when_activated = lambda: self.__set_deafened(not self.deafened)
                 self._buttons.append(button)
-                self._deafened = button.is_active
+                self.deafened = button.is_active
 
             elif value == PinConfig.STATUS_TRANSMITTING.value:
-                self._transmitting_controls.append(LED(pin))
+                self._transmitting_indicator.add(LED(pin))
             elif value == PinConfig.STATUS_CONNECTED.value:
-                self._connected_controls.append(LED(pin))
+                self._connected_indicator.add(LED(pin))
             elif value == PinConfig.STATUS_DEAFENED.value:
-                self._deafened_controls.append(LED(pin))
+                self._deafened_indicator.add(LED(pin))
             elif value == PinConfig.STATUS_RECIEVING.value:
-                self._recieving_controls.append(LED(pin))
-
-        for led in self._transmitting_controls:
-            if self._transmitting:
-                led.on()
-            else:
-                led.off()
-
-        for led in self._connected_controls:
-            led.off()
+                self._recieving_indicator.add(LED(pin))
 
+        self._transmitting_indicator.set(self._transmitting)
+        self._connected_indicator.set(self._connected)
+        self._deafened_indicator.set(self._deafened)
+        self._recieving_indicator.set(False)
 
-        for led in self._deafened_controls:
-            if self._deafened:
-                led.on()
-            else:
-                led.off()
-
-        for led in self._recieving_controls:
-            led.off()
+        self._status.publish(transmitting=self._transmitting, deafened=self._deafened, receiving=False, connected=self._connected)
 
     def __set_deafened(self, value):
         self.deafened = value
@@ -94,25 +112,28 @@ class Control:
         '''
         Stops listening on GPIO pins for evetns.
         '''
+        if self._own_worker:
+            self._worker.stop()
+        else:
+            self._worker.cancel(self._indicator_task)
+        self._releasePins()
+        for indicator in self._indicators:
+            indicator.close()
+
+    def _releasePins(self):
         for button in self._buttons:
             button.close()
-        for led in self._connected_controls:
-            led.off()
-            led.close()
-        for led in self._transmitting_controls:
-            led.off()
-            led.close()
-        for led in self._deafened_controls:
-            led.off()
-            led.close()
-        for led in self._recieving_controls:
-            led.off()
-            led.close()
         self._buttons = []
-        self._connected_controls = []
-        self._transmitting_controls = []
-        self._deafened_controls = []
-        self._recieving_controls = []
+        for indicator in self._indicators:
+            indicator.release()
+
+    def _updateIndicators(self):
+        for indicator in self._indicators:
+            indicator.update()
+
+    def _receiving_changed(self, value: bool):
+        # Published once the indicator has settled, so flickering audio doesn't flood the web UI
+        self._status.publish(receiving=value)
 
     @property
     def transmitting(self) -> bool:
@@ -126,13 +147,13 @@ class Control:
         if not self.transmitting and value:
             logger.info("Started transmitting")
             self._transmitting = True
-            for led in self._transmitting_controls:
-                led.on()
+            self._transmitting_indicator.active = True
+            self._status.publish(transmitting=True)
         elif self.transmitting and not value:
             logger.info("Stopped transmitting")
             self._transmitting = False
-            for led in self._transmitting_controls:
-                led.off()
+            self._transmitting_indicator.active = False
+            self._status.publish(transmitting=False)
 
     @property
     def deafened(self) -> bool:
@@ -146,13 +167,13 @@ class Control:
         if not self._deafened and value:
             logger.info("Started deafening")
             self._deafened = True
-            for led in self._deafened_controls:
-                led.on()
+            self._deafened_indicator.active = True
+            self._status.publish(deafened=True)
         elif self._deafened and not value:
             logger.info("Stopped deafening")
             self._deafened = False
-            for led in self._deafened_controls:
-                led.off()
+            self._deafened_indicator.active = False
+            self._status.publish(deafened=False)
 
 
     @property
@@ -160,18 +181,12 @@ class Control:
         '''
         When true, indicates that audio information has been recieved from the mumble server and is being played on the local speakers.
         ''' 
-        return self._recieving
+        return self._recieving_indicator.active
 
     @recieving.setter
     def recieving(self, value: bool):
-        if not self._recieving and value:
-            self._recieving = True
-            for led in self._recieving_controls:
-                led.on()
-        elif self._recieving and not value:
-            self._recieving = False
-            for led in self._recieving_controls:
-                led.off()
+        # Set every period from the speaker thread, so this must stay a plain flag write
+        self._recieving_indicator.active = value
 
     @property
     def connected(self) -> bool:
@@ -182,11 +197,11 @@ class Control:
 
     def _set_connected(self):
         self._connected = True
-        for led in self._connected_controls:
-            led.on()
+        self._connected_indicator.active = True
+        self._status.publish(connected=True)
 
     def _set_disconnected(self):
         self._connected = False
-        for led in self._connected_controls:
-            led.off()
+        self._connected_indicator.active = False
+        self._status.publish(connected=False)
     
\ No newline at end of file
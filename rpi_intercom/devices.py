@@ -5,10 +5,13 @@ import time
 import alsaaudio as alsa
 from .config import Config, DEFAULTS, Options
 from .shutdown import Shutdown
-from typing import Dict, List
+from typing import Dict, List, Set
 from datetime import datetime, timedelta
 from .logger import getLogger
 from .worker import Worker
+from .preroll import PreRoll
+from .rechunk import periodSize
+from .status import StatusBus
 import numpy as np
 import samplerate
 from datetime import datetime, timezone, timedelta
@@ -23,11 +26,18 @@ DATA_LENGTH = 2 # Length of a single-channel sample in bytes
 AUDIO_DATA_TYPE = np.dtype(np.int16).newbyteorder('<')
 VAD_MINIMUM = 0.5
 VAD_DELAY = 0.5
+# How often the devices are checked and reopened, and the mixer volume synced
+CHECK_INTERVAL_SECONDS = 5
+VOLUME_INTERVAL_SECONDS = 1
+# Worker task keys
+CHECK_TASK = "check"
+VOLUME_TASK = "volume"
 
 class Devices():
-    def __init__(self, config: Config, shutdown: Shutdown):
+    def __init__(self, config: Config, shutdown: Shutdown, status: StatusBus = None, worker: Worker = None):
         self._start = datetime.now()
         self._config = config
+        self._status = status if status is not None else StatusBus()
         self._speaker: alsa.PCM = None
         self._microphone: alsa.PCM = None
         self._devices:Dict[int, List[str]] = {}
@@ -38,7 +48,11 @@ class Devices():
         self._input_pcms: List[str] = alsa.pcms(alsa.PCM_CAPTURE)
         self._output_pcms: List[str] = alsa.pcms(alsa.PCM_PLAYBACK)
         self._cards = alsa.cards()
-        self._worker = Worker("Device Check")
+        # Endpoints in the same process can share a worker, so task keys are our own
+        self._own_worker = worker is None
+        self._worker = worker if worker is not None else Worker("Device Check")
+        self._check_task = (CHECK_TASK, id(self))
+        self._volume_task = (VOLUME_TASK, id(self))
         self._reset_speaker = False
         self._reset_microphone = False
         self._microphone_resampler = None
@@ -55,13 +69,22 @@ class Devices():
         self._vad_last_activated = datetime.now()
         self._vad_active = False
         self._vad_queue = collections.deque(maxlen=10)
+        self._preroll = PreRoll(self._config.preroll, self._config.preroll_catchup) if self._config.preroll > 0 else None
         self._set_volume = False
         self._current_volume = 0
+        # Counted from the audio threads, the same way as FakeDevices, so the audio engine
+        # process can send them back for the metrics
+        self.stats = {
+            'microphone_overruns': 0,
+            'microphone_discarded': 0,
+            'microphone_errors': 0,
+            'speaker_errors': 0,
+            'microphone_resets': 0,
+            'speaker_resets': 0,
+        }
 
         # determine chunk size
-        self._chunk_size = int(math.pow(2, int(math.log2(self._config.chunk_size))))
-        if self._chunk_size < 128:
-            self._chunk_size = 128
+        self._chunk_size = periodSize(self._config.chunk_size)
 
     def list(self):
         print("Identified speaker devices:")
@@ -107,11 +130,11 @@ class Devices():
 
     def resetMic(self):
         self._reset_microphone = True
-        self._worker.trigger()
+        self._worker.trigger(self._check_task)
 
     def resetSpeaker(self):
         self._reset_speaker = True
-        self._worker.trigger()
+        self._worker.trigger(self._check_task)
 
     def set_volume(self, level: int):
         if level < 0:
@@ -121,20 +144,36 @@ class Devices():
         self._config.set_volume(level)
         self._set_volume = True
         self._config.dirty()
-        self._worker.trigger()
+        self._worker.trigger(self._volume_task)
 
     def set_speaker(self, speaker):
         logger.info(f"Setting speaker device to {speaker}")
         self._config.set_speaker(speaker)
+        self._config.dirty()
         self.resetSpeaker()
 
     def set_microphone(self, microphone):
         logger.info(f"Setting microphone device to {microphone}")
         self._config.set_microphone(microphone)
+        self._config.dirty()
         self.resetMic()
 
-    def _checkLoop(self):
-        delay = 5
+    def reconfigure(self, changed: Set[Options]):
+        '''Applies a reloaded config, reopening only the devices that changed'''
+        if Options.PREROLL in changed or Options.PREROLL_CATCHUP in changed:
+            self._preroll = PreRoll(self._config.preroll, self._config.preroll_catchup) if self._config.preroll > 0 else None
+        if Options.VOLUME in changed and self._config.volume is not None:
+            self._set_volume = True
+            self._worker.trigger(self._volume_task)
+        if Options.SPEAKER in changed:
+            logger.info(f"Setting speaker device to {self._config.speaker}")
+            self.resetSpeaker()
+        if Options.MICROPHONE in changed:
+            logger.info(f"Setting microphone device to {self._config.microphone}")
+            self.resetMic()
+
+    def _checkDevices(self):
+        reopen = False
         try:
             mic_name, card, mic_common_name = self._validateDeviceArgs(self._config.microphone, self._input_pcms)
             if self._microphone is None and mic_name is not None and not self._shutdown.shutting_down:
@@ -170,7 +209,8 @@ class Devices():
                     pass
                 self._microphone = None
                 logger.info("Closed microphone")
-                delay = 0
+                self.stats['microphone_resets'] += 1
+                reopen = True
             self._reset_microphone = None
 
             speaker_name, card, speaker_common_name = self._validateDeviceArgs(self._config.speaker, self._output_pcms)
@@ -217,9 +257,16 @@ class Devices():
                 self._current_volume = None
                 self._close(dev)
                 logger.info("Closed speaker")
-                delay = 0 
+                self.stats['speaker_resets'] += 1
+                reopen = True
             self._reset_speaker = False
+        finally:
+            self._status.publish(speaker=self._choosen_speaker, microphone=self._choosen_microphone)
+            if reopen:
+                self._worker.trigger(self._check_task)
 
+    def _syncVolume(self):
+        try:
             if self._set_volume and self._config.volume is not None:
                 if self._mixer is not None:
                     self._mixer.setvolume(self._config.volume)
@@ -232,10 +279,10 @@ class Devices():
                 self._current_volume = self._mixer.getvolume()[0]
                 if self._current_volume != self._config.volume and self._config.volume is not None:
                     logger.info(f"Volume was changed to {self._current_volume}%")
-                    self._config.volume = self._current_volume
+                    self._config.set_volume(self._current_volume)
                     self._config.dirty()
         finally:
-            self._worker.submit(delay, self._checkLoop)
+            self._status.publish(volume=self._current_volume)
 
     @property
     def volume(self):
@@ -267,12 +314,18 @@ class Devices():
         raise Exception(f"'{dev_name}' does not identify a valid sound device")
 
     def start(self):
-        self._worker.start()
-        self._worker.submit(0, self._checkLoop)
+        if self._own_worker:
+            self._worker.start()
+        self._worker.every(CHECK_INTERVAL_SECONDS, self._checkDevices, key=self._check_task)
+        self._worker.every(VOLUME_INTERVAL_SECONDS, self._syncVolume, key=self._volume_task)
         logger.info(f"Using a device chunk size of {self._chunk_size} bytes")
 
     def stop(self):
-        self._worker.stop()
+        if self._own_worker:
+            self._worker.stop()
+        else:
+            self._worker.cancel(self._check_task)
+            self._worker.cancel(self._volume_task)
         if self._speaker is not None:
             device = self._speaker
             self._speaker = None
@@ -302,6 +355,7 @@ class Devices():
             self._speaker.write((output * 32768).astype(AUDIO_DATA_TYPE).tobytes())
         except (Exception, alsa.ALSAAudioError) as e:
             if not self._shutdown.shutting_down:
+                self.stats['speaker_errors'] += 1
                 logger.error("Speaker reported an exception:")
                 logger.printException(e)
                 self.resetSpeaker()
@@ -309,6 +363,7 @@ class Devices():
     def microphone_read(self):
         length, data = self._microphone_read()
         self._vad_queue.append(self._vad)
+        self._status.publish(vad=self.vad)
         return length, data
 
     def _microphone_read(self):
@@ -321,13 +376,14 @@ class Devices():
                 start = datetime.now(timezone.utc)
                 length, data =  self._microphone.read()
                 if length < 0 and datetime.now(timezone.utc) > self._microphone_start + timedelta(seconds=10):
-                    logger.warn("Buffer overrun from the microphone")
+                    self.stats['microphone_overruns'] += 1
+                    logger.warningLimited("Buffer overrun from the microphone")
                     length = -1
                     continue
                 duration = datetime.now(timezone.utc) - start
                 expected_seconds = length / (self._microphone_sample_rate * DATA_LENGTH * self._microphone_channels)
                 if duration.total_seconds() < expected_seconds * 0.5:
-                    logger.debug(f"Expected microphone read to take {int(expected_seconds*1000000)} us, but it took {int(duration.total_seconds()*1000000)} us")
+                    logger.debugLimited("Expected microphone read to take %d us, but it took %d us", int(expected_seconds*1000000), int(duration.total_seconds()*1000000))
                     length = -1
                     continue
             channels = int(len(data) / length / DATA_LENGTH)
@@ -352,20 +408,27 @@ class Devices():
             if max > 1:
                 # I'm not sure why this happens, but when it does the speaker just outputs
                 # an ungly square wave sound.  Ignore it for now.
+                self.stats['microphone_discarded'] += 1
                 data = np.zeros(len(current)).astype(AUDIO_DATA_TYPE).tobytes()
-            elif datetime.now() - self._vad_last_activated < timedelta(seconds=VAD_DELAY):
-                if not self._vad_active:
-                    self._vad_active = True
-                    logger.info("Sound detected")
-                data = (current * 32768).astype(AUDIO_DATA_TYPE).tobytes()
             else:
-                if self._vad_active:
-                    self._vad_active = False
+                active = datetime.now() - self._vad_last_activated < timedelta(seconds=VAD_DELAY)
+                if active and not self._vad_active:
+                    logger.info("Sound detected")
+                elif not active and self._vad_active:
                     logger.info("No sound detected")
-                data = np.zeros(len(current)).astype(AUDIO_DATA_TYPE).tobytes()
+                self._vad_active = active
+                data = (current * 32768).astype(AUDIO_DATA_TYPE).tobytes()
+                if self._preroll is not None:
+                    # Starts with the audio from just before the sound was detected
+                    data = self._preroll.process(data, active)
+                elif not active:
+                    data = None
+                if data is None:
+                    data = np.zeros(len(current)).astype(AUDIO_DATA_TYPE).tobytes()
             return length, data
         except (Exception, alsa.ALSAAudioError) as e:
             if not self._shutdown.shutting_down:
+                self.stats['microphone_errors'] += 1
                 logger.error("Microphone reported an exception:")
                 logger.printException(e)
                 self.resetMic()
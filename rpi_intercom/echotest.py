@@ -6,7 +6,7 @@ class EchoTest():
     def __init__(self):
         self.sound_callback = None
 
-    def transmit(self, chunk):
+    def transmit(self, chunk, held=False):
         if self.sound_callback:
             self.sound_callback(chunk)
 
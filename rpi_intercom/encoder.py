@@ -0,0 +1,122 @@
+from dataclasses import dataclass, replace
+from typing import List, Optional
+from .config import Config
+
+# Opus frame durations (in milliseconds) that pymumble can pack into a packet
+FRAME_DURATIONS = [10, 20, 40, 60]
+
+# Never let the adaptive controller go below this bitrate, speech becomes unintelligible
+MIN_BITRATE = 12000
+
+# Each step down the adaptive ladder multiplies the bitrate by this much
+BITRATE_STEP = 0.75
+
+# Backlog thresholds, as a fraction of send_buffer_latency, that step the profile down or up
+HIGH_WATERMARK = 0.4
+LOW_WATERMARK = 0.1
+
+# How long to wait between steps.  Stepping down is quick to avoid dropping audio, stepping
+# back up is slow so a flaky network doesn't make the profile flap.
+STEP_DOWN_SECONDS = 0.5
+STEP_UP_SECONDS = 5
+
+HIGH = "high"
+LOW = "low"
+
+# The lowest bitrate opus encodes speech at, even when the server asks for less
+OPUS_MIN_BITRATE = 6000
+
+
+def protocolOverhead(audio_per_packet: float, encoder_framesize: float) -> int:
+    '''
+    Bits per second of headers on the voice packets, which count against the server's
+    bandwidth limit.  Worked out like pymumble does, assuming voice is tunnelled over TCP
+    since it can fall back to that at any time.
+    '''
+    # IP, TCP and tunnel headers plus a few bytes for each opus frame in the packet
+    per_packet = 20 + 20 + 6 + 3 * int(audio_per_packet / encoder_framesize)
+    return int(per_packet * 8 / audio_per_packet)
+
+
+@dataclass(frozen=True)
+class EncoderProfile:
+    '''
+    Settings for the opus encoder pymumble uses to send microphone audio.
+    '''
+    bitrate: int
+    frame_duration: int
+    complexity: Optional[int] = None
+
+    @property
+    def audio_per_packet(self) -> float:
+        '''The frame duration in seconds, as pymumble expects it'''
+        return self.frame_duration / 1000
+
+    @classmethod
+    def fromConfig(cls, config: Config):
+        return EncoderProfile(bitrate=config.opus_bitrate, frame_duration=config.opus_frame_duration, complexity=config.opus_complexity)
+
+
+class AdaptiveBitrate:
+    '''
+    Trades audio quality for latency when the send buffer backs up.  While the backlog stays
+    high the encoder profile is stepped down a ladder of lower bitrates and longer frames
+    (fewer, bigger packets), and once it drains the profile is walked back up to the
+    configured one.  This degrades smoothly where clearing the buffer would drop audio.
+    '''
+    def __init__(self, profile: EncoderProfile, latency: float):
+        self._levels = self._buildLevels(profile)
+        self._level = 0
+        self._high = latency * HIGH_WATERMARK
+        self._low = latency * LOW_WATERMARK
+        self._condition: Optional[str] = None
+        self._since = 0.0
+
+    @property
+    def profile(self) -> EncoderProfile:
+        return self._levels[self._level]
+
+    @property
+    def level(self) -> int:
+        return self._level
+
+    def update(self, backlog: float, now: float) -> Optional[EncoderProfile]:
+        '''
+        Feed the current send buffer backlog (in seconds).  Returns the profile to switch
+        to if it should change, or None if the current one should be kept.
+        '''
+        if backlog > self._high:
+            condition = HIGH
+        elif backlog < self._low:
+            condition = LOW
+        else:
+            condition = None
+        if condition != self._condition:
+            # Steps only count the time the backlog has stayed on the same side of the thresholds
+            self._condition = condition
+            self._since = now
+        elapsed = now - self._since
+        if condition == HIGH and self._level < len(self._levels) - 1 and elapsed >= STEP_DOWN_SECONDS:
+            self._level += 1
+        elif condition == LOW and self._level > 0 and elapsed >= STEP_UP_SECONDS:
+            self._level -= 1
+        else:
+            return None
+        # Another step needs the backlog to stay high or low for as long again
+        self._since = now
+        return self.profile
+
+    def reset(self) -> EncoderProfile:
+        self._level = 0
+        self._condition = None
+        return self.profile
+
+    def _buildLevels(self, profile: EncoderProfile) -> List[EncoderProfile]:
+        levels = [profile]
+        durations = [d for d in FRAME_DURATIONS if d > profile.frame_duration]
+        current = profile
+        while current.bitrate > MIN_BITRATE or len(durations) > 0:
+            frame_duration = durations.pop(0) if len(durations) > 0 else current.frame_duration
+            current = replace(current, bitrate=max(MIN_BITRATE, int(current.bitrate * BITRATE_STEP)), frame_duration=frame_duration)
+            levels.append(current)
+        return levels
@@ -0,0 +1,106 @@
+from .config import Config, RESTART_OPTIONS
+from .control import Control
+from .devices import Devices
+from .engine import ProcessDevices
+from .levels import Levels
+from .logger import getLogger
+from .metrics import METRICS, roomOf
+from .mumble import Mumble
+from .recorder import Recorder, recorderAvailable
+from .shutdown import Shutdown
+from .sound import Sound
+from .status import StatusBus
+from .web_audio import WebAudio
+from .worker import Worker
+
+logger = getLogger(__name__)
+
+# Counts from the sound devices' stats, which come from the audio engine process when
+# there is one, as intercom_<key>_total
+DEVICE_COUNTERS = {
+    'microphone_overruns': "Microphone audio the sound card threw away because it wasn't read in time",
+    'microphone_discarded': "Microphone chunks replaced with silence because they were out of range",
+    'microphone_errors': "Errors reading from the microphone",
+    'speaker_errors': "Errors writing to the speaker",
+    'speaker_underruns': "Times the speaker ran out of audio to play",
+    'microphone_resets': "Times the microphone was closed to be reopened",
+    'speaker_resets': "Times the speaker was closed to be reopened",
+    'speaker_ring_underruns': "Periods the audio engine played silence because the intercom fell behind",
+    'microphone_ring_overflows': "Times the intercom fell behind reading microphone audio from the audio engine",
+    'engine_logs_dropped': "Log messages from the audio engine dropped because they couldn't be sent back fast enough",
+}
+
+
+class Endpoint():
+    '''
+    One room: a speaker and microphone, the mumble user they talk as, and the controls,
+    status and web audio that go with them.  The Intercom runs one for each configured
+    endpoint, sharing its workers, web server and shutdown between them.
+
+    `devices` replaces the sound devices the config asks for, eg with FakeDevices.  With
+    audio_engine: process every endpoint starts its own audio engine process.
+    '''
+    def __init__(self, config: Config, shutdown: Shutdown, device_worker: Worker = None, indicator_worker: Worker = None, devices=None):
+        self._config = config
+        self.status = StatusBus()
+        self.levels = Levels()
+        self.control = Control(config, self.status, worker=indicator_worker)
+        if devices is not None:
+            self.devices = devices
+        elif config.audio_engine == "process":
+            self.devices = ProcessDevices(config, shutdown, status=self.status)
+        else:
+            self.devices = Devices(config, shutdown, self.status, worker=device_worker)
+        self.mumble = Mumble(self.control, config, shutdown, self.status)
+        self.sound = Sound(self.devices, self.mumble, self.control, config, self.levels)
+        self.web_audio = WebAudio(self.sound, self.status, self.devices.chunk_size)
+        self.recorder = None
+        if config.record_dir is not None:
+            if recorderAvailable():
+                self.recorder = Recorder(config)
+                self.mumble.addTransmitTap(self.recorder.transmitted)
+                self.sound.addOutputTap(self.recorder.played)
+            else:
+                logger.error(f"Recording needs opuslib and libopus, '{roomOf(config)}' won't be recorded")
+        for key, help in DEVICE_COUNTERS.items():
+            METRICS.counter(f"intercom_{key}_total", help, source=lambda key=key: self.devices.stats.get(key), room=roomOf(config))
+
+    @property
+    def name(self) -> str:
+        return self._config.name
+
+    @property
+    def config(self) -> Config:
+        return self._config
+
+    def start(self):
+        self.control.start()
+        self.mumble.start()
+        self.devices.start()
+        if self.recorder is not None:
+            self.recorder.start()
+        self.sound.start()
+
+    def stop(self):
+        self.status.stop()
+        self.levels.stop()
+        self.mumble.stop()
+        self.sound.stop()
+        if self.recorder is not None:
+            self.recorder.stop()
+        self.devices.stop()
+        self.control.stop()
+
+    def reconfigure(self, config: Config):
+        '''Applies this endpoint's part of a reloaded config'''
+        changed = self._config.diff(config)
+        restart = changed & RESTART_OPTIONS
+        if len(restart) > 0:
+            logger.warning(f"Restart the intercom for changes to {', '.join(sorted(option.value for option in restart))} in '{self.name}' to take effect")
+        changed = changed - restart
+        if len(changed) == 0:
+            return
+        self._config.update(config, changed)
+        self.control.reconfigure(changed)
+        self.devices.reconfigure(changed)
+        self.mumble.reconfigure(changed)
@@ -0,0 +1,433 @@
+import logging
+import multiprocessing
+import queue
+import time
+from multiprocessing import shared_memory
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, List, Set
+import numpy as np
+from .config import Config, Options
+from .rechunk import periodSize, RATE, AUDIO_DATA_TYPE
+from .logger import getLogger, CONSOLE, ATTACHABLE, DISPATCHER
+from .realtime import Realtime
+from .status import StatusBus
+
+logger = getLogger(__name__)
+
+# How much audio the rings between the processes can hold, in periods
+RING_PERIODS = 64
+
+# How often the engine process reports its status
+STATUS_INTERVAL = 0.1
+
+# Log records waiting to go back to the intercom, more than this are dropped
+LOG_QUEUE_SIZE = 1000
+
+# Ring header layout, in uint32s
+WRITE = 0
+READ = 1
+OVERFLOWS = 2
+UNDERFLOWS = 3
+HEADER_LENGTH = 4
+INDEX_MASK = 0xFFFFFFFF
+
+
+class SharedRing:
+    """
+    A single-producer/single-consumer ring of 16 bit PCM in shared memory, for passing
+    audio between processes without locks.  Works like SpscBuffer, but the read and write
+    positions live in the shared header as 32 bit counters (which are written atomically
+    even on a Pi Zero) that are allowed to wrap, so the length is rounded up to a power
+    of 2.
+    """
+    def __init__(self, length: int = None, name: str = None):
+        if name is None:
+            self.max_length = 1 << (length - 1).bit_length()
+            self._shm = shared_memory.SharedMemory(create=True, size=(HEADER_LENGTH * 4) + self.max_length * 2)
+            self._owner = True
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            self.max_length = (self._shm.size - HEADER_LENGTH * 4) // 2
+            self._owner = False
+        self._header = np.ndarray((HEADER_LENGTH,), dtype=np.uint32, buffer=self._shm.buf)
+        self.arr = np.ndarray((self.max_length,), dtype=AUDIO_DATA_TYPE, buffer=self._shm.buf, offset=HEADER_LENGTH * 4)
+        if self._owner:
+            self._header[:] = 0
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @property
+    def length(self) -> int:
+        return (int(self._header[WRITE]) - int(self._header[READ])) & INDEX_MASK
+
+    @property
+    def overflows(self) -> int:
+        return int(self._header[OVERFLOWS])
+
+    @property
+    def underflows(self) -> int:
+        return int(self._header[UNDERFLOWS])
+
+    def push(self, data: np.ndarray) -> int:
+        write = int(self._header[WRITE])
+        free = self.max_length - ((write - int(self._header[READ])) & INDEX_MASK)
+        amount = len(data)
+        if amount > free:
+            self._header[OVERFLOWS] += 1
+            amount = free
+        start = write % self.max_length
+        first = min(amount, self.max_length - start)
+        self.arr[start:start + first] = data[:first]
+        self.arr[0:amount - first] = data[first:amount]
+        self._header[WRITE] = (write + amount) & INDEX_MASK
+        return amount
+
+    def pop(self, amount: int) -> np.ndarray:
+        read = int(self._header[READ])
+        available = (int(self._header[WRITE]) - read) & INDEX_MASK
+        if amount > available:
+            self._header[UNDERFLOWS] += 1
+            amount = available
+        ret = np.empty(amount, dtype=AUDIO_DATA_TYPE)
+        start = read % self.max_length
+        first = min(amount, self.max_length - start)
+        ret[0:first] = self.arr[start:start + first]
+        ret[first:] = self.arr[0:amount - first]
+        self._header[READ] = (read + amount) & INDEX_MASK
+        return ret
+
+    def close(self):
+        self._header = None
+        self.arr = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+def createDevices(config: Config, shutdown):
+    # Only the engine process needs ALSA
+    from .devices import Devices
+    return Devices(config, shutdown)
+
+
+class _EngineShutdown():
+    def __init__(self):
+        self.shutting_down = False
+
+
+class _Engine():
+    '''
+    Runs in the engine process.  Owns the sound devices and moves audio between them and
+    the shared rings on its own threads, under its own GIL.
+    '''
+    def __init__(self, config: Config, factory, microphone_ring: str, speaker_ring: str, conn):
+        self._config = config
+        self._factory = factory
+        self._conn = conn
+        self._send_lock = Lock()
+        self._shutdown = _EngineShutdown()
+        self._devices = None
+        self._microphone_ring = SharedRing(name=microphone_ring)
+        self._speaker_ring = SharedRing(name=speaker_ring)
+        self._running = True
+        self._speaker_underruns = 0
+        self._realtime = Realtime(config)
+        # Logging from the audio threads only queues the record, sending it could block
+        self._logs: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+        self._logs_dropped = 0
+        self._logs_done = False
+
+    def send(self, message):
+        with self._send_lock:
+            self._conn.send(message)
+
+    def forwardLog(self, record: logging.LogRecord):
+        # Arguments and exceptions might not pickle, so send the finished message
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        try:
+            self._logs.put_nowait(record)
+        except queue.Full:
+            self._logs_dropped += 1
+
+    def _logLoop(self):
+        while not self._logs_done or not self._logs.empty():
+            try:
+                record = self._logs.get(timeout=STATUS_INTERVAL)
+            except queue.Empty:
+                continue
+            try:
+                self.send(("log", record))
+            except (OSError, ValueError):
+                pass
+
+    def run(self):
+        # Memory locks aren't inherited by a new process
+        if self._config.lock_memory:
+            self._realtime.lockMemory()
+        self._devices = self._factory(self._config, self._shutdown)
+        self._devices.start()
+        threads = [
+            Thread(target=self._microphoneLoop, name="Microphone Thread", daemon=True),
+            Thread(target=self._speakerLoop, name="Speaker Thread", daemon=True),
+        ]
+        log_thread = Thread(target=self._logLoop, name="Engine Log Forwarder", daemon=True)
+        log_thread.start()
+        for thread in threads:
+            thread.start()
+        try:
+            while self._running:
+                if self._conn.poll(STATUS_INTERVAL):
+                    self._command(*self._conn.recv())
+                self.send(("status", self._status()))
+        except (EOFError, OSError):
+            # The intercom went away
+            pass
+        finally:
+            self._running = False
+            self._shutdown.shutting_down = True
+            for thread in threads:
+                thread.join()
+            self._devices.stop()
+            self._microphone_ring.close()
+            self._speaker_ring.close()
+            # Last, so what stopping the devices logged still goes back
+            self._logs_done = True
+            log_thread.join()
+
+    def _command(self, command: str, *args):
+        if command == "stop":
+            self._running = False
+        elif command == "reset_microphone":
+            self._devices.resetMic()
+        elif command == "reset_speaker":
+            self._devices.resetSpeaker()
+        elif command == "set_volume":
+            self._devices.set_volume(*args)
+        elif command == "set_speaker":
+            self._devices.set_speaker(*args)
+        elif command == "set_microphone":
+            self._devices.set_microphone(*args)
+        elif command == "reconfigure":
+            config, changed = args
+            self._config.update(config, changed)
+            self._devices.reconfigure(changed)
+
+    def _status(self) -> Dict[str, Any]:
+        stats = dict(getattr(self._devices, "stats", {}))
+        stats['speaker_ring_underruns'] = self._speaker_underruns
+        stats['microphone_ring_overflows'] = self._microphone_ring.overflows
+        stats['engine_logs_dropped'] = self._logs_dropped
+        return {
+            'vad': self._devices.vad,
+            'volume': self._devices.volume,
+            'devices': self._devices._devices,
+            'speaker': self._devices._choosen_speaker,
+            'microphone': self._devices._choosen_microphone,
+            'stats': stats,
+        }
+
+    def _microphoneLoop(self):
+        self._realtime.promoteThread()
+        while self._running:
+            _length, chunk = self._devices.microphone_read()
+            if chunk is not None:
+                self._microphone_ring.push(np.frombuffer(chunk, dtype=AUDIO_DATA_TYPE))
+            else:
+                time.sleep(0.1)
+
+    def _speakerLoop(self):
+        self._realtime.promoteThread()
+        chunk_size = self._devices.chunk_size
+        playing = False
+        while self._running:
+            data = self._speaker_ring.pop(chunk_size)
+            if len(data) < chunk_size:
+                if playing:
+                    # The intercom didn't keep up, play silence rather than miss the card's deadline
+                    self._speaker_underruns += 1
+                playing = False
+                data = np.concatenate((data, np.zeros(chunk_size - len(data), dtype=AUDIO_DATA_TYPE)))
+            else:
+                playing = True
+            self._devices.speaker_write(data.astype(float) / 32768)
+
+
+def _engineMain(config: Config, factory, microphone_ring: str, speaker_ring: str, conn):
+    engine = None
+    try:
+        # Log records go back to the intercom, which writes them to the console, the
+        # history and the web UI
+        CONSOLE.setLevel(logging.CRITICAL + 1)
+        engine = _Engine(config, factory, microphone_ring, speaker_ring, conn)
+        ATTACHABLE.attachRecords(engine.forwardLog)
+        engine.run()
+    except KeyboardInterrupt:
+        pass
+
+
+class ProcessDevices():
+    '''
+    Runs the sound devices in a dedicated process so capture and playback don't have to
+    compete for the GIL with pymumble, the web server and logging.  Audio goes between the
+    processes through SharedRings and control messages over a pipe.  This presents the
+    same interface as Devices, so Sound and Server don't know the difference.
+
+    The speaker ring holds `periods` periods of audio ahead of the card to absorb stalls
+    in this process, which adds that much playback latency.
+    '''
+    def __init__(self, config: Config, shutdown, factory: Callable[[Config, Any], Any] = createDevices, periods: int = 4, status: StatusBus = None):
+        self._config = config
+        self._status = status if status is not None else StatusBus()
+        self._shutdown = shutdown
+        self._factory = factory
+        self._chunk_size = periodSize(config.chunk_size)
+        self._period = self._chunk_size / RATE
+        self._periods = periods
+        self._process = None
+        self._conn = None
+        self._reader: Thread = None
+        self._microphone_ring: SharedRing = None
+        self._speaker_ring: SharedRing = None
+        self._running = False
+        self._vad = 0
+        self._current_volume = None
+        self._devices: Dict[int, List[str]] = {}
+        self._choosen_speaker = None
+        self._choosen_microphone = None
+        self.stats: Dict[str, int] = {}
+
+    def start(self):
+        self._microphone_ring = SharedRing(self._chunk_size * RING_PERIODS)
+        self._speaker_ring = SharedRing(self._chunk_size * RING_PERIODS)
+        context = multiprocessing.get_context("spawn")
+        self._conn, child_conn = context.Pipe()
+        self._process = context.Process(
+            target=_engineMain,
+            args=(self._config, self._factory, self._microphone_ring.name, self._speaker_ring.name, child_conn),
+            name="Audio Engine",
+            daemon=True)
+        self._running = True
+        self._process.start()
+        self._reader = Thread(target=self._readLoop, name="Audio Engine Reader", daemon=True)
+        self._reader.start()
+        logger.info(f"Started the audio engine process (pid {self._process.pid}) with a chunk size of {self._chunk_size}")
+
+    def stop(self):
+        # Still cleans up after an engine that exited by itself
+        if self._process is None:
+            return
+        self._running = False
+        self._send("stop")
+        self._process.join(timeout=5)
+        if self._process.is_alive():
+            logger.warning("Audio engine didn't stop, killing it")
+            self._process.kill()
+            self._process.join()
+        self._reader.join()
+        self._conn.close()
+        self._microphone_ring.close()
+        self._speaker_ring.close()
+        self._process = None
+
+    def _send(self, *message):
+        try:
+            self._conn.send(message)
+        except (OSError, ValueError):
+            pass
+
+    def _readLoop(self):
+        while self._running or self._conn.poll():
+            try:
+                if not self._conn.poll(0.5):
+                    continue
+                kind, data = self._conn.recv()
+            except (EOFError, OSError):
+                break
+            if kind == "status":
+                self._vad = data['vad']
+                self._current_volume = data['volume']
+                self._devices = data['devices']
+                self._choosen_speaker = data['speaker']
+                self._choosen_microphone = data['microphone']
+                self.stats = data['stats']
+                self._status.publish(vad=self._vad, volume=self._current_volume, speaker=self._choosen_speaker, microphone=self._choosen_microphone)
+            elif kind == "log":
+                DISPATCHER.handle(data)
+        if self._running and not self._shutdown.shutting_down:
+            # Don't leave Sound waiting on rings nobody is serving, and let the service
+            # manager start the intercom over rather than staying deaf and mute
+            logger.error("The audio engine process exited unexpectedly, shutting down")
+            self._running = False
+            self._shutdown.shutdown()
+
+    @property
+    def chunk_size(self):
+        return self._chunk_size
+
+    @property
+    def frame_length(self):
+        return self.chunk_size * 2
+
+    @property
+    def vad(self):
+        return self._vad
+
+    @property
+    def volume(self):
+        return self._current_volume
+
+    def resetMic(self):
+        self._send("reset_microphone")
+
+    def resetSpeaker(self):
+        self._send("reset_speaker")
+
+    def set_volume(self, level: int):
+        if level < 0:
+            level = 0
+        if level > 100:
+            level = 100
+        self._config.set_volume(level)
+        self._config.dirty()
+        self._send("set_volume", level)
+
+    def set_speaker(self, speaker):
+        self._config.set_speaker(speaker)
+        self._config.dirty()
+        self._send("set_speaker", speaker)
+
+    def set_microphone(self, microphone):
+        self._config.set_microphone(microphone)
+        self._config.dirty()
+        self._send("set_microphone", microphone)
+
+    def reconfigure(self, changed: Set[Options]):
+        # The engine has its own copy of the config
+        self._send("reconfigure", self._config, changed)
+
+    def microphone_read(self):
+        while self._running:
+            missing = self._chunk_size - self._microphone_ring.length
+            if missing <= 0:
+                return self._chunk_size, self._microphone_ring.pop(self._chunk_size).tobytes()
+            # Sleep until the engine should have captured enough.  Waking up to poll costs a
+            # trip through the GIL every time.
+            time.sleep(missing / RATE)
+        return None, None
+
+    def speaker_write(self, data) -> None:
+        if not self._running:
+            # Take as long as a card would, so the speaker thread doesn't spin
+            time.sleep(self._period)
+            return
+        # Block like a sound card would once there is enough audio queued up
+        while self._running:
+            excess = self._speaker_ring.length - self._chunk_size * (self._periods - 1)
+            if excess <= 0:
+                break
+            time.sleep(excess / RATE)
+        self._speaker_ring.push((np.clip(data, -1, 1) * 32767).astype(AUDIO_DATA_TYPE))
@@ -0,0 +1,120 @@
+import time
+from typing import Callable, Dict
+import numpy as np
+from .config import Config
+from .rechunk import periodSize, RATE, AUDIO_DATA_TYPE
+
+
+class FakeDevices():
+    '''
+    Stands in for Devices without any sound hardware, for benchmarks and tests.  It keeps
+    time like a sound card would: microphone_read() blocks until the next period has been
+    "captured" and speaker_write() blocks while the playback buffer is full.  Falling
+    behind by more than the hardware buffer counts as a microphone overrun or a speaker
+    underrun, which is exactly the deadline a real card would have missed.
+
+    source(samples) can supply microphone audio (16 bit PCM bytes), and on_play(data, when)
+    is called with every chunk written to the speaker and the perf_counter() time the
+    card would start playing it.
+    '''
+    def __init__(self, config: Config, shutdown=None, periods: int = 2, source: Callable[[int], bytes] = None, on_play: Callable[[np.ndarray, float], None] = None):
+        self._config = config
+        self._chunk_size = periodSize(config.chunk_size)
+        self._period = self._chunk_size / RATE
+        self._periods = periods
+        self._source = source
+        self._on_play = on_play
+        self._microphone_start = None
+        self._microphone_periods = 0
+        self._speaker_start = None
+        self._speaker_periods = 0
+        self._devices: Dict[int, list] = {0: ["Fake", "0", "Fake sound card"]}
+        self._choosen_speaker = "Fake"
+        self._choosen_microphone = "Fake"
+        self.stats = {
+            'microphone_periods': 0,
+            'microphone_overruns': 0,
+            'speaker_periods': 0,
+            'speaker_underruns': 0,
+        }
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    @property
+    def chunk_size(self):
+        return self._chunk_size
+
+    @property
+    def frame_length(self):
+        return self.chunk_size * 2
+
+    @property
+    def vad(self):
+        return 0
+
+    @property
+    def volume(self):
+        return None
+
+    def resetMic(self):
+        self._microphone_start = None
+
+    def resetSpeaker(self):
+        self._speaker_start = None
+
+    def set_volume(self, level: int):
+        pass
+
+    def set_speaker(self, speaker):
+        pass
+
+    def set_microphone(self, microphone):
+        pass
+
+    def reconfigure(self, changed):
+        pass
+
+    def microphone_read(self):
+        now = time.perf_counter()
+        if self._microphone_start is None:
+            self._microphone_start = now
+            self._microphone_periods = 0
+        ready = self._microphone_start + (self._microphone_periods + 1) * self._period
+        if now < ready:
+            time.sleep(ready - now)
+        elif now - ready > self._periods * self._period:
+            # The capture buffer filled up and the card threw audio away
+            self.stats['microphone_overruns'] += 1
+            self._microphone_periods = int((now - self._microphone_start) / self._period) - 1
+        self._microphone_periods += 1
+        self.stats['microphone_periods'] += 1
+        if self._source is not None:
+            data = self._source(self._chunk_size)
+        else:
+            data = np.zeros(self._chunk_size, dtype=AUDIO_DATA_TYPE).tobytes()
+        return self._chunk_size, data
+
+    def speaker_write(self, data) -> None:
+        now = time.perf_counter()
+        if self._speaker_start is None:
+            self._speaker_start = now
+            self._speaker_periods = 0
+        played = int((now - self._speaker_start) / self._period)
+        if played > self._speaker_periods:
+            # The card ran out of audio to play, start over like ALSA does after an xrun
+            self.stats['speaker_underruns'] += 1
+            self._speaker_start = now
+            self._speaker_periods = 0
+            played = 0
+        if self._speaker_periods - played >= self._periods:
+            # Wait for the card to make room
+            time.sleep(self._speaker_start + (self._speaker_periods - self._periods + 1) * self._period - now)
+        when = self._speaker_start + self._speaker_periods * self._period
+        self._speaker_periods += 1
+        self.stats['speaker_periods'] += 1
+        if self._on_play is not None:
+            self._on_play(data, when)
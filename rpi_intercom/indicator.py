@@ -0,0 +1,107 @@
+from threading import Lock
+from time import monotonic
+from typing import Callable, List, Optional
+from .logger import getLogger
+
+logger = getLogger(__name__)
+
+# How often indicators check for changes
+INDICATOR_INTERVAL_SECONDS = 0.02
+
+
+class Indicator():
+    '''
+    The state shown on a set of LEDs.  Anything can set `active` from any thread, it's a
+    single attribute write, and update() (run periodically by Control's indicator task)
+    applies it to the LEDs.
+
+    A change has to last `on_delay` seconds (turning on) or `hold` seconds (turning off)
+    before it's shown, so audio that stops and starts many times a second keeps the LED
+    steadily on.  With a `blink` period the LEDs blink while active instead of staying on.
+    '''
+    def __init__(self, name: str, leds: List = None, on_delay: float = 0, hold: float = 0, blink: float = 0, changed: Optional[Callable[[bool], None]] = None):
+        self._name = name
+        self._leds = leds if leds is not None else []
+        self._on_delay = on_delay
+        self._hold = hold
+        self._blink = blink
+        self._changed = changed
+        self._lock = Lock()
+        self._shown = False
+        self._pending_since: Optional[float] = None
+        self._closed = False
+        self.active = False
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def shown(self) -> bool:
+        '''What the LEDs are currently showing'''
+        return self._shown
+
+    def add(self, led):
+        self._leds.append(led)
+
+    def configure(self, hold: float, blink: float):
+        with self._lock:
+            self._hold = hold
+            self._blink = blink
+            if self._shown and not self._closed:
+                self._apply(True)
+
+    def release(self):
+        '''Turns off and closes the LEDs, leaving the indicator to have new ones added'''
+        with self._lock:
+            self._shown = False
+            self._pending_since = None
+            for led in self._leds:
+                led.off()
+                led.close()
+            self._leds = []
+
+    def update(self, now: Optional[float] = None):
+        active = self.active
+        now = monotonic() if now is None else now
+        with self._lock:
+            if self._closed:
+                return
+            if active == self._shown:
+                self._pending_since = None
+                return
+            if self._pending_since is None:
+                self._pending_since = now
+            if now - self._pending_since < (self._on_delay if active else self._hold):
+                return
+            self._pending_since = None
+            self._apply(active)
+        if self._changed is not None:
+            self._changed(active)
+
+    def _apply(self, active: bool):
+        self._shown = active
+        for led in self._leds:
+            try:
+                if not active:
+                    led.off()
+                elif self._blink > 0:
+                    led.blink(on_time=self._blink / 2, off_time=self._blink / 2)
+                else:
+                    led.on()
+            except BaseException as e:
+                logger.errorLimited("Unable to update the %s indicator: %s", self._name, e)
+
+    def set(self, active: bool):
+        '''Shows a state straight away, skipping the delays'''
+        self.active = active
+        with self._lock:
+            if self._closed:
+                return
+            self._pending_since = None
+            self._apply(active)
+
+    def close(self):
+        self.release()
+        with self._lock:
+            self._closed = True
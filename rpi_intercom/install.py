@@ -15,13 +15,21 @@ User = rpi-intercom
 Group = rpi-intercom
 Type = simple
 ExecStart = python -u -m rpi_intercom --config {config_path}
+ExecReload = /bin/kill -HUP $MAINPID
 Restart = always
 RestartSec = 5
-
+{realtime}
 [Install]
 WantedBy = multi-user.target
 """
 
+# Added to the service when installed with "realtime", so realtime_priority and
+# lock_memory work without running the intercom as root.
+REALTIME_DEFINITION = """AmbientCapabilities = CAP_SYS_NICE CAP_IPC_LOCK
+LimitRTPRIO = 99
+LimitMEMLOCK = infinity
+"""
+
 ASOUND_CONFIGURATION = """
 defaults.pcm.card {index}
 defaults.ctl.card {index}
@@ -59,6 +67,8 @@ class InstallService:
         print(" - Create a user named 'rpi-intercom' with limited permissions to run the intercom service")
         print(" - Install the rpi-intercom service")
         print(" - Configure the service to start at boot")
+        if "realtime" in sys.argv:
+            print(" - Allow the service to use real-time scheduling and lock its memory")
         if "accept" not in sys.argv:
             print("Do you want to continue [yes/no]?")
             response = input()
@@ -85,7 +95,8 @@ class InstallService:
         service_source_file_path = os.path.abspath(os.path.join(__file__, "..", "data", "rpi-intercom.service"))
         service_dest_file_path = "/etc/systemd/system/rpi-intercom.service"
         with open(service_dest_file_path, "w") as dest:
-            dest.write(SERVICE_DEFINITION.replace("{config_path}", config_path))
+            realtime = REALTIME_DEFINITION if "realtime" in sys.argv else ""
+            dest.write(SERVICE_DEFINITION.replace("{config_path}", config_path).replace("{realtime}", realtime))
 
         print("Enabling the service")
         self._run_process(['systemctl', 'enable', 'rpi-intercom.service'])
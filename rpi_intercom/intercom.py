@@ -2,17 +2,17 @@ import signal, os
 import pkg_resources
 from threading import Event
 from time import sleep
-from .control import Control
 from .config import Config
-from .sound  import Sound
-from .mumble import Mumble
-from .devices import Devices
+from .endpoint import Endpoint
+from .realtime import Realtime
 from .echotest import EchoTest
 from .shutdown import Shutdown
 from .server import Server
+from .reload import ConfigReloader
+from .worker import Worker
 import aiorun
 import logging
-from .logger import getLogger
+from .logger import getLogger, startQueue, stopQueue, configureHistory, flushLimited, LIMIT_INTERVAL_SECONDS
 import sys
 import asyncio
 
@@ -28,33 +28,53 @@ class Intercom:
     in the background while your script does something else.  Accessing the 'controller'
     property gives access to an object the manages the intercom's behavior such as 
     to start/stop playback, mute, or defen.
+
+    With `endpoints` in the config one intercom serves several rooms, each with its own
+    sound devices, mumble user and channel.  They share one web server (pick the room with
+    ?room=name), one worker for device checks and one for indicators, and their audio
+    threads are spread across audio_cpus.
     '''
     def __init__(self, config: Config):
+        configureHistory(config.log_history_size, config.log_history_file)
+        if config.log_mode == "queued":
+            startQueue()
         self._shutdown = Shutdown(config)
         self._config = config
         self._wait_forever = Event()
-        self._control = Control(config)
-        self._devices = Devices(self._config, self._shutdown)
-        self._mumble = Mumble(self._control, config, self._shutdown)
-        self._sound = Sound(self._devices, self._mumble, self._control, config)
-        self._server = Server(self._devices, self._shutdown)
+        self._device_worker = Worker("Device Check")
+        self._indicator_worker = Worker("Indicators")
+        self._endpoints = [Endpoint(endpoint, self._shutdown, self._device_worker, self._indicator_worker) for endpoint in config.endpointConfigs()]
+        self._server = Server(self._endpoints, self._shutdown, config)
+        self._reloader = ConfigReloader(config, self._reconfigure)
 
     @property
     def controller(self):
-        return self._control
+        '''The first endpoint's controller'''
+        return self._endpoints[0].control
+
+    @property
+    def endpoints(self):
+        return self._endpoints
 
     def start(self):
+        # Before anything else starts a thread, so they all inherit the process' CPUs
+        Realtime(self._config).configureProcess()
         self._shutdown.start()
-        self._control.start()
-        self._mumble.start()
-        self._devices.start()
-        self._sound.start()
+        self._device_worker.start()
+        self._indicator_worker.start()
+        # So a burst of rate limited errors that stops is still reported
+        self._device_worker.every(LIMIT_INTERVAL_SECONDS, flushLimited, key="flush limited logs", delay=LIMIT_INTERVAL_SECONDS)
+        for endpoint in self._endpoints:
+            endpoint.start()
+        self._reloader.start()
 
     def stop(self):
-        self._mumble.stop()
-        self._sound.stop()
-        self._devices.stop()
-        self._control.stop()
+        self._reloader.stop()
+        for endpoint in self._endpoints:
+            endpoint.stop()
+        flushLimited(force=True)
+        self._device_worker.stop()
+        self._indicator_worker.stop()
 
     async def run(self):
         try:
@@ -65,6 +85,7 @@ class Intercom:
             self.start()
             signal.signal(signal.SIGQUIT, self._do_shutdown)
             signal.signal(signal.SIGTERM, self._do_shutdown)
+            signal.signal(signal.SIGHUP, self._do_reload)
             await self._server.start()
             await self._shutdown.wait_for_shutdown()
         except KeyboardInterrupt:
@@ -73,6 +94,22 @@ class Intercom:
         finally:
             logger.info("Shutting down")
             self.stop()
+            stopQueue()
+
+    def _reconfigure(self, changed):
+        # Each part only touches what it has to, so audio and the mumble session carry on
+        configs = {config.name: config for config in self._config.endpointConfigs()}
+        for endpoint in self._endpoints:
+            config = configs.pop(endpoint.name, None)
+            if config is None:
+                logger.warning(f"Restart the intercom to remove endpoint '{endpoint.name}'")
+                continue
+            endpoint.reconfigure(config)
+        for name in configs:
+            logger.warning(f"Restart the intercom to add endpoint '{name}'")
+
+    def _do_reload(self, *args, **kwargs):
+        self._reloader.reload()
 
     def _do_shutdown(self, *args, **kwargs):
         self._shutdown.shutdown()
@@ -0,0 +1,177 @@
+import asyncio
+import math
+import struct
+import time
+from collections import deque
+from threading import Lock
+from typing import Awaitable, Callable, Dict, List, Tuple
+import numpy as np
+from .logger import getLogger
+
+logger = getLogger(__name__)
+
+RATE = 48000
+
+# Envelope points per second for each source
+POINTS_PER_SECOND = 50
+
+# How often envelopes are packed up and sent to clients
+SEND_INTERVAL_SECONDS = 0.1
+
+# Points kept per source while waiting to be sent, about 2 seconds
+MAX_POINTS = POINTS_PER_SECOND * 2
+
+# Meters that haven't had a point for this long are removed, eg for talkers who left
+METER_IDLE_SECONDS = 30
+
+# Level sources for the sound devices, talkers are TALKER_PREFIX + their name
+MICROPHONE = "microphone"
+OUTPUT = "output"
+TALKER_PREFIX = "talker:"
+
+FORMAT_VERSION = 1
+
+
+class LevelMeter():
+    '''
+    Reduces a stream of audio to a peak/RMS envelope with one point every `window`
+    samples.  Only ever pushed to from a single audio thread, points are read out
+    through a deque so no lock is needed.
+    '''
+    def __init__(self, window: int):
+        self._window = window
+        self._count = 0
+        self._peak = 0.0
+        self._squares = 0.0
+        self.points: deque = deque(maxlen=MAX_POINTS)
+
+    def push(self, samples: np.ndarray):
+        '''Add audio as floats between -1 and 1'''
+        position = 0
+        while position < len(samples):
+            take = min(self._window - self._count, len(samples) - position)
+            block = samples[position:position + take]
+            self._peak = max(self._peak, float(np.max(np.abs(block))))
+            self._squares += float(np.dot(block, block))
+            self._count += take
+            position += take
+            if self._count >= self._window:
+                self.points.append((min(self._peak, 1.0), min(math.sqrt(self._squares / self._count), 1.0)))
+                self._count = 0
+                self._peak = 0.0
+                self._squares = 0.0
+
+    def drain(self) -> List[Tuple[float, float]]:
+        ret = []
+        while len(self.points) > 0:
+            ret.append(self.points.popleft())
+        return ret
+
+
+def pack(envelopes: Dict[str, List[Tuple[float, float]]]) -> bytes:
+    '''
+    Packs envelopes into a binary websocket frame, little endian:
+        uint8 version, uint8 points per second, uint8 source count
+        then for each source:
+            uint8 name length, name (utf-8), uint16 point count,
+            int16 peak and int16 rms for each point, scaled so 32767 is full scale
+    '''
+    parts = [struct.pack("<BBB", FORMAT_VERSION, POINTS_PER_SECOND, len(envelopes))]
+    for name, points in envelopes.items():
+        encoded = name.encode("utf-8")[:255]
+        parts.append(struct.pack("<B", len(encoded)))
+        parts.append(encoded)
+        parts.append(struct.pack("<H", len(points)))
+        parts.append((np.array(points, dtype=float).reshape(-1) * 32767).round().astype('<i2').tobytes())
+    return b''.join(parts)
+
+
+class Levels():
+    '''
+    Audio level envelopes for the microphone, the mixed output and each talker, for the
+    web UI.  The audio threads feed samples in as they handle them, and every
+    SEND_INTERVAL_SECONDS the new points are packed into one binary frame that every
+    listener shares.  Nothing is computed while nobody is listening.
+    '''
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._window = RATE // POINTS_PER_SECOND
+        self._clock = clock
+        self._meters: Dict[str, LevelMeter] = {}
+        # When each meter last had points, only used by drain()
+        self._last_points: Dict[str, float] = {}
+        self._lock = Lock()
+        self._listeners: List[Callable[[bytes], Awaitable[None]]] = []
+        self._task = None
+        self.active = False
+
+    def attach(self, listener: Callable[[bytes], Awaitable[None]]):
+        self._listeners.append(listener)
+
+    def setActive(self, active: bool):
+        '''Turns metering on while there is someone to send levels to'''
+        if active and not self.active:
+            # Don't send stale points from the last time someone was watching
+            with self._lock:
+                self._meters = {}
+            self._last_points = {}
+        self.active = active
+
+    def push(self, source: str, samples: np.ndarray):
+        '''
+        Adds audio for a source, either 16 bit PCM or floats between -1 and 1.  Call from
+        one thread per source.
+        '''
+        if not self.active:
+            return
+        meter = self._meters.get(source)
+        if meter is None:
+            with self._lock:
+                meter = self._meters.setdefault(source, LevelMeter(self._window))
+        if samples.dtype.kind == 'i':
+            samples = samples.astype(float) / 32768
+        meter.push(samples)
+
+    def drain(self) -> Dict[str, List[Tuple[float, float]]]:
+        now = self._clock()
+        with self._lock:
+            meters = list(self._meters.items())
+        envelopes = {}
+        idle = []
+        for name, meter in meters:
+            points = meter.drain()
+            if len(points) > 0:
+                envelopes[name] = points
+                self._last_points[name] = now
+            elif now - self._last_points.setdefault(name, now) > METER_IDLE_SECONDS:
+                idle.append(name)
+        if len(idle) > 0:
+            with self._lock:
+                for name in idle:
+                    # A push that still had the old meter is lost, the next one makes a new meter
+                    self._meters.pop(name, None)
+                    self._last_points.pop(name, None)
+        return envelopes
+
+    def start(self):
+        self._task = asyncio.create_task(self._sendLoop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _sendLoop(self):
+        while True:
+            await asyncio.sleep(SEND_INTERVAL_SECONDS)
+            if not self.active:
+                continue
+            envelopes = self.drain()
+            if len(envelopes) == 0:
+                continue
+            data = pack(envelopes)
+            for listener in self._listeners:
+                try:
+                    await listener(data)
+                except Exception as e:
+                    logger.error("Level listener raised an exception")
+                    logger.printException(e)
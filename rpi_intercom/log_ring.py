@@ -0,0 +1,142 @@
+import itertools
+import mmap
+import os
+import struct
+from collections import deque
+from threading import Lock
+from typing import Iterator, Optional, Tuple
+
+MAGIC = b"RPILOG01"
+
+# magic, data capacity, write position, oldest entry position, next sequence number
+HEADER = struct.Struct("<8sQQQQ")
+HEADER_SIZE = 64
+
+# length of the text, sequence number
+ENTRY = struct.Struct("<IQ")
+
+
+class LogRing():
+    '''
+    A fixed size ring of pre-formatted log lines, memory mapped from a file so it survives
+    restarts (or anonymous memory if there is no file).  Every line gets a sequence number
+    that keeps counting across restarts, so a client can ask for only the lines after the
+    last one it saw.
+
+    Positions are byte counts that only ever increase and are wrapped into the data area
+    when used, so entries can straddle its end.  Writes go data first, then the header, so
+    a crash part way through an append loses at most that line.
+    '''
+    def __init__(self, capacity: int, path: Optional[str] = None):
+        self._lock = Lock()
+        self._file = None
+        if path is not None:
+            self._file = open(path, "a+b")
+            size = HEADER_SIZE + capacity
+            if os.fstat(self._file.fileno()).st_size != size:
+                self._file.truncate(size)
+            self._map = mmap.mmap(self._file.fileno(), size)
+        else:
+            self._map = mmap.mmap(-1, HEADER_SIZE + capacity)
+        self._capacity = capacity
+        # (sequence, position) of every entry in the ring, oldest first
+        self._index: deque = deque()
+        magic, stored_capacity, self._head, self._tail, self._next_seq = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or stored_capacity != capacity or not self._load():
+            self._head = 0
+            self._tail = 0
+            self._next_seq = max(self._next_seq, 1) if magic == MAGIC else 1
+            self._index.clear()
+            self._writeHeader()
+
+    def _writeHeader(self):
+        HEADER.pack_into(self._map, 0, MAGIC, self._capacity, self._head, self._tail, self._next_seq)
+
+    def _read(self, position: int, length: int) -> bytes:
+        start = position % self._capacity
+        end = start + length
+        if end <= self._capacity:
+            return self._map[HEADER_SIZE + start:HEADER_SIZE + end]
+        first = self._capacity - start
+        return self._map[HEADER_SIZE + start:HEADER_SIZE + self._capacity] + self._map[HEADER_SIZE:HEADER_SIZE + length - first]
+
+    def _write(self, position: int, data: bytes):
+        start = position % self._capacity
+        first = min(len(data), self._capacity - start)
+        self._map[HEADER_SIZE + start:HEADER_SIZE + start + first] = data[:first]
+        if first < len(data):
+            self._map[HEADER_SIZE:HEADER_SIZE + len(data) - first] = data[first:]
+
+    def _load(self) -> bool:
+        '''Rebuilds the index from the file, returns False if it doesn't make sense'''
+        if self._tail > self._head or self._head - self._tail > self._capacity:
+            return False
+        position = self._tail
+        last_seq = None
+        while position < self._head:
+            if self._head - position < ENTRY.size:
+                return False
+            length, seq = ENTRY.unpack(self._read(position, ENTRY.size))
+            if position + ENTRY.size + length > self._head or (last_seq is not None and seq != last_seq + 1):
+                return False
+            self._index.append((seq, position))
+            last_seq = seq
+            position += ENTRY.size + length
+        return last_seq is None or last_seq + 1 == self._next_seq
+
+    @property
+    def last_seq(self) -> int:
+        return self._next_seq - 1
+
+    @property
+    def first_seq(self) -> int:
+        return self._index[0][0] if len(self._index) > 0 else self._next_seq
+
+    def __len__(self):
+        return len(self._index)
+
+    def append(self, text: str) -> int:
+        data = text.encode("utf-8")
+        # Leave room for at least one more entry so the ring is never all one line
+        data = data[:max(0, self._capacity // 2 - ENTRY.size)]
+        size = ENTRY.size + len(data)
+        with self._lock:
+            seq = self._next_seq
+            while self._head + size - self._tail > self._capacity:
+                self._index.popleft()
+                self._tail = self._index[0][1] if len(self._index) > 0 else self._head
+            # Forget the entries about to be overwritten before overwriting them
+            self._writeHeader()
+            self._write(self._head, ENTRY.pack(len(data), seq) + data)
+            self._index.append((seq, self._head))
+            self._head += size
+            self._next_seq = seq + 1
+            self._writeHeader()
+        return seq
+
+    def since(self, seq: int = 0) -> Iterator[Tuple[int, str]]:
+        '''The entries with a sequence number after seq, oldest first'''
+        with self._lock:
+            if len(self._index) == 0:
+                return iter([])
+            # Sequence numbers in the ring are consecutive
+            start = max(0, seq + 1 - self._index[0][0])
+            entries = list(itertools.islice(self._index, start, None))
+            items = []
+            for entry_seq, position in entries:
+                length, _seq = ENTRY.unpack(self._read(position, ENTRY.size))
+                items.append((entry_seq, self._read(position + ENTRY.size, length).decode("utf-8", errors="replace")))
+        return iter(items)
+
+    def clear(self):
+        with self._lock:
+            self._index.clear()
+            self._tail = self._head
+            self._writeHeader()
+
+    def close(self):
+        with self._lock:
+            self._map.flush()
+            self._map.close()
+            if self._file is not None:
+                self._file.close()
@@ -1,10 +1,23 @@
+import atexit
 import logging
+import queue
+import sys
+import time
+import weakref
 from logging import LogRecord, Formatter
+from threading import Thread
+from typing import Callable, Iterator, List, Optional, Tuple
 from traceback import TracebackException
 from colorlog import ColoredFormatter
 from os.path import join, abspath
-
-HISTORY_SIZE = 100
+from .log_ring import LogRing
+
+# Bytes of formatted log lines kept in memory until configureHistory() is called
+HISTORY_CAPACITY = 1 << 20
+# The most records the log writer hands to the handlers at once
+LOG_BATCH_SIZE = 100
+# How often a rate limited call site can log, see StandardLogger.logLimited
+LIMIT_INTERVAL_SECONDS = 10
 PATH_BASE = abspath(join(__file__, "..", ".."))
 FORMATTER = Formatter('%(asctime)s %(levelname)s [%(name)s] %(message)s', '%m-%d %H:%M:%S')
 
@@ -12,29 +25,43 @@ logging.addLevelName(5, "TRACE")
 logging.TRACE = 5
 
 class HistoryHandler(logging.Handler):
-    def __init__(self):
+    """
+    Keeps recent log lines, formatted once as they're logged, in a LogRing.  Each record
+    gets the sequence number of its line as record.seq.
+    """
+    def __init__(self, capacity: int = HISTORY_CAPACITY):
         super(HistoryHandler, self).__init__()
-        self.history = [None] * HISTORY_SIZE
-        self.history_index = 0
+        self._ring = LogRing(capacity)
+        self._last: LogRecord = None
+
+    def open(self, capacity: int, path: Optional[str] = None):
+        """Moves history into a ring of a different size, or one that persists in a file"""
+        with self.lock:
+            ring = LogRing(capacity, path)
+            for _seq, line in self._ring.since(0):
+                ring.append(line)
+            old = self._ring
+            self._ring = ring
+            old.close()
 
     def reset(self):
-        self.history = [None] * HISTORY_SIZE
-        self.history_index = 0
+        self._ring.clear()
+        self._last = None
 
     def emit(self, record: LogRecord):
-        self.history[self.history_index % HISTORY_SIZE] = record
-        self.history_index += 1
+        record.seq = self._ring.append(self.format(record))
+        self._last = record
 
-    def getHistory(self, start=0):
-        end = self.history_index
-        if end - start >= HISTORY_SIZE:
-            start = end - HISTORY_SIZE
-        for x in range(start, end):
-            item = self.history[x % HISTORY_SIZE]
-            yield (x + 1, self.format(item))
+    def getHistory(self, start=0) -> Iterator[Tuple[int, str]]:
+        '''Log lines with a sequence number after start, as (sequence, line)'''
+        return self._ring.since(start)
 
     def getLast(self) -> LogRecord:
-        return self.history[(self.history_index - 1) % HISTORY_SIZE]
+        return self._last
+
+    @property
+    def last_seq(self) -> int:
+        return self._ring.last_seq
 
 
 CONSOLE = logging.StreamHandler()
@@ -62,24 +89,151 @@ class AttachableLogger(logging.Handler):
     def __init__(self):
         super().__init__()
         self._handlers = []
+        self._record_handlers = []
+        self._batch_handlers = []
 
     def emit(self, record: LogRecord):
-        for handler in self._handlers:
-            handler(self.format(record))
+        self.emitBatch([record])
+
+    def emitBatch(self, records: List[LogRecord]):
+        for record in records:
+            for handler in self._record_handlers:
+                handler(record)
+        if len(self._handlers) == 0 and len(self._batch_handlers) == 0:
+            return
+        messages = [self.format(record) for record in records]
+        for message in messages:
+            for handler in self._handlers:
+                handler(message)
+        if len(self._batch_handlers) > 0:
+            # The history's sequence numbers, when it kept the record
+            numbered = [(getattr(record, "seq", None), message) for record, message in zip(records, messages)]
+            for handler in self._batch_handlers:
+                handler(numbered)
 
     def attach(self, handler):
         self._handlers.append(handler)
 
+    def attachRecords(self, handler):
+        """Like attach(), but the handler gets the unformatted LogRecord"""
+        self._record_handlers.append(handler)
+
+    def attachBatch(self, handler: Callable[[List[Tuple[Optional[int], str]]], None]):
+        """
+        Like attach(), but the handler gets a list of (history sequence number, formatted
+        message) at a time
+        """
+        self._batch_handlers.append(handler)
+
+    def detach(self, handler):
+        self._handlers.remove(handler)
+
+    def detachRecords(self, handler):
+        self._record_handlers.remove(handler)
+
+    def detachBatch(self, handler: Callable[[List[Tuple[Optional[int], str]]], None]):
+        self._batch_handlers.remove(handler)
+
 ATTACHABLE = AttachableLogger()
 ATTACHABLE.setFormatter(FORMATTER)
 
+
+class Dispatcher(logging.Handler):
+    """
+    The one handler every StandardLogger has, which passes records on to CONSOLE, HISTORY
+    and ATTACHABLE.  Normally that happens on the thread that logged.  Once startQueue()
+    is called, logging only puts the record on a queue and a single "Log Writer" thread
+    formats and writes records in batches, so the audio threads never wait on a slow
+    console, a handler lock or the web server.
+    """
+    def __init__(self, handlers: List[logging.Handler]):
+        super().__init__()
+        self._handlers = handlers
+        self._queue: queue.SimpleQueue = None
+        self._thread: Thread = None
+
+    def handle(self, record: LogRecord):
+        # Skips Handler's lock, the queue is all the synchronization needed
+        log_queue = self._queue
+        if log_queue is not None:
+            log_queue.put(record)
+        else:
+            self.dispatch([record])
+        return True
+
+    def emit(self, record: LogRecord):
+        self.handle(record)
+
+    def dispatch(self, records: List[LogRecord]):
+        for handler in self._handlers:
+            if isinstance(handler, AttachableLogger):
+                batch = [record for record in records if record.levelno >= handler.level]
+                if len(batch) > 0:
+                    with handler.lock:
+                        handler.emitBatch(batch)
+                continue
+            for record in records:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def startQueue(self):
+        if self._queue is not None:
+            return
+        self._queue = queue.SimpleQueue()
+        self._thread = Thread(target=self._write, args=(self._queue,), name="Log Writer", daemon=True)
+        self._thread.start()
+
+    def stopQueue(self):
+        """Stops queueing and waits for everything already queued to be written"""
+        log_queue = self._queue
+        if log_queue is None:
+            return
+        self._queue = None
+        log_queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def _write(self, log_queue: queue.SimpleQueue):
+        running = True
+        while running:
+            records = [log_queue.get()]
+            while len(records) < LOG_BATCH_SIZE:
+                try:
+                    records.append(log_queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in records:
+                # Records can still arrive from threads that saw the queue before it stopped
+                running = False
+                records = [record for record in records if record is not None]
+            try:
+                self.dispatch(records)
+            except Exception:
+                # There's nowhere left to log this
+                pass
+        while True:
+            try:
+                record = log_queue.get_nowait()
+            except queue.Empty:
+                break
+            if record is not None:
+                self.dispatch([record])
+
+DISPATCHER = Dispatcher([CONSOLE, HISTORY, ATTACHABLE])
+atexit.register(DISPATCHER.stopQueue)
+
+# Every StandardLogger, so flushLimited() can find their rate limited call sites
+_LOGGERS: 'weakref.WeakSet[StandardLogger]' = weakref.WeakSet()
+
 class StandardLogger(logging.Logger):
     def __init__(self, name):
         super().__init__(name)
         self.setLevel(logging.TRACE)
-        self.addHandler(CONSOLE)
-        self.addHandler(HISTORY)
-        self.addHandler(ATTACHABLE)
+        self.addHandler(DISPATCHER)
+        # Call site (code, line) -> [when its window started, messages suppressed since,
+        # interval, and the level, message and args of the last one suppressed]
+        self._limits = {}
+        _LOGGERS.add(self)
 
     def trace(self, msg, *args, **kwargs):
         self.log(logging.TRACE, msg, *args, **kwargs)
@@ -87,6 +241,92 @@ class StandardLogger(logging.Logger):
     def printException(self, ex: Exception):
         self.error(self.formatException(ex))
 
+    def _allow(self, depth: int, interval: float, level: int, msg: str, args: tuple):
+        """
+        Decides whether a rate limited call site gets to log right now.  Returns None if
+        it doesn't, otherwise how many messages it had suppressed and over how long.
+        Suppressing a message costs a frame lookup, a dict lookup and a clock read no
+        matter what the message is.  The last suppressed message is kept unformatted for
+        flushLimited() in case the call site doesn't log again.
+        """
+        frame = sys._getframe(depth)
+        key = (frame.f_code, frame.f_lineno)
+        now = time.monotonic()
+        limit = self._limits.get(key)
+        if limit is None:
+            self._limits[key] = [now, 0, interval, level, msg, args]
+            return 0, 0
+        if now - limit[0] < interval:
+            limit[1] += 1
+            limit[3] = level
+            limit[4] = msg
+            limit[5] = args
+            return None
+        suppressed = limit[1]
+        elapsed = now - limit[0]
+        limit[0] = now
+        limit[1] = 0
+        return suppressed, elapsed
+
+    def logLimited(self, level: int, msg: str, *args, interval: float = LIMIT_INTERVAL_SECONDS, _depth: int = 2, **kwargs):
+        """
+        Logs like log(), except each line of code that calls it logs at most once every
+        `interval` seconds, for messages that can fire every audio period when something
+        goes wrong.  Messages in between are only counted and the next one that gets
+        through says how many there were.  Use %-style args rather than an f-string so
+        suppressed messages are never formatted.
+        """
+        if not self.isEnabledFor(level):
+            return
+        allowed = self._allow(_depth, interval, level, msg, args)
+        if allowed is None:
+            return
+        suppressed, elapsed = allowed
+        if suppressed > 0:
+            msg = f"{msg} (repeated {suppressed} times in the last {elapsed:.0f}s)"
+        self.log(level, msg, *args, stacklevel=_depth, **kwargs)
+
+    def flushLimited(self, force: bool = False):
+        """
+        Reports what rate limited call sites have suppressed once their interval is up (or
+        straight away with `force`), for when they don't log again to say so themselves.
+        """
+        now = time.monotonic()
+        for limit in list(self._limits.values()):
+            suppressed = limit[1]
+            elapsed = now - limit[0]
+            if suppressed == 0 or (elapsed < limit[2] and not force):
+                continue
+            limit[0] = now
+            limit[1] = 0
+            self.log(limit[3], f"{limit[4]} (repeated {suppressed} times in the last {elapsed:.0f}s)", *limit[5])
+
+    def debugLimited(self, msg: str, *args, **kwargs):
+        self.logLimited(logging.DEBUG, msg, *args, _depth=3, **kwargs)
+
+    def infoLimited(self, msg: str, *args, **kwargs):
+        self.logLimited(logging.INFO, msg, *args, _depth=3, **kwargs)
+
+    def warningLimited(self, msg: str, *args, **kwargs):
+        self.logLimited(logging.WARNING, msg, *args, _depth=3, **kwargs)
+
+    def errorLimited(self, msg: str, *args, **kwargs):
+        self.logLimited(logging.ERROR, msg, *args, _depth=3, **kwargs)
+
+    def printExceptionLimited(self, ex: Exception, interval: float = LIMIT_INTERVAL_SECONDS):
+        """Like printException(), rate limited like logLimited()"""
+        if not self.isEnabledFor(logging.ERROR):
+            return
+        # Only the exception is kept for flushLimited(), formatting a traceback is for when it logs
+        allowed = self._allow(2, interval, logging.ERROR, "%s: %s", (type(ex).__name__, ex))
+        if allowed is None:
+            return
+        suppressed, elapsed = allowed
+        message = self.formatException(ex)
+        if suppressed > 0:
+            message = f"(repeated {suppressed} times in the last {elapsed:.0f}s){message}"
+        self.error(message)
+
     def formatException(self, e: Exception) -> str:
         trace = None
         if (hasattr(e, "__traceback__")):
@@ -185,6 +425,14 @@ def getHistory(index):
     return HISTORY.getHistory(index)
 
 
+def lastHistorySeq() -> int:
+    return HISTORY.last_seq
+
+
+def configureHistory(capacity: int, path: Optional[str] = None) -> None:
+    HISTORY.open(capacity, path)
+
+
 def getLast() -> LogRecord:
     return HISTORY.getLast()
 
@@ -193,6 +441,24 @@ def reset() -> None:
     return HISTORY.reset()
 
 
+def flushLimited(force: bool = False) -> None:
+    '''Reports what every rate limited call site has suppressed, see StandardLogger.flushLimited'''
+    for logger in list(_LOGGERS):
+        logger.flushLimited(force)
+
+
+# Registered after the dispatcher's, so it runs first and what it logs still gets written
+atexit.register(flushLimited, True)
+
+
+def startQueue() -> None:
+    DISPATCHER.startQueue()
+
+
+def stopQueue() -> None:
+    DISPATCHER.stopQueue()
+
+
 class TraceLogger(StandardLogger):
     def __init__(self, name):
         super().__init__(name)
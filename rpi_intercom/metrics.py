@@ -0,0 +1,144 @@
+import math
+import threading
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Tuple, Union
+from .config import Config, DEFAULT_ENDPOINT
+from .logger import getLogger
+
+logger = getLogger(__name__)
+
+COUNTER = "counter"
+GAUGE = "gauge"
+
+Number = Union[int, float]
+
+
+class Counter():
+    '''
+    A count that only goes up.  inc() never waits on a lock, so it's safe to call from the
+    audio threads: each thread adds to a cell of its own, and reading the value adds the
+    cells up.  Only a thread's first increment takes the lock, to add its cell.
+
+    A counter with a `source` reads its value from that instead, for counts something else
+    already keeps (eg the audio engine process's stats).
+    '''
+    def __init__(self, source: Callable[[], Number] = None):
+        self._source = source
+        self._local = threading.local()
+        self._cells: List[List[Number]] = []
+        self._lock = Lock()
+
+    def inc(self, amount: Number = 1):
+        try:
+            self._local.cell[0] += amount
+        except AttributeError:
+            cell = [amount]
+            with self._lock:
+                self._cells.append(cell)
+            self._local.cell = cell
+
+    @property
+    def value(self) -> Optional[Number]:
+        if self._source is not None:
+            return self._source()
+        return sum(cell[0] for cell in list(self._cells))
+
+
+class Gauge():
+    '''A value that goes up and down, either set() or read from `source` when it's scraped'''
+    def __init__(self, source: Callable[[], Optional[Number]] = None):
+        self._source = source
+        self._value: Number = 0
+
+    def set(self, value: Number):
+        self._value = value
+
+    @property
+    def value(self) -> Optional[Number]:
+        if self._source is not None:
+            return self._source()
+        return self._value
+
+
+class _Family():
+    def __init__(self, kind: str, help: str):
+        self.kind = kind
+        self.help = help
+        self.metrics: Dict[Tuple[Tuple[str, str], ...], Union[Counter, Gauge]] = {}
+
+
+class Registry():
+    '''
+    Counters and gauges by name and labels, rendered in Prometheus' text format for the
+    web server's /metrics.  Asking for a metric that already exists returns it, unless a
+    new source is given, which replaces the old one (eg when a room's devices are
+    recreated).
+    '''
+    def __init__(self):
+        self._families: Dict[str, _Family] = {}
+        self._lock = Lock()
+
+    def counter(self, name: str, help: str, source: Callable[[], Number] = None, **labels: str) -> Counter:
+        return self._metric(COUNTER, Counter, name, help, source, labels)
+
+    def gauge(self, name: str, help: str, source: Callable[[], Optional[Number]] = None, **labels: str) -> Gauge:
+        return self._metric(GAUGE, Gauge, name, help, source, labels)
+
+    def _metric(self, kind: str, cls, name: str, help: str, source, labels: Dict[str, str]):
+        key = tuple(sorted((label, str(value)) for label, value in labels.items()))
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = _Family(kind, help)
+            elif family.kind != kind:
+                raise ValueError(f"{name} is already a {family.kind}")
+            metric = family.metrics.get(key)
+            if metric is None or source is not None:
+                metric = family.metrics[key] = cls(source)
+            return metric
+
+    def render(self) -> str:
+        with self._lock:
+            families = [(name, family, list(family.metrics.items())) for name, family in sorted(self._families.items())]
+        lines = []
+        for name, family, metrics in families:
+            lines.append(f"# HELP {name} {_escape(family.help, help=True)}")
+            lines.append(f"# TYPE {name} {family.kind}")
+            for key, metric in metrics:
+                try:
+                    value = metric.value
+                except Exception as e:
+                    logger.warningLimited("Unable to read metric %s: %s", name, e)
+                    continue
+                if value is None:
+                    continue
+                labels = ",".join(f'{label}="{_escape(value)}"' for label, value in key)
+                lines.append(f"{name}{{{labels}}} {_format(value)}" if labels else f"{name} {_format(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(text: str, help: bool = False) -> str:
+    text = text.replace("\\", "\\\\").replace("\n", "\\n")
+    return text if help else text.replace('"', '\\"')
+
+
+def _format(value: Number) -> str:
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, float):
+        if math.isnan(value):
+            return "NaN"
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        if value.is_integer():
+            return str(int(value))
+    return repr(value)
+
+
+def roomOf(config: Config) -> str:
+    '''The room label for metrics from an endpoint's config'''
+    return config.name if config.name is not None else DEFAULT_ENDPOINT
+
+
+# Everything the intercom counts, served on the web server's /metrics
+METRICS = Registry()
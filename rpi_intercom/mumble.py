@@ -1,14 +1,22 @@
 import queue
-import pymumble_py3
 import time
 from threading import Thread
+from typing import Callable, List, Set
 from pymumble_py3.channels import Channel
 from pymumble_py3.callbacks import PYMUMBLE_CLBK_SOUNDRECEIVED, PYMUMBLE_CLBK_CONNECTED, PYMUMBLE_CLBK_DISCONNECTED, PYMUMBLE_CLBK_PERMISSIONDENIED, PYMUMBLE_CLBK_CHANNELUPDATED, PYMUMBLE_CLBK_USERUPDATED
 from pymumble_py3.errors import UnknownChannelError, ConnectionRejectedError
-from .config import Config
+from .config import Config, Options
 from .control import Control
+from .encoder import AdaptiveBitrate, EncoderProfile, OPUS_MIN_BITRATE, protocolOverhead
 from .logger import getLogger
+from .metrics import METRICS, roomOf
+from .mumble_client import MumbleClient
+from .preroll import PreRoll
+from .rechunk import Rechunker, RATE
+from .reconnect import Backoff
 from .shutdown import Shutdown
+from .status import StatusBus
+from .transmit_queue import SAMPLE_BYTES, TransmitQueue
 
 
 logger = getLogger(__name__)
@@ -17,14 +25,20 @@ logger = getLogger(__name__)
 # allowed to buffer before audio gets dropped 
 SEND_BUFFER_MAX = 5 # 500ms
 
+# Options that change how microphone audio is encoded
+ENCODER_OPTIONS = {Options.OPUS_BITRATE, Options.OPUS_FRAME_DURATION, Options.OPUS_COMPLEXITY, Options.OPUS_APPLICATION, Options.ADAPTIVE_BITRATE, Options.SEND_BUFFER_LATENCY}
+
 
 class Mumble():
     '''
     Handles staying connected to a mumble server (using pymumble) and 
     sending/recieving audio to/from the mumble server.
     '''
-    def __init__(self, control: Control, config: Config, shutdown: Shutdown):
+    def __init__(self, control: Control, config: Config, shutdown: Shutdown, status: StatusBus = None):
         self._connected = False
+        self._status = status if status is not None else StatusBus()
+        # When the last connection dropped, to measure how long we were offline
+        self._disconnected_at = None
         self._config = config
         self._control = control
         self._shutdown = shutdown
@@ -32,32 +46,116 @@ class Mumble():
         self._mumble = None
 
         # Transmitting audio over the network is handled in a seperate thread to avoid 
-        # locking up the recieving audio buffer form the local microphone.
-        self._transmit_queue = queue.Queue(maxsize=5)
+        # locking up the recieving audio buffer form the local microphone.  Audio that
+        # waits longer than send_buffer_latency for it isn't worth sending.
+        self._transmit_queue = TransmitQueue(config.send_buffer_latency, config.send_buffer_latency)
         self._transmit_thread = None
         self._run_thread = None
         self._sound_callback = None
+        self._transmit_taps: List[Callable[[bytes], None]] = []
         self._stopping = False
         self._channel: Channel = None
         self._joined_channel = False
 
+        # Encoder settings, re-applied whenever pymumble creates a new encoder (eg after a reconnect)
+        self._profile = EncoderProfile.fromConfig(config)
+        self._adaptive = AdaptiveBitrate(self._profile, config.send_buffer_latency) if config.adaptive_bitrate else None
+        self._encoder = None
+        self._bandwidth = None
+        # Set when a reloaded config changes the encoding, the transmit thread applies it
+        self._reencode = False
+        # pymumble pads partial frames with silence, so only hand it whole ones
+        self._rechunker = Rechunker(int(self._profile.audio_per_packet * RATE), RATE)
+        # So the first word after pressing transmit isn't clipped
+        self._preroll = PreRoll(config.preroll, config.preroll_catchup) if config.preroll > 0 else None
+
+        room = roomOf(config)
+        dropped = "Seconds of microphone audio dropped to keep transmitting live"
+        METRICS.counter("intercom_transmit_dropped_seconds_total", dropped, source=lambda: self._transmit_queue.overflowed, room=room, reason="overflow")
+        METRICS.counter("intercom_transmit_dropped_seconds_total", dropped, source=lambda: self._transmit_queue.expired, room=room, reason="expired")
+        self._send_buffer_dropped = METRICS.counter("intercom_transmit_dropped_seconds_total", dropped, room=room, reason="backlog")
+        self._connections = METRICS.counter("intercom_mumble_connections_total", "Connections made to the mumble server, including reconnects", room=room)
+        self._disconnects = METRICS.counter("intercom_mumble_disconnects_total", "Connections to the mumble server that dropped", room=room)
+        METRICS.counter("intercom_rechunk_overflow_samples_total", "Microphone samples dropped waiting to be encoded", source=lambda: self._rechunker.overflowed_samples, room=room)
+        METRICS.gauge("intercom_mumble_connected", "1 while connected to the mumble server", source=lambda: int(self._connected), room=room)
+        METRICS.gauge("intercom_transmit_queue_seconds", "Microphone audio waiting for the transmit thread", source=lambda: self._transmit_queue.duration, room=room)
+        METRICS.gauge("intercom_send_backlog_seconds", "Audio waiting in the send buffer to go to the mumble server", source=self._sendBacklog, room=room)
+        # The latest from the UDP connection, which starts over with each connection
+        self._voice_stats = {}
+        METRICS.counter("intercom_voice_lost_total", "Voice packets from the server lost over UDP this connection", source=lambda: self._voice_stats.get('lost'), room=room)
+        METRICS.counter("intercom_voice_late_total", "Voice packets from the server that arrived late over UDP this connection", source=lambda: self._voice_stats.get('late'), room=room)
+        METRICS.counter("intercom_voice_tunnelled_total", "Voice packets sent over TCP because UDP wasn't getting through this connection", source=lambda: self._voice_stats.get('tunnelled'), room=room)
+
+    def _sendBacklog(self):
+        client = self._mumble
+        if client is None or not self._connected:
+            return None
+        return client.sound_output.get_buffer_size()
+
     def _onConnect(self):
+        self._connections.inc()
         logger.info(f"Connected to Mumble server {self._config.server}:{self._config.port} as '{self._config.nickname}'")
+        self._mumble.timer.mark("auth")
+        self._mumble.backoff.reset()
 
         # If configured to do so, also join a channel after connecting.
-        if self._config.channel is not None:
-            try:
-                self._channel: Channel = self._mumble.channels.find_by_name(self._config.channel)
-                logger.info(f'Joining channel \'{self._config.channel}\'')
-                self._channel.move_in()
-                self._channel.get_users()
-            except UnknownChannelError:
-                logger.info(f"Channel '{self._config.channel}' is unknown")
+        joining = self._joinChannel()
         self._connected = True
         self._control._set_connected()
+        if not joining:
+            self._connectionReady()
+
+    def _joinChannel(self) -> bool:
+        '''Moves into the configured channel, returns whether it's on its way'''
+        if self._config.channel is None:
+            self._channel = None
+            return False
+        try:
+            self._channel: Channel = self._mumble.channels.find_by_name(self._config.channel)
+            logger.info(f'Joining channel \'{self._config.channel}\'')
+            self._channel.move_in()
+            self._channel.get_users()
+            return True
+        except UnknownChannelError:
+            logger.info(f"Channel '{self._config.channel}' is unknown")
+            self._channel = None
+            return False
+
+    def reconfigure(self, changed: Set[Options]):
+        '''Applies a reloaded config without dropping the connection'''
+        if Options.CHANNEL in changed and self._connected and self._mumble is not None:
+            # Staying connected, so there's no connection phase to time
+            self._joined_channel = True
+            self._joinChannel()
+        if len(changed & ENCODER_OPTIONS) > 0:
+            self._reencode = True
+        if Options.SEND_BUFFER_LATENCY in changed:
+            self._transmit_queue.setLimits(self._config.send_buffer_latency, self._config.send_buffer_latency)
+        if Options.PREROLL in changed or Options.PREROLL_CATCHUP in changed:
+            self._preroll = PreRoll(self._config.preroll, self._config.preroll_catchup) if self._config.preroll > 0 else None
+
+    def _connectionReady(self):
+        '''Logs and publishes how long connecting took, once audio can flow'''
+        client = self._mumble
+        if client is None:
+            return
+        timings = {phase: round(seconds * 1000) for phase, seconds in client.timer.timings.items()}
+        outage = None
+        if self._disconnected_at is not None:
+            outage = round((time.monotonic() - self._disconnected_at) * 1000)
+            self._disconnected_at = None
+        logger.info(f"Mumble connection ready after {client.timer.describe()}{', TLS session resumed' if client.tls_resumed else ''}" + (f", offline for {outage}ms" if outage is not None else ""))
+        self._status.publish(connection={'phases_ms': timings, 'total_ms': round(client.timer.total * 1000), 'outage_ms': outage, 'tls_resumed': client.tls_resumed})
+
+    def _voiceStats(self, stats: dict):
+        self._voice_stats = stats
+        self._status.publish(voice=stats)
 
     def _onDisconnect(self):
         self._joined_channel = False
+        if self._connected:
+            self._disconnected_at = time.monotonic()
+            self._disconnects.inc()
         self._connected = False
         logger.warn("Disconnected from mumble server")
         self._control._set_disconnected()
@@ -70,7 +168,10 @@ class Mumble():
         logger.info(f"{data}")
 
     def _userUpdate(self, user, update):
-        if (user.get("name") == self._config.nickname and self._channel.get_id() == update.get("channel_id")):
+        if (self._channel is not None and user.get("name") == self._config.nickname and self._channel.get_id() == update.get("channel_id")):
+            if not self._joined_channel:
+                self._mumble.timer.mark("join")
+                self._connectionReady()
             self._joined_channel = True
             logger.info(f"Moved into channel '{self._config.channel}'")
 
@@ -79,46 +180,116 @@ class Mumble():
         if self._sound_callback:
             self._sound_callback(user, soundchunk.pcm)
 
-    def transmit(self, chunk):
-        try:
-            for sample in chunk:
-                if sample > 0:
-                    self._transmit_queue.put(chunk, block=False)
-                    break
-        except:
-            pass
+    def transmit(self, chunk, held: bool = False):
+        # Gate on the button here, when the audio was captured, rather than when it gets
+        # sent.  Only the pre-roll is kept waiting for a press, and the audio that was
+        # queued before a release still goes out.  `held` is for audio that's sent
+        # whatever the buttons say, like a browser talking.
+        transmitting = self._control.transmitting or held
+        if self._preroll is not None:
+            chunk = self._preroll.process(chunk, transmitting)
+            if chunk is None:
+                return
+        elif not transmitting:
+            return
+        for tap in self._transmit_taps:
+            tap(chunk)
+        for sample in chunk:
+            if sample > 0:
+                self._transmit_queue.put(chunk)
+                break
+
+    def addTransmitTap(self, tap: Callable[[bytes], None]):
+        '''
+        tap(chunk) is called from the microphone thread with the 16 bit PCM of every chunk
+        that's transmitted.  It must not block.
+        '''
+        self._transmit_taps.append(tap)
 
     def _transmit_loop(self):
         while(not self._stopping):
             try:
-                chunk = self._transmit_queue.get(block=True, timeout=0.5)
-                if self._connected and self._control.transmitting and self._mumble is not None:
+                # When part of a frame is waiting, wake up after a frame of silence to send the tail end of it
+                timeout = self._profile.audio_per_packet if self._rechunker.pending > 0 else 0.5
+                chunk, _waited = self._transmit_queue.get(timeout)
+                if self._connected and self._mumble is not None:
                     output = self._mumble.sound_output
+                    if self._reencode:
+                        self._reencode = False
+                        self._reconfigureEncoder(output)
+                    if output.encoder is not self._encoder or output.bandwidth != self._bandwidth:
+                        self._applyProfile(output, self._profile)
                     backlog = output.get_buffer_size()
+                    if self._adaptive is not None:
+                        profile = self._adaptive.update(backlog, time.monotonic())
+                        if profile is not None:
+                            logger.info(f"Changing audio encoding to {profile.bitrate} bps in {profile.frame_duration}ms packets.  Backlog: {backlog}")
+                            self._applyProfile(output, profile)
                     if backlog > self._config._send_buffer_latency:
                         # Audio from the microphone can slowly get sent to us faster than we can 
-                        # trasmit it.  Dropping the buffer avoids a buildup of audio delay over 
-                        # time by sacraficing some quality when it happens.  It would be better 
-                        # to compress and re-sample the audio to catch up.
-                        output.clear_buffer()
-                        logger.warn(f"Clearing audio send buffer due to latency.  Backlog: {backlog}")
-                    self._mumble.sound_output.add_sound(chunk)
+                        # trasmit it.  Dropping the oldest of it avoids a buildup of audio delay
+                        # over time by sacraficing some quality when it happens, and leaving
+                        # half keeps it from happening again straight away.
+                        dropped = self._trimSendBuffer(output, self._config._send_buffer_latency / 2)
+                        self._send_buffer_dropped.inc(dropped)
+                        logger.warningLimited("Dropped %dms of the oldest audio from the send buffer due to latency.  Backlog: %s", round(dropped * 1000), backlog)
+                    for frame in self._rechunker.push(chunk):
+                        output.add_sound(frame)
                 else:
-                    time.sleep(1)
-            except IndexError:
-                # there wasn't any audio in the trasmit queue.
-                time.sleep(0.005)
+                    self._rechunker.clear()
+            except queue.Empty:
+                # The microphone went quiet, send whatever is left over
+                frame = self._rechunker.flush()
+                if len(frame) > 0 and self._connected and self._mumble is not None:
+                    self._mumble.sound_output.add_sound(frame)
             except Exception as e:
-                if isinstance(e, queue.Empty):
-                    # Such pythonic, so clean. wow.
-                    continue
                 logger.printException(e)
 
+    def _trimSendBuffer(self, output, keep: float) -> float:
+        '''Drops the oldest audio from pymumble's send buffer down to `keep` seconds, returns the seconds dropped'''
+        dropped = 0
+        with output.lock:
+            excess = (output.get_buffer_size() - keep) * RATE * SAMPLE_BYTES * output.channels
+            while excess > 0 and len(output.pcm) > 0:
+                frame = output.pcm.pop(0)
+                excess -= len(frame)
+                dropped += len(frame)
+        return dropped / SAMPLE_BYTES / output.channels / RATE
+
+    def _reconfigureEncoder(self, output):
+        profile = EncoderProfile.fromConfig(self._config)
+        logger.info(f"Changing audio encoding to {profile.bitrate} bps in {profile.frame_duration}ms packets")
+        self._adaptive = AdaptiveBitrate(profile, self._config.send_buffer_latency) if self._config.adaptive_bitrate else None
+        self._mumble.set_codec_profile(self._config.opus_application)
+        if output.opus_profile != self._config.opus_application:
+            output.opus_profile = self._config.opus_application
+            output.create_encoder()
+        self._applyProfile(output, profile)
+
+    def _applyProfile(self, output, profile: EncoderProfile):
+        self._profile = profile
+        self._rechunker.set_frame_samples(int(profile.audio_per_packet * RATE))
+        if output.get_audio_per_packet() != profile.audio_per_packet:
+            # This also creates a new encoder
+            output.set_audio_per_packet(profile.audio_per_packet)
+        self._bandwidth = output.bandwidth
+        self._encoder = output.encoder
+        if output.encoder is None:
+            # The server hasn't told us which codec to use yet
+            return
+        bitrate = profile.bitrate
+        if self._mumble.server_max_bandwidth is not None:
+            overhead = protocolOverhead(output.audio_per_packet, output.encoder_framesize)
+            bitrate = min(bitrate, max(OPUS_MIN_BITRATE, self._mumble.server_max_bandwidth - overhead))
+        output.encoder.bitrate = bitrate
+        if profile.complexity is not None:
+            output.encoder.complexity = profile.complexity
+
     def start(self):
         '''
         Connects to the mumble server and starst sending/recieving audio.  Also retrys connecting to mumble if a disconnect happens.
         '''
-        self._mumble = pymumble_py3.Mumble(
+        self._mumble = MumbleClient(
             self._config.server,
             self._config.nickname,
             password=self._config.password,
@@ -126,7 +297,10 @@ class Mumble():
             reconnect=True,
             certfile=self._config.cert_file,
             keyfile=self._config.key_file,
-            tokens=self._config.tokens)
+            tokens=self._config.tokens,
+            backoff=Backoff(),
+            udp=self._config.udp_voice)
+        self._mumble.on_voice_stats = self._voiceStats
         # Bind to some server events so we can be notified and react accordingly.
         self._mumble.callbacks.set_callback(PYMUMBLE_CLBK_SOUNDRECEIVED, self._onSound)
         self._mumble.callbacks.set_callback(PYMUMBLE_CLBK_CONNECTED, self._onConnect)
@@ -135,6 +309,7 @@ class Mumble():
         self._mumble.callbacks.set_callback(PYMUMBLE_CLBK_CHANNELUPDATED, self._channelUpdated)
         self._mumble.callbacks.set_callback(PYMUMBLE_CLBK_USERUPDATED, self._userUpdate)
         self._mumble.set_receive_sound(True)
+        self._mumble.set_codec_profile(self._config.opus_application)
 
         self._run_thread = Thread(target=self._run_mumble, name="Mumble Run Thread", daemon=True)
         self._run_thread.start()
@@ -143,21 +318,24 @@ class Mumble():
         self._transmit_thread.start()
 
     def _run_mumble(self):
+        # MumbleClient retries dropped connections itself, this only restarts it after a
+        # rejection or an unexpected error
+        backoff = Backoff(initial=5)
         while True:
-            sleep = 5
             try:
                 logger.info(f"Connecting to mumble server {self._config.server}:{self._config.port}")
                 self._mumble.run()
+                sleep = backoff.next()
             except ConnectionRejectedError:
                 logger.error("Mumble server rejected login")
                 # avoid mumble throttling us
                 sleep = 30
             except Exception as e:
                 logger.printException(e)
-                sleep = 10
+                sleep = max(1, backoff.next())
             if self._shutdown.shutting_down:
                 return
-            logger.info(f"I'll retry in {sleep} seconds")
+            logger.info(f"I'll retry in {sleep:.1f} seconds")
             time.sleep(sleep)
         
 
@@ -0,0 +1,306 @@
+import select
+import socket
+import ssl
+import struct
+import threading
+import time
+from time import monotonic
+from typing import Callable, Dict, Optional
+import pymumble_py3
+from pymumble_py3 import mumble_pb2
+from pymumble_py3.callbacks import PYMUMBLE_CLBK_DISCONNECTED
+from pymumble_py3.constants import PYMUMBLE_CONN_STATE_AUTHENTICATING, PYMUMBLE_CONN_STATE_CONNECTED, PYMUMBLE_CONN_STATE_FAILED, PYMUMBLE_CONN_STATE_NOT_CONNECTED, PYMUMBLE_MSG_TYPES_AUTHENTICATE, PYMUMBLE_MSG_TYPES_CRYPTSETUP, PYMUMBLE_MSG_TYPES_PING, PYMUMBLE_MSG_TYPES_UDPTUNNEL, PYMUMBLE_MSG_TYPES_VERSION, PYMUMBLE_OS_STRING, PYMUMBLE_OS_VERSION_STRING, PYMUMBLE_PING_DELAY, PYMUMBLE_PROTOCOL_VERSION, PYMUMBLE_READ_BUFFER_SIZE
+from pymumble_py3.errors import ConnectionRejectedError
+from .logger import getLogger
+from .reconnect import Backoff, PhaseTimer
+from .udp import UdpVoice, udpAvailable
+
+logger = getLogger(__name__)
+
+# How long to wait for the server to accept the TCP connection
+CONNECT_TIMEOUT_SECONDS = 5
+
+# A connection that hasn't answered a ping for this long is given up on.  pymumble pings
+# every 10 seconds and waits a full minute.
+PING_TIMEOUT_SECONDS = 25
+
+# How often voice statistics are reported
+VOICE_STATS_SECONDS = 1
+
+
+class _VoiceRouter():
+    '''
+    What pymumble's SoundOutput sees as its Mumble object.  It writes finished voice
+    packets to `control_socket`, so this hands them to UDP when that's working and to the
+    real control socket otherwise.
+    '''
+    def __init__(self, client: 'MumbleClient'):
+        self._client = client
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    @property
+    def control_socket(self):
+        return self
+
+    def send(self, packet: bytes) -> int:
+        udp = self._client.udp
+        if udp is not None and len(packet) > 6:
+            type, length = struct.unpack_from("!HL", packet)
+            if type == PYMUMBLE_MSG_TYPES_UDPTUNNEL and len(packet) == length + 6 and udp.send(packet[6:]):
+                return len(packet)
+        return self._client.control_socket.send(packet)
+
+
+class MumbleClient(pymumble_py3.Mumble):
+    '''
+    pymumble's client with a faster way back after the connection drops.  pymumble waits
+    a fixed 10 seconds before every reconnect and builds a new TLS setup each time, this
+    retries immediately and then backs off (see Backoff), keeps one SSLContext and
+    resumes the previous TLS session when the server allows it.
+
+    Every attempt is timed by phase (dns, tcp, tls, then auth and join which Mumble marks
+    as the server gets back to it) in `timer`.
+
+    With `udp`, voice goes over UDP once the server has sent the keys for it (see
+    UdpVoice), falling back to the TCP tunnel whenever UDP isn't getting through.
+    on_voice_stats(stats) is called every second with its statistics.
+    '''
+    def __init__(self, *args, backoff: Backoff = None, udp: bool = True, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.backoff = backoff if backoff is not None else Backoff()
+        self.udp: Optional[UdpVoice] = None
+        self.on_voice_stats: Optional[Callable[[Dict[str, object]], None]] = None
+        self._use_udp = udp
+        if udp and not udpAvailable():
+            logger.warning("pycryptodome isn't installed, voice will only be sent through the TCP connection")
+            self._use_udp = False
+        self._address = None
+        self._last_stats = 0
+        self.timer = PhaseTimer()
+        self.tls_resumed = False
+        self._session = None
+        self._context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        # Mumble servers mostly use self signed certificates, and pymumble never checked them either
+        self._context.check_hostname = False
+        self._context.verify_mode = ssl.CERT_NONE
+        if self.certfile is not None:
+            self._context.load_cert_chain(self.certfile, self.keyfile)
+
+    def init_connection(self):
+        super().init_connection()
+        if getattr(self, "udp", None) is not None:
+            self.udp.close()
+        self.udp = None
+        self.sound_output.mumble_object = _VoiceRouter(self)
+
+    def run(self):
+        self.mumble_thread = threading.current_thread()
+        while True:
+            self.init_connection()
+            if self.connect() >= PYMUMBLE_CONN_STATE_FAILED:
+                self.ready_lock.release()
+                if not self.reconnect or not self.parent_thread.is_alive():
+                    raise ConnectionRejectedError("Connection error with the Mumble (murmur) Server")
+                self._wait()
+                continue
+
+            try:
+                self.loop()
+            except socket.error:
+                self.connected = PYMUMBLE_CONN_STATE_NOT_CONNECTED
+            self._keepSession()
+            try:
+                self.control_socket.close()
+            except (AttributeError, socket.error):
+                pass
+            if self.udp is not None:
+                self.udp.close()
+                self.udp = None
+
+            self.callbacks(PYMUMBLE_CLBK_DISCONNECTED)
+            if not self.reconnect or not self.parent_thread.is_alive():
+                break
+            self._wait()
+
+    def _wait(self):
+        delay = self.backoff.next()
+        if delay > 0:
+            logger.info(f"Reconnecting to mumble in {delay:.1f} seconds")
+            time.sleep(delay)
+
+    def _keepSession(self):
+        try:
+            if self.control_socket is not None and self.control_socket.session is not None:
+                self._session = self.control_socket.session
+        except (AttributeError, ValueError, ssl.SSLError):
+            pass
+
+    def connect(self):
+        self.timer.start()
+        self.tls_resumed = False
+        std_sock = None
+        try:
+            server_info = socket.getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM)
+            self.timer.mark("dns")
+            family, _type, _proto, _name, address = server_info[0]
+            self._address = address
+            std_sock = socket.socket(family, socket.SOCK_STREAM)
+            std_sock.settimeout(CONNECT_TIMEOUT_SECONDS)
+            std_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            std_sock.connect(address)
+            self.timer.mark("tcp")
+        except socket.error as e:
+            logger.info(f"Unable to reach mumble server {self.host}:{self.port}: {e}")
+            if std_sock is not None:
+                std_sock.close()
+            self.connected = PYMUMBLE_CONN_STATE_FAILED
+            return self.connected
+
+        try:
+            self.control_socket = self._context.wrap_socket(std_sock, session=self._session)
+            self.tls_resumed = self.control_socket.session_reused
+            self.timer.mark("tls")
+            self.control_socket.setblocking(False)
+
+            version = mumble_pb2.Version()
+            version.version = (PYMUMBLE_PROTOCOL_VERSION[0] << 16) + (PYMUMBLE_PROTOCOL_VERSION[1] << 8) + PYMUMBLE_PROTOCOL_VERSION[2]
+            version.release = self.application
+            version.os = PYMUMBLE_OS_STRING
+            version.os_version = PYMUMBLE_OS_VERSION_STRING
+            self.send_message(PYMUMBLE_MSG_TYPES_VERSION, version)
+
+            authenticate = mumble_pb2.Authenticate()
+            authenticate.username = self.user
+            authenticate.password = self.password
+            authenticate.tokens.extend(self.tokens)
+            authenticate.opus = True
+            self.send_message(PYMUMBLE_MSG_TYPES_AUTHENTICATE, authenticate)
+        except (socket.error, ValueError) as e:
+            logger.info(f"Unable to start a session with mumble server {self.host}:{self.port}: {e}")
+            # Don't try to resume a session that may be why it failed
+            self._session = None
+            std_sock.close()
+            self.connected = PYMUMBLE_CONN_STATE_FAILED
+            return self.connected
+
+        self.connected = PYMUMBLE_CONN_STATE_AUTHENTICATING
+        return self.connected
+
+    def read_control_messages(self):
+        # pymumble ignores the server closing the connection and only notices when its
+        # next ping fails, up to 10 seconds later
+        try:
+            buffer = self.control_socket.recv(PYMUMBLE_READ_BUFFER_SIZE)
+        except ssl.SSLWantReadError:
+            return
+        except socket.error:
+            buffer = None
+        if buffer == b"":
+            logger.info("Mumble server closed the connection")
+            self.connected = PYMUMBLE_CONN_STATE_NOT_CONNECTED
+            return
+        if buffer is not None:
+            self.receive_buffer += buffer
+
+        while len(self.receive_buffer) >= 6:
+            type, size = struct.unpack("!HL", self.receive_buffer[0:6])
+            if len(self.receive_buffer) < size + 6:
+                break
+            message = self.receive_buffer[6:size + 6]
+            self.receive_buffer = self.receive_buffer[size + 6:]
+            self.dispatch_control_message(type, message)
+
+    def loop(self):
+        # pymumble's loop, also serving the UDP socket
+        self.exit = False
+        last_ping = time.time()
+        while self.connected not in (PYMUMBLE_CONN_STATE_NOT_CONNECTED, PYMUMBLE_CONN_STATE_FAILED) and self.parent_thread.is_alive() and not self.exit:
+            if last_ping + PYMUMBLE_PING_DELAY <= time.time():
+                self.ping()
+                last_ping = time.time()
+
+            if self.connected == PYMUMBLE_CONN_STATE_CONNECTED:
+                while self.commands.is_cmd():
+                    self.treat_command(self.commands.pop_cmd())
+                self.sound_output.send_audio()
+
+            udp = self.udp
+            readers = [self.control_socket]
+            if udp is not None:
+                self._pollUdp(udp)
+                readers.append(udp)
+            (rlist, wlist, xlist) = select.select(readers, [], [self.control_socket], self.loop_rate)
+
+            if udp is not None and udp in rlist:
+                for packet in udp.receive():
+                    self.sound_received(packet)
+            if self.control_socket in rlist:
+                self.read_control_messages()
+            elif self.control_socket in xlist:
+                self.control_socket.close()
+                self.connected = PYMUMBLE_CONN_STATE_NOT_CONNECTED
+
+    def _pollUdp(self, udp: UdpVoice):
+        if udp.poll():
+            logger.info("Asking the mumble server to resync UDP encryption")
+            self.send_message(PYMUMBLE_MSG_TYPES_CRYPTSETUP, mumble_pb2.CryptSetup())
+        self.udp_active = udp.active
+        now = monotonic()
+        if self.on_voice_stats is not None and now - self._last_stats >= VOICE_STATS_SECONDS:
+            self._last_stats = now
+            self.on_voice_stats(udp.stats())
+
+    def dispatch_control_message(self, type, message):
+        if type == PYMUMBLE_MSG_TYPES_CRYPTSETUP:
+            setup = mumble_pb2.CryptSetup()
+            setup.ParseFromString(message)
+            self._cryptSetup(setup)
+            self.ping()
+            return
+        super().dispatch_control_message(type, message)
+
+    def _cryptSetup(self, setup):
+        if not self._use_udp:
+            return
+        if len(setup.key) == 16 and len(setup.client_nonce) == 16 and len(setup.server_nonce) == 16:
+            if self.udp is None:
+                self.udp = UdpVoice(self._address)
+            self.udp.crypt.setKey(setup.key, setup.client_nonce, setup.server_nonce)
+        elif self.udp is not None and len(setup.server_nonce) == 16:
+            # The answer to our resync request
+            self.udp.crypt.setDecryptIV(setup.server_nonce)
+        elif self.udp is not None:
+            # The server lost track of our nonce
+            reply = mumble_pb2.CryptSetup()
+            reply.client_nonce = bytes(self.udp.crypt.encrypt_iv)
+            self.send_message(PYMUMBLE_MSG_TYPES_CRYPTSETUP, reply)
+
+    def ping(self):
+        # pymumble's ping, plus our UDP statistics for the server
+        ping = mumble_pb2.Ping()
+        ping.timestamp = int(time.time())
+        ping.tcp_ping_avg = self.ping_stats['avg']
+        ping.tcp_ping_var = self.ping_stats['var']
+        ping.tcp_packets = self.ping_stats['nb']
+        if self.udp is not None:
+            ping.good = self.udp.crypt.good
+            ping.late = self.udp.crypt.late
+            ping.lost = self.udp.crypt.lost
+            ping.resync = self.udp.crypt.resync
+            ping.udp_packets = self.udp.received
+        self.send_message(PYMUMBLE_MSG_TYPES_PING, ping)
+        self.ping_stats['time_send'] = int(time.time() * 1000)
+        last_received = self.ping_stats['last_rcv']
+        if last_received != 0 and time.time() * 1000 > last_received + PING_TIMEOUT_SECONDS * 1000:
+            logger.warning(f"Mumble server hasn't answered a ping in {PING_TIMEOUT_SECONDS} seconds")
+            self.connected = PYMUMBLE_CONN_STATE_NOT_CONNECTED
+
+    def ping_response(self, mess):
+        super().ping_response(mess)
+        if self.udp is not None:
+            # How the packets we sent over UDP fared, as the server saw them
+            self.udp.server_good = mess.good
+            self.udp.server_late = mess.late
+            self.udp.server_lost = mess.lost
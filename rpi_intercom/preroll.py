@@ -0,0 +1,66 @@
+from typing import Optional
+import numpy as np
+from .circular_buffer import Buffer
+from .rechunk import AUDIO_DATA_TYPE, RATE
+
+
+class PreRoll:
+    '''
+    Keeps the last few hundred milliseconds of microphone audio while a gate (voice
+    detection or the transmit button) is closed, so when it opens the start of the first
+    word goes out too instead of being clipped.
+
+    Opening the gate flushes the kept audio ahead of the live audio.  That puts
+    transmission behind real time, so until it has caught up each chunk handed back
+    is made from `catchup` chunks worth of audio (a 200ms pre-roll at 1.1x is caught up
+    after 2s).  Once caught up chunks pass straight through.  After the gate closes
+    whatever is still behind keeps going out at the same rate.
+    '''
+    def __init__(self, seconds: float, catchup: float = 1.1, rate: int = RATE):
+        self._history = Buffer(max(1, int(seconds * rate)), dtype=AUDIO_DATA_TYPE)
+        # Room for the pre-roll plus plenty of chunks arriving while it catches up
+        self._backlog = Buffer(self._history.max_length + rate, dtype=AUDIO_DATA_TYPE)
+        self._catchup = catchup
+        self._rate = rate
+        self._open = False
+
+    @property
+    def behind(self) -> float:
+        '''How far behind real time the audio being handed back is, in seconds'''
+        return self._backlog.length / self._rate
+
+    def process(self, pcm: bytes, open: bool) -> Optional[bytes]:
+        '''
+        Takes a chunk of 16 bit PCM and whether the gate is open, returns what to transmit
+        in its place (the same length) or None if nothing should be sent.
+        '''
+        chunk = np.frombuffer(pcm, dtype=AUDIO_DATA_TYPE)
+        if open and not self._open:
+            self._backlog.push(self._history.pop(self._history.length))
+        self._open = open
+        if open:
+            self._backlog.push(chunk)
+        else:
+            self._history.push(chunk)
+            if self._backlog.length == 0:
+                return None
+        return self._drain(len(chunk)).tobytes()
+
+    def _drain(self, samples: int) -> np.ndarray:
+        backlog = self._backlog.length
+        if backlog <= samples:
+            out = np.zeros(samples, dtype=AUDIO_DATA_TYPE)
+            tail = self._backlog.pop(samples)
+            out[:len(tail)] = tail
+            return out
+        take = min(backlog, int(round(samples * self._catchup)))
+        if take <= samples:
+            return self._backlog.pop(samples)
+        # Squeeze `take` samples into `samples`, which also raises the pitch slightly
+        audio = self._backlog.pop(take)
+        return np.interp(np.linspace(0, take - 1, samples), np.arange(take), audio).astype(AUDIO_DATA_TYPE)
+
+    def clear(self):
+        self._history.pop(self._history.length)
+        self._backlog.pop(self._backlog.length)
+        self._open = False
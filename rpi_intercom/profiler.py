@@ -0,0 +1,176 @@
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from threading import Event, Lock, Thread
+from typing import Any, Callable, Dict, List, Optional
+from .logger import getLogger
+
+logger = getLogger(__name__)
+
+# The threads that have to keep up with the sound card and the network
+AUDIO_THREADS = ["Speaker Thread", "Microphone Thread", "Transmit Thread"]
+DEFAULT_SECONDS = 30
+MAX_SECONDS = 300
+DEFAULT_INTERVAL = 0.01
+MIN_INTERVAL = 0.002
+MAX_INTERVAL = 1.0
+# The share of the time the sampler may spend sampling before it slows down
+MAX_OVERHEAD = 0.02
+# Distinct stacks kept, anything new after that is counted together
+MAX_STACKS = 20000
+# How often progress is reported and the thread names are looked up again
+REPORT_SECONDS = 1
+OTHER_STACKS = "[other stacks]"
+
+
+class Profiler():
+    '''
+    Profiles the running intercom by sampling the stacks of chosen threads (by name) with
+    sys._current_frames(), for a flame graph of where their time goes.  It only ever
+    looks at the threads from its own, so unlike cProfile it doesn't slow down the
+    threads being profiled, and it can be pointed at threads that are already running.
+
+    A session always stops after at most MAX_SECONDS.  If sampling takes more than
+    MAX_OVERHEAD of the time, eg because the stacks are deep or the CPU is busy, the
+    sampler halves its rate.  The result is in the collapsed stack format that
+    flamegraph.pl and speedscope read, one "thread;outer;...;inner count" line per stack.
+
+    With audio_engine: process the speaker and microphone threads run in the audio
+    engine's own process and can't be sampled from here.
+
+    on_change(status) is called from the sampling thread whenever a session starts,
+    progresses or finishes.
+    '''
+    def __init__(self, on_change: Callable[[Dict[str, Any]], None] = None):
+        self._on_change = on_change
+        self._lock = Lock()
+        self._thread: Thread = None
+        self._stop = Event()
+        self._stacks: Counter = Counter()
+        self._threads: List[str] = []
+        self._seconds = 0.0
+        self._interval = DEFAULT_INTERVAL
+        self._samples = 0
+        self._started = None
+        self._elapsed = 0.0
+        self._overhead = 0.0
+        self._finished: Optional[float] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, threads: List[str] = None, seconds: float = DEFAULT_SECONDS, interval: float = DEFAULT_INTERVAL) -> bool:
+        '''Starts a session, returns False if one is already running'''
+        with self._lock:
+            if self.running:
+                return False
+            self._threads = list(threads) if threads else list(AUDIO_THREADS)
+            seconds = float(seconds)
+            interval = float(interval)
+            # NaN would never reach the deadline, so anything that isn't a number gets the defaults
+            self._seconds = min(max(seconds, 0), MAX_SECONDS) if math.isfinite(seconds) else DEFAULT_SECONDS
+            self._interval = max(interval, MIN_INTERVAL) if math.isfinite(interval) else DEFAULT_INTERVAL
+            self._stacks = Counter()
+            self._samples = 0
+            self._elapsed = 0.0
+            self._overhead = 0.0
+            self._finished = None
+            self._started = time.time()
+            self._stop.clear()
+            self._thread = Thread(target=self._run, name="Profiler", daemon=True)
+            self._thread.start()
+        logger.info(f"Profiling {', '.join(self._threads)} for {self._seconds:.0f}s")
+        return True
+
+    def stop(self):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            'running': self.running,
+            'threads': self._threads,
+            'seconds': self._seconds,
+            'elapsed': round(self._elapsed, 1),
+            'samples': self._samples,
+            'interval_ms': round(self._interval * 1000, 1),
+            'overhead': round(self._overhead, 4),
+            'finished': self._finished,
+            'available': len(self._stacks) > 0,
+        }
+
+    def collapsed(self) -> str:
+        '''The samples so far, in collapsed stack format'''
+        stacks = dict(self._stacks)
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+
+    def filename(self) -> str:
+        started = time.strftime("%Y%m%d-%H%M%S", time.localtime(self._started or time.time()))
+        return f"intercom-profile-{started}.folded"
+
+    def _run(self):
+        me = threading.get_ident()
+        started = time.monotonic()
+        deadline = started + self._seconds
+        names: Dict[int, str] = {}
+        window = started
+        sampling = 0.0
+        next_report = started
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if now >= next_report:
+                # Threads come and go (eg when mumble reconnects), so look them up again now and then
+                names = {thread.ident: thread.name for thread in threading.enumerate() if thread.name in self._threads and thread.ident != me}
+                if now > window:
+                    self._overhead = sampling / (now - window)
+                    if self._overhead > MAX_OVERHEAD and self._interval < MAX_INTERVAL:
+                        self._interval = min(self._interval * 2, MAX_INTERVAL)
+                        logger.info(f"Profiling took {self._overhead:.1%} of the time, slowing down to a sample every {self._interval * 1000:.0f}ms")
+                window = now
+                sampling = 0.0
+                self._elapsed = now - started
+                self._changed()
+                next_report = now + REPORT_SECONDS
+            self._sample(names)
+            sampling += time.monotonic() - now
+            self._stop.wait(self._interval)
+        self._elapsed = time.monotonic() - started
+        self._finished = time.time()
+        logger.info(f"Profiling finished with {self._samples} samples of {', '.join(self._threads)}")
+        self._changed(running=False)
+
+    def _sample(self, names: Dict[int, str]):
+        frames = sys._current_frames()
+        for ident, name in names.items():
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.append(name)
+            key = ";".join(reversed(stack))
+            if key not in self._stacks and len(self._stacks) >= MAX_STACKS:
+                key = f"{name};{OTHER_STACKS}"
+            self._stacks[key] += 1
+        self._samples += 1
+
+    def _changed(self, **overrides):
+        if self._on_change is None:
+            return
+        status = self.status()
+        status.update(overrides)
+        try:
+            self._on_change(status)
+        except Exception as e:
+            logger.printException(e)
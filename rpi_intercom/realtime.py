@@ -0,0 +1,142 @@
+import ctypes
+import ctypes.util
+import os
+import resource
+from threading import current_thread
+from typing import List, Optional, Set
+from .config import Config
+from .logger import getLogger
+
+logger = getLogger(__name__)
+
+# From <sys/mman.h>
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+POLICIES = {
+    "fifo": getattr(os, "SCHED_FIFO", None),
+    "rr": getattr(os, "SCHED_RR", None),
+}
+
+
+def parseCpus(cpus: str) -> Set[int]:
+    '''
+    Parses a CPU list the way taskset and /sys/devices/system/cpu do, eg "0-2,3".
+    '''
+    ret = set()
+    for part in cpus.replace(" ", "").split(","):
+        if len(part) == 0:
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            if int(end) < int(start):
+                raise ValueError(f"'{part}' isn't a valid CPU range")
+            ret.update(range(int(start), int(end) + 1))
+        else:
+            ret.add(int(part))
+    if len(ret) == 0:
+        raise ValueError(f"'{cpus}' doesn't list any CPUs")
+    return ret
+
+
+def _formatCpus(cpus: Set[int]) -> str:
+    return ",".join(str(cpu) for cpu in sorted(cpus))
+
+
+def spreadCpus(cpus: str, count: int) -> List[str]:
+    '''
+    Shares a CPU list out between `count` endpoints, one CPU each in turn, so each room's
+    audio threads get a core to themselves when there are enough of them.
+    '''
+    ordered = sorted(parseCpus(cpus))
+    return [str(ordered[i % len(ordered)]) for i in range(count)]
+
+
+class Realtime():
+    '''
+    Gives the audio threads real-time scheduling and pins threads to CPUs, as far as the
+    intercom is allowed to.  Nothing here is fatal: when the kernel says no (usually
+    because the process lacks CAP_SYS_NICE/CAP_IPC_LOCK or the rlimits for them) it logs
+    what it got instead and carries on at normal priority.
+    '''
+    def __init__(self, config: Config):
+        self._priority = config.realtime_priority
+        self._policy_name = config.realtime_policy
+        self._audio_cpus = self._parse(config.audio_cpus, "audio_cpus")
+        self._process_cpus = self._parse(config.process_cpus, "process_cpus")
+        self._lock_memory = config.lock_memory
+
+    def _parse(self, cpus: Optional[str], name: str) -> Optional[Set[int]]:
+        if cpus is None:
+            return None
+        try:
+            return parseCpus(str(cpus))
+        except ValueError:
+            logger.error(f"Ignoring {name}, '{cpus}' isn't a valid list of CPUs")
+            return None
+
+    def configureProcess(self):
+        '''
+        Pins every thread the process has so far to process_cpus and locks memory if
+        configured.  Call this before starting other threads, which inherit the affinity.
+        '''
+        if self._process_cpus is not None:
+            self._pinProcess(self._process_cpus)
+        if self._lock_memory:
+            self.lockMemory()
+
+    def _pinProcess(self, cpus: Set[int]):
+        if not hasattr(os, "sched_setaffinity"):
+            logger.warning("CPU affinity isn't supported on this platform, process_cpus is ignored")
+            return
+        try:
+            # sched_setaffinity only applies to a single thread on Linux, so set it on each one
+            for task in os.listdir("/proc/self/task"):
+                os.sched_setaffinity(int(task), cpus)
+            logger.info(f"Pinned the intercom to CPUs {_formatCpus(os.sched_getaffinity(0))}")
+        except (OSError, ValueError) as e:
+            logger.warning(f"Couldn't pin the intercom to CPUs {_formatCpus(cpus)}: {e}")
+
+    def lockMemory(self) -> bool:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+                soft, _hard = resource.getrlimit(resource.RLIMIT_MEMLOCK)
+                limit = "unlimited" if soft == resource.RLIM_INFINITY else f"{soft} bytes"
+                logger.warning(f"Couldn't lock memory: {os.strerror(ctypes.get_errno())} (RLIMIT_MEMLOCK is {limit})")
+                return False
+        except (OSError, AttributeError) as e:
+            logger.warning(f"Couldn't lock memory: {e}")
+            return False
+        logger.info("Locked the intercom's memory")
+        return True
+
+    def promoteThread(self):
+        '''
+        Applies the configured priority and audio_cpus to the calling thread and logs what
+        it actually got.  Does nothing if neither is configured.
+        '''
+        if self._priority <= 0 and self._audio_cpus is None:
+            return
+        name = current_thread().name
+        obtained = []
+        if self._priority > 0:
+            policy = POLICIES.get(self._policy_name)
+            try:
+                if policy is None or not hasattr(os, "sched_setscheduler"):
+                    raise OSError("not supported on this platform")
+                priority = min(self._priority, os.sched_get_priority_max(policy))
+                os.sched_setscheduler(0, policy, os.sched_param(priority))
+                obtained.append(f"SCHED_{self._policy_name.upper()} priority {priority}")
+            except OSError as e:
+                soft, _hard = resource.getrlimit(resource.RLIMIT_RTPRIO)
+                logger.warning(f"{name} couldn't get real-time priority {self._priority}: {e.strerror or e} (RLIMIT_RTPRIO is {soft})")
+                obtained.append("normal priority")
+        if self._audio_cpus is not None and hasattr(os, "sched_setaffinity"):
+            try:
+                os.sched_setaffinity(0, self._audio_cpus)
+            except (OSError, ValueError) as e:
+                logger.warning(f"{name} couldn't pin itself to CPUs {_formatCpus(self._audio_cpus)}: {e}")
+        if hasattr(os, "sched_getaffinity"):
+            obtained.append(f"on CPUs {_formatCpus(os.sched_getaffinity(0))}")
+        logger.info(f"{name} running with {' '.join(obtained)}")
@@ -0,0 +1,79 @@
+import math
+from typing import List
+import numpy as np
+from .circular_buffer import Buffer
+
+AUDIO_DATA_TYPE = np.dtype(np.int16).newbyteorder('<')
+RATE = 48000  # pymumble encodes 48kHz audio
+
+# Opus frames are a multiple of 10ms
+FRAME_SAMPLES = int(RATE * 0.01)
+
+
+def periodSize(chunk_size: int) -> int:
+    '''
+    The sound card period to use for a configured chunk_size.  Multiples of an opus frame
+    (10ms) are used as-is so capture periods line up with encoder frames, otherwise round
+    down to a power of 2.
+    '''
+    if chunk_size % FRAME_SAMPLES == 0:
+        size = chunk_size
+    else:
+        size = int(math.pow(2, int(math.log2(chunk_size))))
+    return max(size, 128)
+
+
+class Rechunker:
+    '''
+    Sits between the microphone and pymumble, accumulating 16 bit PCM from the
+    microphone and handing it back out in chunks that are exactly one encoder frame
+    long.  Capture periods are a power of two (512 samples) while opus frames are
+    10ms multiples (480 samples), and pymumble pads any partial frame it gets with
+    silence, so feeding it capture periods directly adds gaps and makes the send
+    backlog wobble.
+    '''
+    def __init__(self, frame_samples: int, max_samples: int):
+        self._frame_samples = frame_samples
+        self._buffer = Buffer(max_samples, dtype=AUDIO_DATA_TYPE)
+
+    @property
+    def frame_samples(self) -> int:
+        return self._frame_samples
+
+    def set_frame_samples(self, frame_samples: int):
+        self._frame_samples = frame_samples
+
+    @property
+    def pending(self) -> int:
+        '''The number of samples waiting for enough audio to fill a frame'''
+        return self._buffer.length
+
+    @property
+    def overflowed_samples(self) -> int:
+        '''Audio thrown away because frames weren't taken out as fast as it was pushed'''
+        return self._buffer.overflowed_samples
+
+    def push(self, pcm: bytes) -> List[bytes]:
+        '''
+        Add PCM audio and return any complete frames it produced.
+        '''
+        self._buffer.push(np.frombuffer(pcm, dtype=AUDIO_DATA_TYPE))
+        frames = []
+        while self._buffer.length >= self._frame_samples:
+            frames.append(self._buffer.pop(self._frame_samples).tobytes())
+        return frames
+
+    def flush(self) -> bytes:
+        '''
+        Return whatever partial frame is buffered, padded with silence to a full frame.
+        Used when the audio stops so the tail end of it isn't held back.
+        '''
+        if self._buffer.length == 0:
+            return b''
+        frame = np.zeros(self._frame_samples, dtype=AUDIO_DATA_TYPE)
+        remaining = self._buffer.pop(self._frame_samples)
+        frame[:len(remaining)] = remaining
+        return frame.tobytes()
+
+    def clear(self):
+        self._buffer.pop(self._buffer.length)
@@ -0,0 +1,72 @@
+import random
+from time import monotonic
+from typing import Dict, Optional
+
+
+class Backoff():
+    '''
+    How long to wait before each reconnect attempt.  The first retry after a connection
+    drops is immediate, since most drops are a short Wi-Fi blip that's already over.
+    After that the delay doubles from `initial` up to `maximum`, with up to `jitter` of
+    it randomised so a room full of intercoms doesn't reconnect in lockstep after the
+    server restarts.  reset() once a connection succeeds.
+    '''
+    def __init__(self, initial: float = 0.5, maximum: float = 30, factor: float = 2, jitter: float = 0.25):
+        self._initial = initial
+        self._maximum = maximum
+        self._factor = factor
+        self._jitter = jitter
+        self._attempts = 0
+
+    @property
+    def attempts(self) -> int:
+        '''Retries since the last reset'''
+        return self._attempts
+
+    def next(self) -> float:
+        self._attempts += 1
+        if self._attempts == 1:
+            return 0
+        delay = min(self._maximum, self._initial * self._factor ** (self._attempts - 2))
+        return delay * (1 - self._jitter * random.random())
+
+    def reset(self):
+        self._attempts = 0
+
+
+class PhaseTimer():
+    '''
+    Times the phases of connecting (dns, tcp, tls, auth, join), each measured from the
+    end of the one before it.
+    '''
+    def __init__(self):
+        self._start: Optional[float] = None
+        self._last: Optional[float] = None
+        self._timings: Dict[str, float] = {}
+
+    def start(self):
+        self._start = monotonic()
+        self._last = self._start
+        self._timings = {}
+
+    def mark(self, phase: str):
+        '''Records that phase just finished'''
+        if self._last is None:
+            return
+        now = monotonic()
+        self._timings[phase] = now - self._last
+        self._last = now
+
+    @property
+    def timings(self) -> Dict[str, float]:
+        '''Seconds taken by each phase so far'''
+        return dict(self._timings)
+
+    @property
+    def total(self) -> float:
+        if self._start is None:
+            return 0
+        return self._last - self._start
+
+    def describe(self) -> str:
+        return ", ".join(f"{phase} {seconds * 1000:.0f}ms" for phase, seconds in self._timings.items())
@@ -0,0 +1,320 @@
+import os
+import re
+import struct
+import time
+from datetime import datetime
+from threading import Event, Thread
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from .config import Config
+from .logger import getLogger
+from .metrics import METRICS, roomOf
+from .rechunk import AUDIO_DATA_TYPE, RATE
+from .spsc import SpscBuffer
+
+try:
+    import opuslib
+except Exception:
+    # opuslib raises a plain Exception when libopus itself is missing
+    opuslib = None
+
+logger = getLogger(__name__)
+
+TRANSMIT = "transmit"
+PLAYBACK = "playback"
+
+# Recordings are encoded in 20ms frames for speech, which is plenty for reviewing later
+RECORD_FRAME = 960
+RECORD_BITRATE = 24000
+# The encoder's lookahead at 48kHz, which players skip
+PRE_SKIP = 312
+# How much audio the audio threads can get ahead of the writer before it's dropped
+QUEUE_SECONDS = 10
+# How often the writer encodes what's been queued and writes it out, as one page per file
+WRITE_INTERVAL_SECONDS = 1
+
+OGG_BOS = 2
+OGG_EOS = 4
+EXTENSION = ".opus"
+
+
+def recorderAvailable() -> bool:
+    '''Recording needs opuslib, which pymumble installs, and libopus'''
+    return opuslib is not None
+
+
+def _crcTable() -> List[int]:
+    table = []
+    for i in range(256):
+        crc = i << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else (crc << 1)
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+
+CRC_TABLE = _crcTable()
+
+
+def oggCrc(data: bytes) -> int:
+    '''The CRC Ogg pages are checked with, which isn't zlib's'''
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ CRC_TABLE[(crc >> 24) ^ byte]
+    return crc
+
+
+class OggOpusWriter:
+    '''
+    Writes Opus packets to a file as an Ogg stream (RFC 7845).  Packets are held until
+    flush(), which writes them out as one page, so each batch is a single write.
+    '''
+    def __init__(self, file: BinaryIO, serial: int, pre_skip: int = PRE_SKIP, vendor: str = "rpi_intercom"):
+        self._file = file
+        self._serial = serial
+        self._sequence = 0
+        # Counts every sample decoded, including the pre-skip ones players leave out
+        self._granule = 0
+        # Each packet with the granule position at its end
+        self._packets: List[Tuple[bytes, int]] = []
+        self.bytes_written = 0
+        head = b"OpusHead" + struct.pack("<BBHIhB", 1, 1, pre_skip, RATE, 0, 0)
+        self._writePage([head], 0, OGG_BOS)
+        vendor_bytes = vendor.encode()
+        self._writePage([b"OpusTags" + struct.pack("<I", len(vendor_bytes)) + vendor_bytes + struct.pack("<I", 0)], 0, 0)
+
+    def add(self, packet: bytes, samples: int):
+        self._granule += samples
+        self._packets.append((packet, self._granule))
+
+    def flush(self):
+        if len(self._packets) > 0:
+            self._writePages(self._packets, 0)
+            self._packets = []
+
+    def close(self):
+        '''Writes what's left as the last page, which the file has to end with'''
+        self._writePages(self._packets, OGG_EOS)
+        self._packets = []
+
+    def _writePages(self, packets: List[Tuple[bytes, int]], flags: int):
+        # A page can only have 255 lacing values.  Packets are never split across pages, so
+        # each page's granule position is the end of its last packet.
+        page: List[bytes] = []
+        segments = 0
+        granule = self._granule
+        for packet, end in packets:
+            needed = len(packet) // 255 + 1
+            if segments + needed > 255:
+                self._writePage(page, granule, 0)
+                page = []
+                segments = 0
+            page.append(packet)
+            segments += needed
+            granule = end
+        self._writePage(page, granule, flags)
+
+    def _writePage(self, packets: List[bytes], granule: int, flags: int):
+        lacing = bytearray()
+        for packet in packets:
+            lacing.extend(b"\xff" * (len(packet) // 255))
+            lacing.append(len(packet) % 255)
+        header = struct.pack("<4sBBqIIIB", b"OggS", 0, flags, granule, self._serial, self._sequence, 0, len(lacing))
+        page = bytearray(header + lacing + b"".join(packets))
+        page[22:26] = struct.pack("<I", oggCrc(page))
+        self._file.write(page)
+        self._sequence += 1
+        self.bytes_written += len(page)
+
+
+class _Stream():
+    '''
+    One direction of audio: the lock-free buffer an audio thread hands frames to, and the
+    segment file the writer thread encodes them into
+    '''
+    def __init__(self, name: str, queue_samples: int):
+        self.name = name
+        self.buffer = SpscBuffer(queue_samples, dtype=AUDIO_DATA_TYPE)
+        self.pending = np.zeros(0, dtype=AUDIO_DATA_TYPE)
+        self.encoder = None
+        self.file: Optional[BinaryIO] = None
+        self.path: Optional[str] = None
+        self.writer: Optional[OggOpusWriter] = None
+        self.opened = 0.0
+
+
+class Recorder():
+    '''
+    Records what an endpoint transmits and what it plays into Ogg/Opus files in
+    record_dir, starting a new file every record_segment seconds and deleting the oldest
+    once there are more than record_max_size bytes of them or they're older than
+    record_max_age days.  Silence isn't recorded, so files only hold what was said.
+
+    The audio threads only copy their audio into a lock-free buffer, everything else
+    happens on the writer thread.  When the writer falls behind by more than
+    QUEUE_SECONDS the newest audio is dropped and counted rather than the buffer growing.
+    Each file is written once a second, and only synced to disk when it's finished
+    unless record_fsync is set, to spare SD cards.
+    '''
+    def __init__(self, config: Config, encoder_factory: Callable[[], object] = None, clock: Callable[[], float] = time.time, queue_seconds: float = QUEUE_SECONDS):
+        self._config = config
+        self._dir = config.record_dir
+        self._room = roomOf(config)
+        # Every room records into the same directory, and room names can have '-' in them,
+        # so only names exactly like _open() makes are this room's
+        self._pattern = re.compile(rf"{re.escape(self._room)}-({TRANSMIT}|{PLAYBACK})-\d{{8}}-\d{{6}}{re.escape(EXTENSION)}")
+        self._encoder_factory = encoder_factory if encoder_factory is not None else self._opusEncoder
+        self._clock = clock
+        self._streams: Dict[str, _Stream] = {name: _Stream(name, int(queue_seconds * RATE)) for name in (TRANSMIT, PLAYBACK)}
+        self._stop = Event()
+        self._thread: Thread = None
+        self._written = METRICS.counter("intercom_recorder_written_bytes_total", "Bytes of recordings written", room=self._room)
+        for name, stream in self._streams.items():
+            METRICS.counter("intercom_recorder_dropped_seconds_total", "Audio left out of recordings because the writer fell behind",
+                            source=lambda stream=stream: stream.buffer.overflowed_samples / RATE, room=self._room, stream=name)
+
+    @staticmethod
+    def _opusEncoder():
+        encoder = opuslib.Encoder(RATE, 1, opuslib.APPLICATION_VOIP)
+        encoder.bitrate = RECORD_BITRATE
+        return encoder
+
+    def transmitted(self, chunk: bytes):
+        '''16 bit PCM being sent to mumble, from the microphone thread'''
+        self._streams[TRANSMIT].buffer.push(np.frombuffer(chunk, dtype=AUDIO_DATA_TYPE))
+
+    def played(self, mixed: np.ndarray):
+        '''Audio being played, as floats, from the speaker thread'''
+        if not mixed.any():
+            return
+        self._streams[PLAYBACK].buffer.push((np.clip(mixed, -1, 1) * 32767).astype(AUDIO_DATA_TYPE))
+
+    def start(self):
+        try:
+            os.makedirs(self._dir, exist_ok=True)
+        except OSError as e:
+            # Not worth stopping the intercom for, the audio will just count as dropped
+            logger.error(f"Unable to record to {self._dir}: {e}")
+            return
+        self._expire()
+        self._stop.clear()
+        self._thread = Thread(target=self._writeLoop, name="Recorder", daemon=True)
+        self._thread.start()
+        logger.info(f"Recording to {self._dir}")
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _writeLoop(self):
+        while not self._stop.wait(WRITE_INTERVAL_SECONDS):
+            try:
+                self.write()
+            except Exception as e:
+                logger.printExceptionLimited(e)
+        try:
+            self.write()
+        finally:
+            for stream in self._streams.values():
+                self._close(stream)
+
+    def write(self):
+        '''Encodes and writes out everything queued, starting new files when it's time'''
+        now = self._clock()
+        rotated = False
+        for stream in self._streams.values():
+            if stream.file is not None and now - stream.opened >= self._config.record_segment:
+                self._close(stream)
+                rotated = True
+            samples = stream.buffer.pop(stream.buffer.length)
+            if len(samples) > 0:
+                stream.pending = np.concatenate((stream.pending, samples))
+            if len(stream.pending) < RECORD_FRAME:
+                continue
+            if stream.file is None:
+                self._open(stream, now)
+            frames = len(stream.pending) // RECORD_FRAME
+            for i in range(frames):
+                frame = stream.pending[i * RECORD_FRAME:(i + 1) * RECORD_FRAME]
+                stream.writer.add(stream.encoder.encode(frame.tobytes(), RECORD_FRAME), RECORD_FRAME)
+            stream.pending = stream.pending[frames * RECORD_FRAME:]
+            self._writeOut(stream, stream.writer.flush)
+        if rotated:
+            self._expire()
+
+    def _open(self, stream: _Stream, now: float):
+        name = f"{self._room}-{stream.name}-{datetime.fromtimestamp(now).strftime('%Y%m%d-%H%M%S')}{EXTENSION}"
+        stream.path = os.path.join(self._dir, name)
+        stream.file = open(stream.path, "ab")
+        stream.opened = now
+        # A fresh encoder for each file, so it doesn't start on the last one's state
+        stream.encoder = self._encoder_factory()
+        stream.writer = OggOpusWriter(stream.file, serial=int(now * 1000) & 0xFFFFFFFF)
+        logger.debug(f"Recording {stream.name} to {stream.path}")
+
+    def _close(self, stream: _Stream):
+        if stream.file is None:
+            return
+        if len(stream.pending) > 0:
+            # Pad out the last frame rather than lose the end of it
+            frame = np.zeros(RECORD_FRAME, dtype=AUDIO_DATA_TYPE)
+            frame[:len(stream.pending)] = stream.pending
+            stream.writer.add(stream.encoder.encode(frame.tobytes(), RECORD_FRAME), RECORD_FRAME)
+            stream.pending = np.zeros(0, dtype=AUDIO_DATA_TYPE)
+        self._writeOut(stream, stream.writer.close, sync=True)
+        try:
+            stream.file.close()
+        except OSError as e:
+            logger.errorLimited("Unable to close recording %s: %s", stream.path, e)
+        stream.file = None
+        stream.writer = None
+        stream.encoder = None
+
+    def _writeOut(self, stream: _Stream, write: Callable[[], None], sync: bool = False):
+        before = stream.writer.bytes_written
+        try:
+            write()
+            stream.file.flush()
+            if sync or self._config.record_fsync:
+                os.fsync(stream.file.fileno())
+        except OSError as e:
+            logger.errorLimited("Unable to write recording %s: %s", stream.path, e)
+        self._written.inc(stream.writer.bytes_written - before)
+
+    def recordings(self) -> List[Tuple[float, int, str]]:
+        '''This room's finished and unfinished recordings, oldest first, as (mtime, size, path)'''
+        found = []
+        try:
+            names = os.listdir(self._dir)
+        except OSError:
+            return found
+        for name in names:
+            if self._pattern.fullmatch(name):
+                path = os.path.join(self._dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, stat.st_size, path))
+        return sorted(found)
+
+    def _expire(self):
+        '''Deletes this room's oldest recordings until they're within record_max_age and record_max_size'''
+        recordings = self.recordings()
+        total = sum(size for _, size, _ in recordings)
+        # Files still being written count towards the total, but aren't deleted
+        recording = {stream.path for stream in self._streams.values() if stream.file is not None}
+        found = [entry for entry in recordings if entry[2] not in recording]
+        oldest = self._clock() - self._config.record_max_age * 24 * 60 * 60
+        for mtime, size, path in found:
+            if mtime >= oldest and total <= self._config.record_max_size:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                logger.info(f"Deleted old recording {path}")
+            except OSError as e:
+                logger.errorLimited("Unable to delete old recording %s: %s", path, e)
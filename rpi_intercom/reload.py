@@ -0,0 +1,81 @@
+import os
+from typing import Callable, Set
+import yaml
+from schema import SchemaError
+from .config import Config, Options, RESTART_OPTIONS
+from .logger import getLogger
+from .worker import Worker
+
+logger = getLogger(__name__)
+
+# How often the config file is checked for changes
+CONFIG_CHECK_SECONDS = 2
+CHECK_TASK = "check"
+
+
+class ConfigReloader():
+    '''
+    Reloads the config file when it's modified, or when reload() is called (on SIGHUP),
+    and updates the running config in place with whatever changed.  `apply` is then
+    called with the options that changed so each part of the intercom can pick them up
+    without restarting, eg moving channel, rebinding GPIO pins or reopening just the
+    device that changed.  Options in RESTART_OPTIONS are left alone with a warning.
+
+    A file that fails to load or validate is logged and ignored, the intercom keeps
+    running with what it had.
+    '''
+    def __init__(self, config: Config, apply: Callable[[Set[Options]], None], interval: float = CONFIG_CHECK_SECONDS):
+        self._config = config
+        self._apply = apply
+        self._interval = interval
+        self._worker = Worker("Config Reload")
+
+    def start(self):
+        if self._config.path is None:
+            return
+        self._worker.start()
+        self._worker.every(self._interval, self._check, key=CHECK_TASK)
+
+    def stop(self):
+        self._worker.stop()
+
+    def reload(self):
+        '''Reloads the config file even if it doesn't look modified, safe to call from a signal handler'''
+        if self._config.path is None:
+            logger.warning("There's no config file to reload")
+            return
+        self._worker.submit(0, self._load)
+
+    def _check(self):
+        try:
+            mtime = os.stat(self._config.path).st_mtime_ns
+        except OSError:
+            # Probably being replaced, look again next time
+            return
+        if mtime != self._config.mtime:
+            self._load()
+
+    def _load(self) -> Set[Options]:
+        path = self._config.path
+        try:
+            loaded = Config.fromFile(path)
+        except (OSError, yaml.YAMLError, SchemaError) as e:
+            logger.error(f"Unable to reload config from {path}, keeping the current config: {e}")
+            return set()
+        self._config.set_mtime(loaded.mtime)
+        changed = self._config.diff(loaded)
+        if len(changed) == 0:
+            return changed
+        restart = changed & RESTART_OPTIONS
+        if len(restart) > 0:
+            logger.warning(f"Restart the intercom for changes to {', '.join(sorted(option.value for option in restart))} to take effect")
+        changed = changed - restart
+        if len(changed) == 0:
+            return changed
+        logger.info(f"Reloaded config, applying changes to {', '.join(sorted(option.value for option in changed))}")
+        self._config.update(loaded, changed)
+        try:
+            self._apply(changed)
+        except Exception as e:
+            logger.printException(e)
+        return changed
@@ -1,5 +1,6 @@
 from asyncio import Event
-from typing import Any, Dict, List
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union, TYPE_CHECKING
 from aiohttp import web
 from aiohttp.web import Request
 from os.path import join, abspath
@@ -8,14 +9,21 @@ import asyncio
 import json
 import logging
 
-from .devices import Devices
-from .logger import getLogger, getHistory, ATTACHABLE
+from .config import Config
+from .logger import getLogger, getHistory, lastHistorySeq, ATTACHABLE
+from .metrics import METRICS
+from .profiler import Profiler, AUDIO_THREADS, DEFAULT_SECONDS
 from .shutdown import Shutdown
+from .status import StatusBus, getEncoder
+
+if TYPE_CHECKING:
+    from .endpoint import Endpoint
 
 logger = getLogger(__name__)
 class ClientConnection():
-    def __init__(self, ws: web.WebSocketResponse, handler):
+    def __init__(self, ws: web.WebSocketResponse, handler, encoder: Callable[[Any], Union[str, bytes]] = json.dumps):
         self._closed = Event()
+        self._encoder = encoder
         self._ws = ws
         self._write_queue = asyncio.Queue()
         self._read_loop_task = asyncio.create_task(self.read_loop())
@@ -41,7 +49,10 @@ class ClientConnection():
     async def write_loop(self):
         while self._running:
             item = await self._write_queue.get()
-            await self._ws.send_str(item)
+            if isinstance(item, bytes):
+                await self._ws.send_bytes(item)
+            else:
+                await self._ws.send_str(item)
 
     async def log(self, message):
         await self.queue({'type': 'log', 'log': message})
@@ -50,7 +61,11 @@ class ClientConnection():
         await self.queue(message)
 
     async def queue(self, message: Any):
-        await self._write_queue.put(json.dumps(message))
+        await self.queueEncoded(self._encoder(message))
+
+    async def queueEncoded(self, data: Union[str, bytes]):
+        '''Queues a message that has already been encoded, so it can be shared between connections'''
+        await self._write_queue.put(data)
         while self._write_queue.qsize() > 1000:
             # drop messages, just being defensive
             await self._write_queue.get()
@@ -59,70 +74,159 @@ class ClientConnection():
         await self._read_loop_task
 
 class Server():
-    def __init__(self, devices: Devices, shutdown: Shutdown):
-        self._connections: List[ClientConnection] = []
-        self._devices = devices
+    '''
+    The web interface for every endpoint.  Clients pick a room with ?room=name on any of
+    the websockets, without one they get the first.
+    '''
+    def __init__(self, endpoints: List['Endpoint'], shutdown: Shutdown, config: Config):
+        self._endpoints: Dict[str, 'Endpoint'] = {endpoint.name: endpoint for endpoint in endpoints}
+        self._default = endpoints[0]
+        self._connections: Dict[str, List[ClientConnection]] = {endpoint.name: [] for endpoint in endpoints}
+        self._level_connections: Dict[str, List[ClientConnection]] = {endpoint.name: [] for endpoint in endpoints}
         self._shutdown = shutdown
-        self._update = None
+        self._port = config.web_port
+        self._encoder = getEncoder(config.status_encoder)
+        # One profiler for the whole process, every room sees how it's going
+        self._profiler = Profiler(self.publish_profile)
 
     async def start(self):
         app = web.Application()
         app.add_routes([
             web.get('/ws', self.websocket_handler),
+            web.get('/levels', self.levels_handler),
+            web.get('/audio', self.audio_handler),
+            web.get('/talk', self.talk),
+            web.get('/metrics', self.metrics),
+            web.get('/profile', self.profile),
             web.get('/', self.index),
             web.static('/static', abspath(join(__file__, "..", "static")))
             ])
         runner = web.AppRunner(app)
         await runner.setup()
-        site = web.TCPSite(runner, "0.0.0.0", 8000)
+        site = web.TCPSite(runner, "0.0.0.0", self._port)
         await site.start()
         self._loop = asyncio.get_running_loop()
-        ATTACHABLE.attach(self.write_log)
-        self._update = asyncio.create_task(self.update_loop())
+        ATTACHABLE.attachBatch(self.write_logs)
+        for name, endpoint in self._endpoints.items():
+            endpoint.status.attach(partial(self.publish_status, name))
+            endpoint.status.start()
+            endpoint.levels.attach(partial(self.publish_levels, name))
+            endpoint.levels.start()
+            endpoint.web_audio.start()
 
-    def welcomeMessage(self):
+    def _endpoint(self, request: web.Request) -> 'Endpoint':
+        name = request.query.get("room")
+        if name is None:
+            return self._default
+        if name not in self._endpoints:
+            raise web.HTTPNotFound(text=f"There's no room called '{name}'")
+        return self._endpoints[name]
+
+    def welcomeMessage(self, endpoint: 'Endpoint', since: int = 0):
+        '''since is the last log sequence number a reconnecting client already has'''
+        if since > lastHistorySeq():
+            # History started over since the client last saw it, so send all of it
+            since = 0
         logs = []
-        for item in getHistory(0):
-            logs.append(item[1])
+        log_seq = since
+        for seq, line in getHistory(since):
+            logs.append(line)
+            log_seq = seq
         return {
-            'devices': self._devices._devices,
-            'speaker': self._devices._choosen_speaker,
-            'microphone': self._devices._choosen_microphone,
+            'room': endpoint.name,
+            'rooms': list(self._endpoints),
+            'devices': endpoint.devices._devices,
+            'speaker': endpoint.devices._choosen_speaker,
+            'microphone': endpoint.devices._choosen_microphone,
             'log': logs,
+            'log_seq': log_seq,
+            'status': endpoint.status.snapshot(),
         }
 
-    async def update_loop(self):
-        while True:
-            update = {
-                'type': 'status',
-                'vad': self._devices.vad,
-                'volume': self._devices.volume
-            }
-            for conn in self._connections:
-                await conn.send(update)
-            await asyncio.sleep(0.5)
-    
-    def write_log(self, message):
-        asyncio.run_coroutine_threadsafe(self._write_log(message), self._loop)
-
-    async def _write_log(self, message):
-        for conn in self._connections:
-            await conn.log(message)
+    async def publish_status(self, room: str, changes: Dict[str, Any]):
+        connections = self._connections[room]
+        if len(connections) == 0:
+            return
+        # Only the fields that changed, encoded once for everyone
+        data = self._encoder({'type': 'status', **changes})
+        await asyncio.gather(*[conn.queueEncoded(data) for conn in connections])
+
+    def publish_profile(self, status: Dict[str, Any]):
+        for endpoint in self._endpoints.values():
+            endpoint.status.publish(profile=status)
+
+    async def publish_levels(self, room: str, data: bytes):
+        await asyncio.gather(*[conn.queueEncoded(data) for conn in self._level_connections[room]])
+
+    def write_logs(self, messages: List[Tuple[Optional[int], str]]):
+        # One trip to the event loop for however many messages the log writer batched up
+        asyncio.run_coroutine_threadsafe(self._write_logs(messages), self._loop)
+
+    async def _write_logs(self, messages: List[Tuple[Optional[int], str]]):
+        # Logs are for the whole intercom, so every room gets them
+        connections = [conn for room in self._connections.values() for conn in room]
+        if len(connections) == 0:
+            return
+        encoded = [self._encoder({'type': 'log', 'log': message, 'seq': seq}) for seq, message in messages]
+        for data in encoded:
+            await asyncio.gather(*[conn.queueEncoded(data) for conn in connections])
 
     async def index(self, request: web.Request):
         return web.FileResponse(abspath(join(__file__, "..", "static", "index.html")))
 
+    async def talk(self, request: web.Request):
+        return web.FileResponse(abspath(join(__file__, "..", "static", "talk.html")))
+
+    async def metrics(self, request: web.Request):
+        '''Every room's counters, for Prometheus to scrape'''
+        return web.Response(text=METRICS.render(), headers={'Content-Type': "text/plain; version=0.0.4; charset=utf-8"})
+
+    async def profile(self, request: web.Request):
+        '''The last profile's samples as collapsed stacks, for flamegraph.pl or speedscope'''
+        if not self._profiler.status()['available']:
+            raise web.HTTPNotFound(text="There's no profile yet, start one from the web interface")
+        return web.Response(text=self._profiler.collapsed(), headers={
+            'Content-Disposition': f'attachment; filename="{self._profiler.filename()}"',
+        })
+
     async def websocket_handler(self, request: web.Request):
+        endpoint = self._endpoint(request)
         ws = web.WebSocketResponse()
         await ws.prepare(request)
-        conn = ClientConnection(ws, self.client_message)
-        await conn.queue({'type': 'init', 'data': self.welcomeMessage()})
-        self._connections.append(conn)
+        conn = ClientConnection(ws, partial(self.client_message, endpoint), self._encoder)
+        try:
+            since = int(request.query.get("since", 0))
+        except ValueError:
+            since = 0
+        await conn.queue({'type': 'init', 'data': self.welcomeMessage(endpoint, since)})
+        connections = self._connections[endpoint.name]
+        connections.append(conn)
         await conn.closed()
-        self._connections.remove(conn)
+        connections.remove(conn)
         return ws
 
-    async def client_message(self, ws, message: Dict[str, Any]):
+    async def levels_handler(self, request: web.Request):
+        '''Streams binary audio level envelopes, see levels.pack() for the format'''
+        endpoint = self._endpoint(request)
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        conn = ClientConnection(ws, self.levels_message, self._encoder)
+        connections = self._level_connections[endpoint.name]
+        connections.append(conn)
+        endpoint.levels.setActive(True)
+        await conn.closed()
+        connections.remove(conn)
+        endpoint.levels.setActive(len(connections) > 0)
+        return ws
+
+    async def audio_handler(self, request: web.Request):
+        return await self._endpoint(request).web_audio.handler(request)
+
+    async def levels_message(self, ws, message: Dict[str, Any]):
+        # Level clients only listen
+        pass
+
+    async def client_message(self, endpoint: 'Endpoint', ws, message: Dict[str, Any]):
         data_type = message.get("type")
         if data_type == "shutdown":
             logger.info("Web client requested a shutdown")
@@ -132,26 +236,39 @@ class Server():
             pass
         elif data_type == "reset":
             logger.info("Resetting sound devices")
-            self._devices.resetSpeaker()
-            self._devices.resetMic()
+            endpoint.devices.resetSpeaker()
+            endpoint.devices.resetMic()
         elif data_type == "volume_up":
-            if (self._devices.volume):
-                self._devices.set_volume(self._devices.volume + 5)
+            if (endpoint.devices.volume):
+                endpoint.devices.set_volume(endpoint.devices.volume + 5)
             else:
-                self._devices.set_volume(100)
+                endpoint.devices.set_volume(100)
         elif data_type == "volume_down":
-            if (self._devices.volume):
-                self._devices.set_volume(self._devices.volume - 5)
+            if (endpoint.devices.volume):
+                endpoint.devices.set_volume(endpoint.devices.volume - 5)
             else:
-                self._devices.set_volume(0)
+                endpoint.devices.set_volume(0)
         elif data_type == "set_speaker":
             device = message.get("speaker")
             if device == "null":
                 device = None
-            self._devices.set_speaker(device)
+            endpoint.devices.set_speaker(device)
         elif data_type == "set_microphone":
             device = message.get("speaker")
             if device == "null":
                 device = None
-            self._devices.set_microphone(device)
+            endpoint.devices.set_microphone(device)
+        elif data_type == "profile_start":
+            threads = message.get("threads")
+            if not isinstance(threads, list) or len(threads) == 0 or not all(isinstance(thread, str) for thread in threads):
+                threads = AUDIO_THREADS
+            try:
+                seconds = float(message.get("seconds", DEFAULT_SECONDS))
+            except (TypeError, ValueError):
+                seconds = DEFAULT_SECONDS
+            if not self._profiler.start(threads, seconds):
+                logger.warning("A profile is already running")
+        elif data_type == "profile_stop":
+            # Joining the sampler only takes as long as one sample
+            await asyncio.get_running_loop().run_in_executor(None, self._profiler.stop)
         
@@ -16,6 +16,7 @@ class Shutdown():
         self._shutdown_indicator = None
         self._shutdown_requested = None
         self._shutdown_taks = None
+        self._loop: asyncio.AbstractEventLoop = None
 
     @property
     def shutting_down(self):
@@ -24,14 +25,23 @@ class Shutdown():
     def start(self):
         self._shutdown_task = asyncio.create_task(self.watch_for_shutdown())
         self._shutdown_indicator = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
 
     async def wait_for_shutdown(self):
         await self._shutdown_indicator.wait()
 
     def shutdown(self):
+        '''Can be called from any thread'''
         logger.info("Shutdown was requested")
         self._shutdown_requested = datetime.utcnow()
-        self._shutdown_indicator.set()
+        try:
+            current = asyncio.get_running_loop()
+        except RuntimeError:
+            current = None
+        if self._loop is not None and current is not self._loop:
+            self._loop.call_soon_threadsafe(self._shutdown_indicator.set)
+        else:
+            self._shutdown_indicator.set()
 
     async def watch_for_shutdown(self):
         await self.wait_for_shutdown()
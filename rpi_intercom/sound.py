@@ -1,64 +1,173 @@
 from pickle import TRUE
 from threading import Lock, Thread
-from time import sleep
-from typing import Dict, List
+from time import sleep, monotonic
+from typing import Callable, Dict, Hashable, List, Set, TYPE_CHECKING
 import queue
 from contextlib import contextmanager
 from .config import Config
-from .mumble import Mumble
 from .control import Control
-from .devices import Devices
 from .speaker import Speaker
+from .talkers import TalkerPool
+from .realtime import Realtime
+from .levels import Levels, MICROPHONE, OUTPUT, TALKER_PREFIX
+from .spsc import SpscBuffer
+from .logger import getLogger
+from .metrics import METRICS, roomOf
 import numpy as np
 
+if TYPE_CHECKING:
+    # Only imported for type hints, so Sound can run against ProcessDevices or FakeDevices
+    # without ALSA or opus installed
+    from .mumble import Mumble
+    from .devices import Devices
+
+logger = getLogger(__name__)
+
+# How often the speaker thread checks for talkers that have gone quiet
+EVICT_INTERVAL_SECONDS = 5
+
 class Sound():
     '''
     Handles buffering audio between the speaker, microphone, and mumble.  Also mixes audio form Mumble in case there is more than oen speaker
     '''
-    def __init__(self, devices: Devices, mumble: Mumble, control: Control, config: Config):
+    def __init__(self, devices: 'Devices', mumble: 'Mumble', control: Control, config: Config, levels: Levels = None):
         
         self._audio_data_type = np.dtype(np.int16).newbyteorder('<')
         self._devices = devices
         self._mumble = mumble
         self._control = control
-        self._speakers: Dict[str, Speaker] = {}
+        self._talkers = TalkerPool(config.max_talkers, self._devices.chunk_size * 10, self._devices.chunk_size * 5)
+        self._realtime = Realtime(config)
+        self._levels = levels if levels is not None else Levels()
         self._microphone_thread: Thread = None
         self._speaker_thread: Thread = None
+        self._transmit_sources: Dict[Hashable, SpscBuffer] = {}
+        # Sources that are talking to mumble, which transmits them whatever the buttons say
+        self._transmit_holds: Set[Hashable] = set()
+        self._output_taps: List[Callable[[np.ndarray], None]] = []
         self._mumble._sound_callback = self._play
         self._running = False
 
+        room = roomOf(config)
+        self._speaker_errors = METRICS.counter("intercom_speaker_loop_errors_total", "Exceptions in the speaker thread, each one plays a chunk of silence", room=room)
+        METRICS.counter("intercom_talker_dropped_frames_total", "Frames from mumble users dropped because max_talkers were already talking", source=lambda: self._talkers.dropped, room=room)
+        METRICS.counter("intercom_talker_overflow_samples_total", "Samples from mumble users dropped because too much was buffered", source=lambda: self._talkers.buffer_stats[0], room=room)
+        METRICS.counter("intercom_talker_underrun_samples_total", "Silence played in the middle of someone talking because their audio was late", source=lambda: self._talkers.buffer_stats[1], room=room)
+        METRICS.gauge("intercom_talkers", "Mumble users with a speaker buffer", source=lambda: len(self._talkers), room=room)
+
     def _microphone_loop(self):
+        self._realtime.promoteThread()
         while(self._running):
             _length, chunk = self._devices.microphone_read()
             if chunk is not None:
-                self._mumble.transmit(chunk)
+                if self._levels.active:
+                    self._levels.push(MICROPHONE, np.frombuffer(chunk, dtype=self._audio_data_type))
+                held = len(self._transmit_holds) > 0
+                if len(self._transmit_sources) > 0:
+                    # Only a hold leaves the room's microphone out, transmitting sends both
+                    chunk = self._mixTransmitSources(chunk, microphone=self._control.transmitting or not held)
+                self._mumble.transmit(chunk, held)
             else:
                 sleep(0.1)
 
 
     def _speaker_loop(self):
+        self._realtime.promoteThread()
+        next_evict = monotonic() + EVICT_INTERVAL_SECONDS
         while(self._running):
             try:
                 toMix: List[bytes] = []
-                for speaker in self._speakers.values():
+                for speaker in self._talkers.active():
                     frame = speaker.read(self._devices.chunk_size)
                     if frame is not None:
                         toMix.append(frame)
+                        if self._levels.active:
+                            self._levels.push(TALKER_PREFIX + speaker.name, frame)
+                    else:
+                        self._talkers.idle(speaker)
+                if monotonic() > next_evict:
+                    self._talkers.evict()
+                    next_evict = monotonic() + EVICT_INTERVAL_SECONDS
                 if len(toMix) == 0 or self._control.deafened:
                     # There isn't any audio buffered from mumble, so just send
                     # silent audio data to the speaker.
                     self._control.recieving = False
-                    self._devices.speaker_write(np.zeros(self._devices.chunk_size))
+                    mixed = np.zeros(self._devices.chunk_size)
                 else:
                     mixed = self._mix(toMix)
                     self._control.recieving = True
-                    self._devices.speaker_write(mixed)
+                if self._levels.active:
+                    self._levels.push(OUTPUT, mixed)
+                for tap in self._output_taps:
+                    tap(mixed)
+                self._devices.speaker_write(mixed)
             except Exception as e:
-                print(e)
+                self._speaker_errors.inc()
+                logger.printExceptionLimited(e)
                 self._control.recieving = False
                 self._devices.speaker_write(np.zeros(self._devices.chunk_size))
             
 
+    def _mixTransmitSources(self, chunk: bytes, microphone: bool = True) -> bytes:
+        samples = np.frombuffer(chunk, dtype=self._audio_data_type)
+        toMix = [samples.astype(float) / 32768] if microphone else []
+        for source in list(self._transmit_sources.values()):
+            if source.length > 0:
+                data = source.pop(len(samples))
+                if len(data) < len(samples):
+                    data = np.concatenate((data, np.zeros(len(samples) - len(data))))
+                toMix.append(data)
+        if microphone and len(toMix) == 1:
+            return chunk
+        if len(toMix) == 0:
+            return bytes(len(chunk))
+        mixed = self._mix(toMix)
+        return (np.clip(mixed, -1, 1) * 32767).astype(self._audio_data_type).tobytes()
+
+    def addTransmitSource(self, key: Hashable, max_samples: int) -> SpscBuffer:
+        '''
+        Adds a source of audio (eg a browser's microphone) that gets mixed into what the
+        microphone transmits to mumble.  Push floats into the returned buffer from a
+        single thread.
+        '''
+        source = SpscBuffer(max_samples)
+        self._transmit_sources[key] = source
+        return source
+
+    def removeTransmitSource(self, key: Hashable):
+        self._transmit_sources.pop(key, None)
+        self._transmit_holds.discard(key)
+
+    def holdTransmit(self, key: Hashable, held: bool):
+        '''
+        While any source holds transmit, what they push is sent to mumble even when the
+        buttons aren't transmitting, without the room's microphone.  Each key holds once,
+        so a client letting go doesn't affect the others.
+        '''
+        if held:
+            self._transmit_holds.add(key)
+        else:
+            self._transmit_holds.discard(key)
+
+    @property
+    def transmit_held(self) -> bool:
+        return len(self._transmit_holds) > 0
+
+    def addOutputTap(self, tap: Callable[[np.ndarray], None]):
+        '''
+        tap(mixed) is called from the speaker thread with every chunk sent to the speaker,
+        as floats between -1 and 1.  It must not block.
+        '''
+        self._output_taps.append(tap)
+
+    def playLocal(self, session: Hashable, name: str, frame: bytes):
+        '''
+        Buffer 16 bit PCM to be mixed into the speaker output like a mumble user's audio
+        '''
+        if self._control.deafened:
+            return
+        self._talkers.buffer(session, name, frame)
+
     def _mix(self, sources: np.ndarray):
         """
         This implements a very simple and widely recognized mixing method that also
@@ -108,8 +217,4 @@ class Sound():
 
         # Keep track of audio chunks recieved per user so we can mix together 
         # audio sources later if necessary
-        name = user['name']
-        if name not in self._speakers:
-            self._speakers[name] = Speaker(name, self._devices.chunk_size * 10, self._devices.chunk_size * 5)
-
-        self._speakers[name].buffer(frame)
+        self._talkers.buffer(user['session'], user['name'], frame)
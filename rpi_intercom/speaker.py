@@ -1,41 +1,82 @@
 import datetime
-from threading import Lock
-from .circular_buffer import Buffer
+import time
+from .spsc import SpscBuffer
 import numpy as np
 from .logger import getLogger
 
 logger = getLogger(__name__)
 
 class Speaker:
-    """Represents a speaker, as in a channel of audio from one person on Mumble"""
-    def __init__(self, name: str, max_buffer, ideal_buffer):
+    """
+    Represents a speaker, as in a channel of audio from one person on Mumble.  Audio is
+    buffered on pymumble's thread and read on the speaker thread through a lock-free
+    buffer, so neither thread ever has to wait for the other.
+    """
+    def __init__(self, name: str, max_buffer, ideal_buffer, session: int = None):
         self._name = name
-        self._buffer = Buffer(max_buffer)
-        self._lock = Lock()
+        self._session = session
+        self._buffer = SpscBuffer(max_buffer)
         self._ideal_buffer = ideal_buffer
         self._missed = True
         self._started_talking = False
+        self._last_buffered = time.monotonic()
         self._audio_data_type = np.dtype(np.int16).newbyteorder('<')
 
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def session(self) -> int:
+        return self._session
+
+    @property
+    def length(self) -> int:
+        """The number of samples buffered"""
+        return self._buffer.length
+
+    @property
+    def buffer_stats(self):
+        """Audio dropped because the buffer was full, and reads the buffer couldn't fill, in samples"""
+        return self._buffer.overflowed_samples, self._buffer.underflowed_samples
+
+    @property
+    def last_buffered(self) -> float:
+        """The time.monotonic() timestamp of the last audio recieved"""
+        return self._last_buffered
+
+    def reset(self, session: int, name: str):
+        """
+        Clear the buffer so this speaker can be reused for a different person.  Only
+        safe while nobody is buffering or reading audio on it.
+        """
+        self._session = session
+        self._name = name
+        self._buffer.clear()
+        self._missed = True
+        self._started_talking = False
+        self._last_buffered = time.monotonic()
+
     def buffer(self, data: bytes):
-        with self._lock:
-            # Convert 16 bit int data to floats in the range (-1, 1)
-            self._buffer.push(np.frombuffer(data, dtype=self._audio_data_type).astype(float) / 32768)
-            if self._buffer.length >= self._ideal_buffer:
-                self._missed = False
+        # Convert 16 bit int data to floats in the range (-1, 1)
+        self._buffer.push(np.frombuffer(data, dtype=self._audio_data_type).astype(float) / 32768)
+        self._last_buffered = time.monotonic()
 
     def read(self, size):
-        with self._lock:
-            if not self._missed and self._buffer.length > 0:
-                if not self._started_talking:
-                    logger.info(f"{self._name} started talking")
-                    self._started_talking = True
-                ret = self._buffer.pop(size)
-                if len(ret) < size:
-                    ret = np.concatenate((ret, np.zeros(size - len(ret))), axis=None)
-                return ret
-            if not self._missed:
-                logger.info(f"{self._name} stopped talking")
-            self._missed = True
-            self._started_talking = False
-            return None
\ No newline at end of file
+        # Only the reading thread touches _missed, so wait to start playing here
+        # rather than in buffer()
+        if self._missed and self._buffer.length >= self._ideal_buffer:
+            self._missed = False
+        if not self._missed and self._buffer.length > 0:
+            if not self._started_talking:
+                logger.info(f"{self._name} started talking")
+                self._started_talking = True
+            ret = self._buffer.pop(size)
+            if len(ret) < size:
+                ret = np.concatenate((ret, np.zeros(size - len(ret))), axis=None)
+            return ret
+        if not self._missed:
+            logger.info(f"{self._name} stopped talking")
+        self._missed = True
+        self._started_talking = False
+        return None
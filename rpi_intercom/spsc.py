@@ -0,0 +1,72 @@
+import numpy as np
+
+class SpscBuffer:
+    """
+    A single-producer/single-consumer ring buffer that never takes a lock.  One thread
+    may push while another pops, and neither ever waits on the other.
+
+    The producer only ever writes the data and then advances the write index, the
+    consumer only ever reads the data and then advances the read index.  The indexes
+    only ever increase (python ints don't overflow) and assigning one is atomic, so each
+    side sees either the old or the new position of the other and never a half-written
+    chunk.  When the buffer is full the producer drops what it can't fit rather than
+    moving the consumer's index, and both sides count what they lost.
+    """
+    def __init__(self, length: int, dtype=float):
+        self.max_length: int = length
+        self.arr = np.zeros(self.max_length, dtype=dtype)
+        self._write: int = 0
+        self._read: int = 0
+        self.overflows: int = 0
+        self.overflowed_samples: int = 0
+        self.underflows: int = 0
+        self.underflowed_samples: int = 0
+
+    @property
+    def length(self) -> int:
+        return self._write - self._read
+
+    def push(self, data: np.ndarray) -> int:
+        """
+        Producer side.  Returns how many samples were actually buffered.
+        """
+        write = self._write
+        free = self.max_length - (write - self._read)
+        amount = len(data)
+        if amount > free:
+            self.overflows += 1
+            self.overflowed_samples += amount - free
+            amount = free
+        if amount == 0:
+            return 0
+        start = write % self.max_length
+        first = min(amount, self.max_length - start)
+        self.arr[start:start + first] = data[:first]
+        self.arr[0:amount - first] = data[first:amount]
+        # Publish the data only once it has been copied in
+        self._write = write + amount
+        return amount
+
+    def pop(self, amount: int) -> np.ndarray:
+        """
+        Consumer side.  Returns up to amount samples, fewer if the buffer runs dry.
+        """
+        read = self._read
+        available = self._write - read
+        if amount > available:
+            self.underflows += 1
+            self.underflowed_samples += amount - available
+            amount = available
+        ret = np.empty(amount, dtype=self.arr.dtype)
+        start = read % self.max_length
+        first = min(amount, self.max_length - start)
+        ret[0:first] = self.arr[start:start + first]
+        ret[first:] = self.arr[0:amount - first]
+        self._read = read + amount
+        return ret
+
+    def clear(self):
+        """
+        Consumer side, or when neither side is using the buffer.
+        """
+        self._read = self._write
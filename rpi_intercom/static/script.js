@@ -1,8 +1,14 @@
+// With several rooms the page is opened as /?room=name, and every socket asks for that room
+const ROOM = new URLSearchParams(location.search).get("room");
+const ROOM_QUERY = ROOM === null ? "" : "room=" + encodeURIComponent(ROOM);
+
 class Console {
     constructor() {
         this.logBox = document.getElementById("log");
         this.vad = document.getElementById("vad");
         this.volume = document.getElementById("volume");
+        this.state = document.getElementById("state");
+        this.flags = {};
     }
 
     log(message) {
@@ -37,6 +43,17 @@ class Console {
             this.volume.innerText = "?";
         }
     }
+
+    update_flag(name, value) {
+        this.flags[name] = value;
+        let active = [];
+        for (let flag of ["connected", "transmitting", "receiving", "deafened"]) {
+            if (this.flags[flag]) {
+                active.push(flag);
+            }
+        }
+        this.state.innerText = active.join(", ");
+    }
 }
 
 class Connection {
@@ -48,7 +65,8 @@ class Connection {
     }
 
     reinitialize() {
-        this.socket = new WebSocket("ws://" + location.host + "/ws");
+        // Only ask for the log lines we missed while disconnected
+        this.socket = new WebSocket("ws://" + location.host + "/ws?since=" + this.handler.log_seq + (ROOM_QUERY ? "&" + ROOM_QUERY : ""));
         let myself = this;
 
         this.socket.onclose = function(event) {
@@ -89,10 +107,97 @@ class Connection {
     }
 }
 
+// Scrolling peak/RMS envelopes for each audio source, streamed as binary frames from
+// /levels.  See levels.py for the frame format.
+class Meters {
+    constructor() {
+        this.canvas = document.getElementById("meters");
+        this.history = 100;
+        this.rowHeight = 30;
+        this.sources = {};
+        this.reinitialize();
+        let myself = this;
+        window.requestAnimationFrame(function() { myself.draw(); });
+    }
+
+    reinitialize() {
+        this.socket = new WebSocket("ws://" + location.host + "/levels" + (ROOM_QUERY ? "?" + ROOM_QUERY : ""));
+        this.socket.binaryType = "arraybuffer";
+        let myself = this;
+        this.socket.onmessage = function(event) {
+            myself.onMessage(event.data);
+        };
+        this.socket.onclose = function(event) {
+            setTimeout(function() { myself.reinitialize(); }, 1000);
+        };
+    }
+
+    onMessage(buffer) {
+        let view = new DataView(buffer);
+        let offset = 3;
+        let count = view.getUint8(2);
+        let decoder = new TextDecoder();
+        for (let i = 0; i < count; i++) {
+            let nameLength = view.getUint8(offset);
+            offset += 1;
+            let name = decoder.decode(new Uint8Array(buffer, offset, nameLength));
+            offset += nameLength;
+            let points = view.getUint16(offset, true);
+            offset += 2;
+            if (!(name in this.sources)) {
+                this.sources[name] = {'peak': [], 'rms': []};
+            }
+            let source = this.sources[name];
+            for (let j = 0; j < points; j++) {
+                source.peak.push(view.getInt16(offset, true) / 32767);
+                source.rms.push(view.getInt16(offset + 2, true) / 32767);
+                offset += 4;
+            }
+            source.peak.splice(0, Math.max(0, source.peak.length - this.history));
+            source.rms.splice(0, Math.max(0, source.rms.length - this.history));
+            source.updated = Date.now();
+        }
+    }
+
+    draw() {
+        let now = Date.now();
+        for (let name in this.sources) {
+            if (now - this.sources[name].updated > 5000) {
+                delete this.sources[name];
+            }
+        }
+        let names = Object.keys(this.sources).sort();
+        this.canvas.height = Math.max(1, names.length) * this.rowHeight;
+        let context = this.canvas.getContext("2d");
+        let labelWidth = 150;
+        let barWidth = (this.canvas.width - labelWidth) / this.history;
+        context.fillStyle = "black";
+        context.fillRect(0, 0, this.canvas.width, this.canvas.height);
+        for (let row = 0; row < names.length; row++) {
+            let source = this.sources[names[row]];
+            let middle = row * this.rowHeight + this.rowHeight / 2;
+            context.fillStyle = "white";
+            context.fillText(names[row], 5, middle + 4);
+            let start = labelWidth + (this.history - source.peak.length) * barWidth;
+            for (let i = 0; i < source.peak.length; i++) {
+                let peak = source.peak[i] * this.rowHeight / 2;
+                let rms = source.rms[i] * this.rowHeight / 2;
+                context.fillStyle = source.peak[i] >= 0.99 ? "red" : "#3a7";
+                context.fillRect(start + i * barWidth, middle - peak, barWidth, peak * 2);
+                context.fillStyle = "#7f7";
+                context.fillRect(start + i * barWidth, middle - rms, barWidth, rms * 2);
+            }
+        }
+        let myself = this;
+        window.requestAnimationFrame(function() { myself.draw(); });
+    }
+}
+
 class Main {
     constructor() {
-        this.url = "ws://" + location.host + "/ws";
+        this.url = "ws://" + location.host + "/ws" + (ROOM_QUERY ? "?" + ROOM_QUERY : "");
         this.log = new Console();
+        this.log_seq = 0;
         this.conn = new Connection(this, this.log);
         this.freeze = false;
     }
@@ -100,20 +205,68 @@ class Main {
     onMessage(event) {
         let data = JSON.parse(event.data);
         if (data.type == "log") {
+            if (data.seq != null) {
+                if (data.seq <= this.log_seq) {
+                    // Already got it with the history
+                    return;
+                }
+                this.log_seq = data.seq;
+            }
             this.log.log(data.log);
         } else if (data.type == "init") {
             this.initialize(data.data);
         } else if (data.type == "status") {
-            this.log.update_vad(data.vad);
-            this.log.update_volume(data.volume);
+            this.update_status(data);
         } else {
             console.log("Unknown message: " + event.data);
         }
         return;
     }
 
+    update_status(status) {
+        // Status messages only carry the fields that changed
+        if ("vad" in status) {
+            this.log.update_vad(status.vad);
+        }
+        if ("volume" in status) {
+            this.log.update_volume(status.volume);
+        }
+        for (let flag of ["connected", "transmitting", "receiving", "deafened"]) {
+            if (flag in status) {
+                this.log.update_flag(flag, status[flag]);
+            }
+        }
+        if ("profile" in status) {
+            this.update_profile(status.profile);
+        }
+    }
+
+    update_profile(profile) {
+        let text = profile.threads.join(", ") + ": " + profile.samples + " samples every " + profile.interval_ms + "ms";
+        if (profile.running) {
+            text = "Profiling " + text + " (" + profile.elapsed + "/" + profile.seconds + "s)";
+        }
+        document.getElementById("profile-status").innerText = text;
+        let download = document.getElementById("profile-download");
+        download.hidden = profile.running || !profile.available;
+    }
+
     initialize(data) {
         this.freeze = true;
+        let rooms = document.getElementById("rooms");
+        rooms.textContent = "";
+        if (data.rooms.length > 1) {
+            rooms.append("Room: ");
+            for (const room of data.rooms) {
+                let link = document.createElement("a");
+                link.href = "/?room=" + encodeURIComponent(room);
+                link.textContent = room;
+                if (room == data.room) {
+                    link.classList.add("current");
+                }
+                rooms.append(link, " ");
+            }
+        }
         let inputSelect = document.getElementById("input-device");
         let outputSelect = document.getElementById("output-device");
         while (inputSelect.firstChild) {
@@ -148,11 +301,15 @@ class Main {
         document.getElementById("shutdown-button").onclick = function() { myself.shutdown()};
         document.getElementById("volume-up").onclick = function() { myself.volume_up()};
         document.getElementById("volume-down").onclick = function() { myself.volume_down()};
+        document.getElementById("profile-start").onclick = function() { myself.profile_start()};
+        document.getElementById("profile-stop").onclick = function() { myself.profile_stop()};
         inputSelect.onchange = function() { myself.set_microphone()};
         outputSelect.onchange = function() { myself.set_speaker()};
         for (let i = 0 ; i < data.log.length; i++) {
             this.log.log(data.log[i]);
         }
+        this.log_seq = data.log_seq;
+        this.update_status(data.status);
         this.freeze = false;
     }
 
@@ -172,6 +329,15 @@ class Main {
         this.conn.send({'type': 'volume_down'})
     }
 
+    profile_start(){
+        let seconds = parseFloat(document.getElementById("profile-seconds").value);
+        this.conn.send({'type': 'profile_start', 'seconds': isNaN(seconds) ? 30 : seconds})
+    }
+
+    profile_stop(){
+        this.conn.send({'type': 'profile_stop'})
+    }
+
     set_speaker(){
         if (!this.freeze) {
             let device = document.getElementById("output-device");
@@ -190,4 +356,5 @@ class Main {
 window.addEventListener('load', (event) => {
     console.log('The page has fully loaded');
     new Main();
+    new Meters();
 });
\ No newline at end of file
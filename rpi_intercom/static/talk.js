@@ -0,0 +1,156 @@
+// Listens to and talks through the intercom over /audio.  Every binary frame starts with a
+// uint32 sequence number followed by 16 bit mono PCM at 48kHz, in both directions.
+const RATE = 48000;
+// Scheduled playback is kept between these, in seconds
+const MIN_BUFFER = 0.05;
+const MAX_BUFFER = 0.3;
+// Opened as /talk?room=name to talk through one of several rooms
+const ROOM = new URLSearchParams(location.search).get("room");
+
+class Talk {
+    constructor() {
+        this.context = null;
+        this.listening = false;
+        this.talking = false;
+        this.nextTime = 0;
+        this.sendSequence = 0;
+        this.received = 0;
+        this.skipped = 0;
+        this.microphone = null;
+        this.stats = document.getElementById("stats");
+        let myself = this;
+        let talk = document.getElementById("talk");
+        document.getElementById("listen").onclick = function() { myself.toggleListen(); };
+        talk.onpointerdown = function() { myself.setTalking(true); };
+        talk.onpointerup = function() { myself.setTalking(false); };
+        talk.onpointerleave = function() { myself.setTalking(false); };
+        this.connect();
+    }
+
+    connect() {
+        this.socket = new WebSocket("ws://" + location.host + "/audio" + (ROOM === null ? "" : "?room=" + encodeURIComponent(ROOM)));
+        this.socket.binaryType = "arraybuffer";
+        let myself = this;
+        this.socket.onopen = function() {
+            if (myself.listening) {
+                myself.send({'type': 'listen', 'active': true});
+            }
+        };
+        this.socket.onmessage = function(event) { myself.onMessage(event); };
+        this.socket.onclose = function() {
+            setTimeout(function() { myself.connect(); }, 1000);
+        };
+    }
+
+    send(message) {
+        if (this.socket.readyState == WebSocket.OPEN) {
+            this.socket.send(JSON.stringify(message));
+        }
+    }
+
+    audioContext() {
+        if (this.context == null) {
+            this.context = new AudioContext({'sampleRate': RATE, 'latencyHint': 'interactive'});
+        }
+        this.context.resume();
+        return this.context;
+    }
+
+    buffered() {
+        if (this.context == null) {
+            return 0;
+        }
+        return Math.max(0, this.nextTime - this.context.currentTime);
+    }
+
+    onMessage(event) {
+        if (typeof event.data == "string") {
+            let data = JSON.parse(event.data);
+            if (data.type == "ping") {
+                this.send({'type': 'pong', 't': data.t, 'buffered': this.buffered()});
+            }
+            return;
+        }
+        if (!this.listening) {
+            return;
+        }
+        this.received++;
+        let pcm = new Int16Array(event.data, 4);
+        let context = this.audioContext();
+        let buffer = context.createBuffer(1, pcm.length, RATE);
+        let samples = buffer.getChannelData(0);
+        for (let i = 0; i < pcm.length; i++) {
+            samples[i] = pcm[i] / 32768;
+        }
+        let now = context.currentTime;
+        if (this.nextTime < now + MIN_BUFFER / 2) {
+            // Ran dry, start over with a little cushion
+            this.nextTime = now + MIN_BUFFER;
+        } else if (this.nextTime > now + MAX_BUFFER) {
+            // Too far behind, drop this chunk to catch up
+            this.skipped++;
+            return;
+        }
+        let source = context.createBufferSource();
+        source.buffer = buffer;
+        source.connect(context.destination);
+        source.start(this.nextTime);
+        this.nextTime += buffer.duration;
+        this.stats.innerText = "Received: " + this.received + "  Skipped: " + this.skipped +
+            "  Buffered: " + Math.round(this.buffered() * 1000) + "ms";
+    }
+
+    toggleListen() {
+        this.listening = !this.listening;
+        if (this.listening) {
+            this.audioContext();
+        }
+        document.getElementById("listen").innerText = this.listening ? "Stop Listening" : "Listen";
+        this.send({'type': 'listen', 'active': this.listening});
+    }
+
+    async startMicrophone() {
+        let context = this.audioContext();
+        let stream = await navigator.mediaDevices.getUserMedia({'audio': {'channelCount': 1, 'echoCancellation': true}});
+        let input = context.createMediaStreamSource(stream);
+        let processor = context.createScriptProcessor(1024, 1, 1);
+        let myself = this;
+        processor.onaudioprocess = function(event) {
+            if (!myself.talking || myself.socket.readyState != WebSocket.OPEN) {
+                return;
+            }
+            let samples = event.inputBuffer.getChannelData(0);
+            let frame = new ArrayBuffer(4 + samples.length * 2);
+            new DataView(frame).setUint32(0, myself.sendSequence++, true);
+            let pcm = new Int16Array(frame, 4);
+            for (let i = 0; i < samples.length; i++) {
+                pcm[i] = Math.max(-1, Math.min(1, samples[i])) * 32767;
+            }
+            myself.socket.send(frame);
+        };
+        input.connect(processor);
+        processor.connect(context.destination);
+        this.microphone = processor;
+    }
+
+    async setTalking(talking) {
+        if (talking == this.talking) {
+            return;
+        }
+        if (talking && this.microphone == null) {
+            try {
+                await this.startMicrophone();
+            } catch (e) {
+                this.stats.innerText = "Couldn't open the microphone: " + e;
+                return;
+            }
+        }
+        this.talking = talking;
+        document.getElementById("talk").classList.toggle("active", talking);
+        this.send({'type': 'talk', 'active': talking, 'route': document.getElementById("route").value});
+    }
+}
+
+window.addEventListener('load', (event) => {
+    new Talk();
+});
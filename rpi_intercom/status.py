@@ -0,0 +1,114 @@
+import asyncio
+import json
+from threading import Lock
+from time import monotonic
+from typing import Any, Awaitable, Callable, Dict, List, Union
+from .logger import getLogger
+
+logger = getLogger(__name__)
+
+# The most often status updates get sent, changes in between are coalesced
+MIN_INTERVAL_SECONDS = 0.05
+
+
+def _orjson(message: Any) -> str:
+    import orjson
+    return orjson.dumps(message).decode("utf-8")
+
+
+# Encoders turn a message into a websocket frame.  str becomes a text frame and bytes a
+# binary one.
+ENCODERS: Dict[str, Callable[[Any], Union[str, bytes]]] = {
+    "json": json.dumps,
+    "orjson": _orjson,
+}
+
+
+def getEncoder(name: str) -> Callable[[Any], Union[str, bytes]]:
+    if name == "orjson":
+        try:
+            import orjson
+        except ImportError:
+            logger.warning("orjson isn't installed, falling back to json for status updates")
+            return ENCODERS["json"]
+    return ENCODERS[name]
+
+
+class StatusBus():
+    '''
+    Collects the intercom's status (vad, volume, transmitting, etc) from whatever thread
+    changes it and tells listeners on the event loop about the fields that changed.
+    publish() is cheap and can be called as often as values are computed, since only
+    real changes are kept and they're delivered at most every `min_interval` seconds,
+    with any changes in between merged together.
+    '''
+    def __init__(self, min_interval: float = MIN_INTERVAL_SECONDS):
+        self._min_interval = min_interval
+        self._lock = Lock()
+        self._state: Dict[str, Any] = {}
+        self._pending: Dict[str, Any] = {}
+        self._listeners: List[Callable[[Dict[str, Any]], Awaitable[None]]] = []
+        self._loop: asyncio.AbstractEventLoop = None
+        self._wake: asyncio.Event = None
+        self._scheduled = False
+        self._last_sent = 0
+        self._task = None
+
+    def attach(self, listener: Callable[[Dict[str, Any]], Awaitable[None]]):
+        self._listeners.append(listener)
+
+    def start(self):
+        '''Starts delivering changes, must be called from the event loop'''
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._deliverLoop())
+        with self._lock:
+            if len(self._pending) > 0:
+                self._scheduled = True
+                self._wake.set()
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def publish(self, **values):
+        with self._lock:
+            for key, value in values.items():
+                if key in self._state and self._state[key] == value:
+                    continue
+                self._state[key] = value
+                self._pending[key] = value
+            if len(self._pending) == 0 or self._scheduled or self._loop is None:
+                return
+            self._scheduled = True
+        try:
+            self._loop.call_soon_threadsafe(self._wake.set)
+        except RuntimeError:
+            # The loop has closed, so there is nobody left to tell
+            pass
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._state)
+
+    async def _deliverLoop(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            delay = self._last_sent + self._min_interval - monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            with self._lock:
+                changes = self._pending
+                self._pending = {}
+                self._scheduled = False
+            if len(changes) == 0:
+                continue
+            self._last_sent = monotonic()
+            for listener in self._listeners:
+                try:
+                    await listener(changes)
+                except Exception as e:
+                    logger.error("Status listener raised an exception")
+                    logger.printException(e)
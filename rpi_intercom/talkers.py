@@ -0,0 +1,114 @@
+import time
+from threading import Lock
+from typing import Dict, List, Optional
+from .speaker import Speaker
+from .logger import getLogger
+
+logger = getLogger(__name__)
+
+# How long a talker can go without sending audio before its Speaker is returned to the pool
+TALKER_IDLE_SECONDS = 30
+
+
+class TalkerPool:
+    '''
+    Hands out Speakers to remote users from a fixed, preallocated pool.  Talkers are keyed by
+    their mumble session id rather than their name so renames and reconnects don't leak
+    entries, and go back to the pool once they've been quiet for TALKER_IDLE_SECONDS.
+
+    Audio is buffered from pymumble's thread and read on the speaker thread.  The pymumble
+    side never takes the pool's lock unless it needs a new Speaker, and the speaker thread
+    only iterates over talkers that currently have audio buffered.
+    '''
+    def __init__(self, size: int, max_buffer: int, ideal_buffer: int, idle_timeout: float = TALKER_IDLE_SECONDS):
+        self._speakers: List[Speaker] = [Speaker(None, max_buffer, ideal_buffer) for _ in range(size)]
+        self._free: List[Speaker] = list(self._speakers)
+        self._talkers: Dict[int, Speaker] = {}
+        self._active: Dict[int, Speaker] = {}
+        self._lock = Lock()
+        self._idle_timeout = idle_timeout
+        self._dropped = 0
+
+    @property
+    def dropped(self) -> int:
+        '''Frames that were thrown away because every Speaker in the pool was in use'''
+        return self._dropped
+
+    @property
+    def buffer_stats(self):
+        '''Samples dropped because a talker's buffer was full, and padded because it ran short, over every Speaker'''
+        stats = [speaker.buffer_stats for speaker in self._speakers]
+        return sum(overflowed for overflowed, _ in stats), sum(underflowed for _, underflowed in stats)
+
+    def __len__(self):
+        return len(self._talkers)
+
+    def buffer(self, session: int, name: str, frame: bytes):
+        '''
+        Buffer audio recieved from a user.  Called from pymumble's thread.
+        '''
+        speaker = self._talkers.get(session)
+        if speaker is None or speaker.session != session:
+            speaker = self._allocate(session, name)
+            if speaker is None:
+                return
+        speaker.buffer(frame)
+        self._active[session] = speaker
+
+    def active(self) -> List[Speaker]:
+        '''
+        Speakers that have buffered audio.  Called from the speaker thread.
+        '''
+        speakers = []
+        for session, speaker in list(self._active.items()):
+            if speaker.session == session:
+                speakers.append(speaker)
+            else:
+                # Left behind by pymumble buffering audio while the speaker was evicted
+                self._active.pop(session, None)
+        return speakers
+
+    def idle(self, speaker: Speaker):
+        '''
+        Called from the speaker thread once a Speaker has nothing left to play.
+        '''
+        session = speaker.session
+        if self._active.get(session) is speaker:
+            del self._active[session]
+        if speaker.length > 0 and speaker.session == session:
+            # pymumble buffered more audio while we were removing it
+            self._active[session] = speaker
+
+    def evict(self, now: Optional[float] = None):
+        '''
+        Return Speakers that have been quiet for too long to the pool.  Called from the speaker thread.
+        '''
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            for session, speaker in list(self._talkers.items()):
+                if now - speaker.last_buffered > self._idle_timeout:
+                    self._release(session, speaker)
+
+    def _allocate(self, session: int, name: str) -> Optional[Speaker]:
+        with self._lock:
+            if len(self._free) == 0:
+                # Make room by evicting whichever idle talker was heard from longest ago
+                idle = [(speaker.last_buffered, session) for session, speaker in self._talkers.items() if session not in self._active]
+                if len(idle) == 0:
+                    if self._dropped == 0:
+                        logger.warning(f"Too many people are talking at once, audio from {name} will be dropped")
+                    self._dropped += 1
+                    return None
+                _, oldest = min(idle)
+                self._release(oldest, self._talkers[oldest])
+            speaker = self._free.pop()
+            speaker.reset(session, name)
+            self._talkers[session] = speaker
+            return speaker
+
+    def _release(self, session: int, speaker: Speaker):
+        del self._talkers[session]
+        if self._active.get(session) is speaker:
+            del self._active[session]
+        speaker.reset(None, None)
+        self._free.append(speaker)
@@ -0,0 +1,81 @@
+import queue
+import time
+from collections import deque
+from threading import Condition
+from typing import Callable, Deque, Tuple
+from .rechunk import RATE
+
+# 16 bit mono
+SAMPLE_BYTES = 2
+
+
+class TransmitQueue:
+    '''
+    Microphone audio waiting for the transmit thread, bounded by how much audio it holds
+    rather than how many chunks.  When the network stalls it's the oldest audio that goes,
+    so what does get sent is live rather than what was said a while ago:
+
+    * put() drops the oldest chunks to stay within `max_duration` seconds of audio.
+    * Each chunk is stamped with when it was put, and get() throws away any that have
+      waited longer than `budget` seconds instead of handing them over to be encoded.
+
+    Both count what they dropped, in seconds of audio.  put() is called from the
+    microphone thread and get() from the transmit thread.
+    '''
+    def __init__(self, max_duration: float, budget: float, rate: int = RATE, clock: Callable[[], float] = time.monotonic):
+        self._chunks: Deque[Tuple[float, bytes]] = deque()
+        self._condition = Condition()
+        self._bytes = 0
+        self._rate = rate
+        self._clock = clock
+        self.setLimits(max_duration, budget)
+        self.overflowed = 0.0
+        self.expired = 0.0
+
+    def setLimits(self, max_duration: float, budget: float):
+        with self._condition:
+            self._max_bytes = max(0, int(max_duration * self._rate)) * SAMPLE_BYTES
+            self._budget = budget
+
+    @property
+    def duration(self) -> float:
+        '''Seconds of audio waiting'''
+        return self._bytes / SAMPLE_BYTES / self._rate
+
+    def __len__(self):
+        return len(self._chunks)
+
+    def put(self, chunk: bytes):
+        with self._condition:
+            self._chunks.append((self._clock(), chunk))
+            self._bytes += len(chunk)
+            while self._bytes > self._max_bytes and len(self._chunks) > 0:
+                _, dropped = self._chunks.popleft()
+                self._bytes -= len(dropped)
+                self.overflowed += len(dropped) / SAMPLE_BYTES / self._rate
+            self._condition.notify()
+
+    def get(self, timeout: float) -> Tuple[bytes, float]:
+        '''
+        The oldest chunk that's still within the budget and how long it waited, raises
+        queue.Empty if there isn't one within `timeout` seconds.
+        '''
+        deadline = self._clock() + timeout
+        with self._condition:
+            while True:
+                while len(self._chunks) > 0:
+                    put, chunk = self._chunks.popleft()
+                    self._bytes -= len(chunk)
+                    waited = self._clock() - put
+                    if waited <= self._budget:
+                        return chunk, waited
+                    self.expired += len(chunk) / SAMPLE_BYTES / self._rate
+                remaining = deadline - self._clock()
+                if remaining <= 0:
+                    raise queue.Empty()
+                self._condition.wait(remaining)
+
+    def clear(self):
+        with self._condition:
+            self._chunks.clear()
+            self._bytes = 0
@@ -0,0 +1,386 @@
+import socket
+import struct
+from time import monotonic
+from typing import Dict, List, Optional, Tuple
+from .logger import getLogger
+
+try:
+    from Crypto.Cipher import AES
+except ImportError:
+    AES = None
+
+logger = getLogger(__name__)
+
+BLOCK_SIZE = 16
+
+# Voice packet types, the top three bits of the first byte
+AUDIO_TYPE_PING = 1
+
+# How often the server is pinged over UDP, and how long without an answer before voice
+# goes back to the TCP tunnel
+UDP_PING_INTERVAL_SECONDS = 1
+UDP_TIMEOUT_SECONDS = 3
+
+# How long decryption can keep failing before asking the server to resync the nonces
+RESYNC_SECONDS = 5
+
+MAX_DATAGRAM = 1024
+
+
+def udpAvailable() -> bool:
+    '''UDP voice needs pycryptodome for AES'''
+    return AES is not None
+
+
+def _times2(block: int) -> int:
+    carry = block >> 127
+    return ((block << 1) & ((1 << 128) - 1)) ^ (carry * 0x87)
+
+
+def _times3(block: int) -> int:
+    return _times2(block) ^ block
+
+
+def _int(data: bytes) -> int:
+    return int.from_bytes(data, "big")
+
+
+def _bytes(block: int) -> bytes:
+    return block.to_bytes(BLOCK_SIZE, "big")
+
+
+def encodeVarint(value: int) -> bytes:
+    '''Mumble's variable length integer encoding, for non-negative values'''
+    if value < 0x80:
+        return bytes([value])
+    if value < 0x4000:
+        return bytes([0x80 | (value >> 8), value & 0xFF])
+    if value < 0x200000:
+        return bytes([0xC0 | (value >> 16)]) + (value & 0xFFFF).to_bytes(2, "big")
+    if value < 0x10000000:
+        return bytes([0xE0 | (value >> 24)]) + (value & 0xFFFFFF).to_bytes(3, "big")
+    if value < 0x100000000:
+        return b"\xF0" + value.to_bytes(4, "big")
+    return b"\xF4" + value.to_bytes(8, "big")
+
+
+def decodeVarint(data: bytes, position: int = 0) -> Tuple[int, int]:
+    '''Returns the value and how many bytes it took'''
+    first = data[position]
+    if first & 0x80 == 0:
+        return first, 1
+    if first & 0xC0 == 0x80:
+        return ((first & 0x3F) << 8) | data[position + 1], 2
+    if first & 0xE0 == 0xC0:
+        return ((first & 0x1F) << 16) | int.from_bytes(data[position + 1:position + 3], "big"), 3
+    if first & 0xF0 == 0xE0:
+        return ((first & 0x0F) << 24) | int.from_bytes(data[position + 1:position + 4], "big"), 4
+    if first == 0xF0:
+        return int.from_bytes(data[position + 1:position + 5], "big"), 5
+    if first == 0xF4:
+        return int.from_bytes(data[position + 1:position + 9], "big"), 9
+    raise ValueError(f"Unsupported varint prefix {first:#x}")
+
+
+class CryptStateOCB2():
+    '''
+    The OCB2-AES128 encryption mumble uses for UDP voice, including its nonce handling:
+    every packet carries the low byte of the sender's nonce and a 3 byte tag, which is
+    enough to put late and lost packets back in place and to reject replays.
+
+    Keeps counts of good, late and lost packets received, as the server does for the
+    packets we send it.
+    '''
+    def __init__(self):
+        self._cipher = None
+        self.encrypt_iv = bytearray(BLOCK_SIZE)
+        self.decrypt_iv = bytearray(BLOCK_SIZE)
+        self._decrypt_history = bytearray(256)
+        self.good = 0
+        self.late = 0
+        self.lost = 0
+        self.resync = 0
+        self.last_good: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._cipher is not None
+
+    def setKey(self, key: bytes, encrypt_iv: bytes, decrypt_iv: bytes):
+        self._cipher = AES.new(bytes(key), AES.MODE_ECB)
+        self.encrypt_iv = bytearray(encrypt_iv)
+        self.decrypt_iv = bytearray(decrypt_iv)
+        self._decrypt_history = bytearray(256)
+        self.last_good = monotonic()
+
+    def setDecryptIV(self, iv: bytes):
+        self.decrypt_iv = bytearray(iv)
+        self.resync += 1
+        self.last_good = monotonic()
+
+    def _aes(self, block: int) -> int:
+        return _int(self._cipher.encrypt(_bytes(block)))
+
+    def _aesDecrypt(self, block: int) -> int:
+        return _int(self._cipher.decrypt(_bytes(block)))
+
+    def ocbEncrypt(self, plain: bytes, nonce: bytes) -> Tuple[bytes, bytes]:
+        '''Returns the ciphertext and the full tag'''
+        delta = self._aes(_int(nonce))
+        checksum = 0
+        encrypted = bytearray()
+        position = 0
+        remaining = len(plain)
+        while remaining > BLOCK_SIZE:
+            block = plain[position:position + BLOCK_SIZE]
+            # Counter-cryptanalysis from section 9 of https://eprint.iacr.org/2019/311, the
+            # attack needs a second to last block that is all zero but for its last byte,
+            # which digital silence produces all the time, so flip a bit of it instead
+            flip = remaining - BLOCK_SIZE <= BLOCK_SIZE and not any(block[:BLOCK_SIZE - 1])
+            value = _int(block) ^ (1 << 120 if flip else 0)
+            delta = _times2(delta)
+            encrypted += _bytes(delta ^ self._aes(delta ^ value))
+            checksum ^= value
+            position += BLOCK_SIZE
+            remaining -= BLOCK_SIZE
+        delta = _times2(delta)
+        pad = _bytes(self._aes(delta ^ (remaining * 8)))
+        last = plain[position:] + pad[remaining:]
+        checksum ^= _int(last)
+        encrypted += bytes(a ^ b for a, b in zip(last[:remaining], pad))
+        delta = _times3(delta)
+        tag = _bytes(self._aes(delta ^ checksum))
+        return bytes(encrypted), tag
+
+    def ocbDecrypt(self, encrypted: bytes, nonce: bytes) -> Tuple[Optional[bytes], bytes]:
+        '''Returns the plaintext (None if it's an attack) and the full tag'''
+        delta = self._aes(_int(nonce))
+        checksum = 0
+        plain = bytearray()
+        position = 0
+        remaining = len(encrypted)
+        while remaining > BLOCK_SIZE:
+            delta = _times2(delta)
+            value = delta ^ self._aesDecrypt(delta ^ _int(encrypted[position:position + BLOCK_SIZE]))
+            plain += _bytes(value)
+            checksum ^= value
+            position += BLOCK_SIZE
+            remaining -= BLOCK_SIZE
+        delta = _times2(delta)
+        pad = _bytes(self._aes(delta ^ (remaining * 8)))
+        last = bytes(a ^ b for a, b in zip(encrypted[position:], pad)) + pad[remaining:]
+        checksum ^= _int(last)
+        plain += last[:remaining]
+        success = last[:BLOCK_SIZE - 1] != _bytes(delta)[:BLOCK_SIZE - 1]
+        delta = _times3(delta)
+        tag = _bytes(self._aes(delta ^ checksum))
+        return (bytes(plain) if success else None), tag
+
+    def encrypt(self, plain: bytes) -> bytes:
+        for i in range(BLOCK_SIZE):
+            self.encrypt_iv[i] = (self.encrypt_iv[i] + 1) & 0xFF
+            if self.encrypt_iv[i] != 0:
+                break
+        encrypted, tag = self.ocbEncrypt(plain, bytes(self.encrypt_iv))
+        return bytes([self.encrypt_iv[0]]) + tag[:3] + encrypted
+
+    def decrypt(self, packet: bytes) -> Optional[bytes]:
+        '''Returns the plaintext, or None for a packet that's bad, a replay or too late'''
+        if len(packet) < 4 or self._cipher is None:
+            return None
+        saved = bytearray(self.decrypt_iv)
+        iv = self.decrypt_iv
+        ivbyte = packet[0]
+        restore = False
+        late = 0
+        lost = 0
+
+        if (iv[0] + 1) & 0xFF == ivbyte:
+            # In order, as expected
+            if ivbyte > iv[0]:
+                iv[0] = ivbyte
+            elif ivbyte < iv[0]:
+                iv[0] = ivbyte
+                self._increment(iv)
+            else:
+                return None
+        else:
+            diff = ivbyte - iv[0]
+            if diff > 128:
+                diff -= 256
+            elif diff < -128:
+                diff += 256
+            if ivbyte < iv[0] and -30 < diff < 0:
+                # Late, without wrapping around
+                late = 1
+                lost = -1
+                iv[0] = ivbyte
+                restore = True
+            elif ivbyte > iv[0] and -30 < diff < 0:
+                # Late, from before the last wrap around
+                late = 1
+                lost = -1
+                iv[0] = ivbyte
+                for i in range(1, BLOCK_SIZE):
+                    iv[i] = (iv[i] - 1) & 0xFF
+                    if iv[i] != 0xFF:
+                        break
+                restore = True
+            elif ivbyte > iv[0] and diff > 0:
+                lost = ivbyte - iv[0] - 1
+                iv[0] = ivbyte
+            elif ivbyte < iv[0] and diff > 0:
+                lost = 256 - iv[0] + ivbyte - 1
+                iv[0] = ivbyte
+                self._increment(iv)
+            else:
+                self.decrypt_iv = saved
+                return None
+            if self._decrypt_history[iv[0]] == iv[1]:
+                # Seen it already
+                self.decrypt_iv = saved
+                return None
+
+        plain, tag = self.ocbDecrypt(packet[4:], bytes(iv))
+        if plain is None or tag[:3] != packet[1:4]:
+            self.decrypt_iv = saved
+            return None
+        self._decrypt_history[iv[0]] = iv[1]
+        if restore:
+            self.decrypt_iv = saved
+        self.good += 1
+        self.late += late
+        self.lost = max(0, self.lost + lost)
+        self.last_good = monotonic()
+        return plain
+
+    @staticmethod
+    def _increment(iv: bytearray):
+        for i in range(1, BLOCK_SIZE):
+            iv[i] = (iv[i] + 1) & 0xFF
+            if iv[i] != 0:
+                break
+
+
+class UdpVoice():
+    '''
+    Carries voice packets to and from the mumble server over UDP instead of tunnelling
+    them through the TLS connection, where one lost packet holds up all the audio behind
+    it until TCP has resent it.
+
+    The server is pinged over UDP every second.  Voice only goes over UDP while those
+    pings are being answered, otherwise send() returns False and the caller sends it
+    through the TCP tunnel, which also tells the server to answer the same way.  Not
+    thread safe, it's meant to be driven from the mumble client's loop.
+    '''
+    def __init__(self, address: tuple, crypt: CryptStateOCB2 = None, ping_interval: float = UDP_PING_INTERVAL_SECONDS, timeout: float = UDP_TIMEOUT_SECONDS):
+        self._address = address
+        self.crypt = crypt if crypt is not None else CryptStateOCB2()
+        self._ping_interval = ping_interval
+        self._timeout = timeout
+        self._socket = socket.socket(socket.AF_INET6 if len(address) == 4 else socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+        self._active = False
+        self._last_ping = 0
+        self._last_pong: Optional[float] = None
+        self._last_resync_request = 0
+        self._failed = 0
+        self._rtt: Optional[float] = None
+        self.sent = 0
+        self.received = 0
+        self.tunnelled = 0
+        # The server's counts of the packets we sent it, from its TCP pings
+        self.server_good = 0
+        self.server_late = 0
+        self.server_lost = 0
+
+    @property
+    def active(self) -> bool:
+        return self._active
+
+    def fileno(self) -> int:
+        return self._socket.fileno()
+
+    def close(self):
+        self._active = False
+        self._socket.close()
+
+    def _send(self, plain: bytes):
+        try:
+            self._socket.sendto(self.crypt.encrypt(plain), self._address)
+        except OSError as e:
+            logger.debugLimited("Unable to send UDP voice: %s", e)
+
+    def send(self, plain: bytes) -> bool:
+        '''Sends a voice packet if UDP is working, returns False if it should be tunnelled'''
+        if not self._active:
+            self.tunnelled += 1
+            return False
+        self._send(plain)
+        self.sent += 1
+        return True
+
+    def poll(self, now: float = None) -> bool:
+        '''
+        Pings the server when it's time and checks whether UDP still works.  Returns True if
+        nonces should be resynced with the server.
+        '''
+        now = monotonic() if now is None else now
+        if not self.crypt.ready:
+            return False
+        if now - self._last_ping >= self._ping_interval:
+            self._last_ping = now
+            self._send(bytes([AUDIO_TYPE_PING << 5]) + encodeVarint(int(now * 1000)))
+        active = self._last_pong is not None and now - self._last_pong < self._timeout
+        if active != self._active:
+            self._active = active
+            if active:
+                logger.info("Sending voice over UDP")
+            else:
+                logger.info("UDP isn't getting through, sending voice through the TCP connection")
+        if self._failed > 0 and self.crypt.last_good is not None and now - self.crypt.last_good > RESYNC_SECONDS and now - self._last_resync_request > RESYNC_SECONDS:
+            self._last_resync_request = now
+            self._failed = 0
+            return True
+        return False
+
+    def receive(self) -> List[bytes]:
+        '''Reads whatever has arrived, returns the decrypted voice packets'''
+        packets = []
+        while True:
+            try:
+                data, _address = self._socket.recvfrom(MAX_DATAGRAM)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                # eg a port unreachable from the last send
+                logger.debugLimited("UDP voice socket error: %s", e)
+                break
+            plain = self.crypt.decrypt(data)
+            if plain is None or len(plain) == 0:
+                self._failed += 1
+                continue
+            if plain[0] >> 5 == AUDIO_TYPE_PING:
+                sent, _size = decodeVarint(plain, 1)
+                now = monotonic()
+                self._last_pong = now
+                self._rtt = now - sent / 1000
+                continue
+            self.received += 1
+            packets.append(plain)
+        return packets
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            'udp': self._active,
+            'rtt_ms': None if self._rtt is None else round(self._rtt * 1000, 1),
+            'sent': self.sent,
+            'tunnelled': self.tunnelled,
+            'received': self.crypt.good,
+            'late': self.crypt.late,
+            'lost': self.crypt.lost,
+            'resync': self.crypt.resync,
+            'server_received': self.server_good,
+            'server_late': self.server_late,
+            'server_lost': self.server_lost,
+        }
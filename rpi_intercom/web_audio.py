@@ -0,0 +1,236 @@
+import asyncio
+import itertools
+import json
+import math
+import struct
+from collections import deque
+from time import monotonic
+from typing import Dict, Optional
+import aiohttp
+from aiohttp import web
+import numpy as np
+from .logger import getLogger
+from .sound import Sound
+from .status import StatusBus
+
+logger = getLogger(__name__)
+
+RATE = 48000
+AUDIO_DATA_TYPE = np.dtype(np.int16).newbyteorder('<')
+
+# Every binary frame, in either direction, starts with a uint32 sequence number followed by
+# 16 bit mono PCM at 48kHz
+HEADER = struct.Struct("<I")
+
+# The most playback audio queued for a client that can't keep up, older audio is dropped
+MAX_QUEUED_SECONDS = 0.25
+
+# The most browser microphone audio waiting to be transmitted
+MAX_TRANSMIT_SECONDS = 0.25
+
+# Where a client's microphone audio goes
+ROUTE_MUMBLE = "mumble"
+ROUTE_LOCAL = "local"
+ROUTE_BOTH = "both"
+
+# How often clients are pinged to measure latency
+PING_INTERVAL_SECONDS = 1
+
+
+class AudioClient():
+    '''
+    One browser connected to /audio.  Playback is queued per client with a bounded deque
+    so a slow phone only ever loses its own audio.
+    '''
+    def __init__(self, ws: web.WebSocketResponse, id: int, max_frames: int):
+        self.id = id
+        self.ws = ws
+        self.queue: deque = deque(maxlen=max_frames)
+        self.wake = asyncio.Event()
+        self.listening = False
+        self.talking = False
+        self.route = ROUTE_MUMBLE
+        self.sequence = 0
+        self.queued_samples = 0
+        self.dropped = 0
+        self.received = 0
+        self.missed = 0
+        self.last_received_sequence: Optional[int] = None
+        self.rtt: Optional[float] = None
+        self.client_buffer: Optional[float] = None
+
+    def queue_audio(self, pcm: bytes):
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+            self.queued_samples -= (len(self.queue[0]) - HEADER.size) // 2
+        self.queue.append(HEADER.pack(self.sequence & 0xFFFFFFFF) + pcm)
+        self.sequence += 1
+        self.queued_samples += len(pcm) // 2
+        self.wake.set()
+
+    def stats(self) -> Dict[str, float]:
+        queued = self.queued_samples / RATE
+        latency = queued
+        if self.rtt is not None:
+            latency += self.rtt / 2
+        if self.client_buffer is not None:
+            latency += self.client_buffer
+        return {
+            'listening': self.listening,
+            'talking': self.talking,
+            'rtt_ms': None if self.rtt is None else round(self.rtt * 1000),
+            'queued_ms': round(queued * 1000),
+            'client_buffer_ms': None if self.client_buffer is None else round(self.client_buffer * 1000),
+            'latency_ms': round(latency * 1000),
+            'dropped': self.dropped,
+            'missed': self.missed,
+        }
+
+
+class WebAudio():
+    '''
+    Lets a browser listen to and talk through the intercom over the /audio websocket.
+
+    The mixed speaker output is converted to PCM16 once per period on the speaker thread
+    and handed to the event loop, where it is queued for every listening client.  While a
+    client holds "talk", the audio it sends is mixed into what the microphone transmits
+    to mumble, played on the local speaker like a mumble user's, or both.
+
+    Text messages from the client:
+        {"type": "listen", "active": true/false}
+        {"type": "talk", "active": true/false, "route": "mumble"/"local"/"both"}
+            talking to mumble sends the browser's audio without the room's microphone,
+            whatever the buttons say
+        {"type": "pong", "t": <from ping>, "buffered": <seconds queued in the browser>}
+    '''
+    def __init__(self, sound: Sound, status: StatusBus, chunk_size: int):
+        self._sound = sound
+        self._status = status
+        self._clients: Dict[int, AudioClient] = {}
+        self._ids = itertools.count(1)
+        self._max_frames = max(1, int(MAX_QUEUED_SECONDS * RATE / chunk_size))
+        self._loop: asyncio.AbstractEventLoop = None
+        self._listeners = 0
+        self._sound.addOutputTap(self._tap)
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+
+    def _tap(self, mixed: np.ndarray):
+        # Called on the speaker thread
+        if self._listeners == 0 or self._loop is None:
+            return
+        pcm = (np.clip(mixed, -1, 1) * 32767).astype(AUDIO_DATA_TYPE).tobytes()
+        try:
+            self._loop.call_soon_threadsafe(self._fanOut, pcm)
+        except RuntimeError:
+            # The loop has closed
+            pass
+
+    def _fanOut(self, pcm: bytes):
+        for client in self._clients.values():
+            if client.listening:
+                client.queue_audio(pcm)
+
+    def _updateListeners(self):
+        self._listeners = sum(1 for client in self._clients.values() if client.listening)
+
+    def _publishStats(self):
+        self._status.publish(web_audio={str(id): client.stats() for id, client in self._clients.items()})
+
+    async def handler(self, request: web.Request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        client = AudioClient(ws, next(self._ids), self._max_frames)
+        self._clients[client.id] = client
+        logger.info(f"Browser audio client {client.id} connected from {request.remote}")
+        source = self._sound.addTransmitSource(("web", client.id), int(MAX_TRANSMIT_SECONDS * RATE))
+        writer = asyncio.create_task(self._writeLoop(client))
+        pinger = asyncio.create_task(self._pingLoop(client))
+        try:
+            async for msg in ws:
+                if msg.type == aiohttp.WSMsgType.BINARY:
+                    self._receiveAudio(client, source, msg.data)
+                elif msg.type == aiohttp.WSMsgType.TEXT:
+                    try:
+                        message = json.loads(msg.data)
+                    except ValueError as e:
+                        logger.warningLimited("Browser audio client %s sent a bad message: %s", client.id, e)
+                        continue
+                    if isinstance(message, dict):
+                        self._receiveMessage(client, message)
+        finally:
+            writer.cancel()
+            pinger.cancel()
+            # Also lets go of its hold on transmit
+            self._sound.removeTransmitSource(("web", client.id))
+            del self._clients[client.id]
+            self._updateListeners()
+            self._publishStats()
+            logger.info(f"Browser audio client {client.id} disconnected, {client.dropped} playback frames dropped, {client.missed} talk frames missed")
+        return ws
+
+    def _receiveAudio(self, client: AudioClient, source, data: bytes):
+        if len(data) <= HEADER.size:
+            return
+        sequence, = HEADER.unpack_from(data)
+        if client.last_received_sequence is not None:
+            client.missed += max(0, ((sequence - client.last_received_sequence) & 0xFFFFFFFF) - 1)
+        client.last_received_sequence = sequence
+        client.received += 1
+        if not client.talking:
+            return
+        pcm = data[HEADER.size:]
+        if len(pcm) % AUDIO_DATA_TYPE.itemsize != 0:
+            logger.warningLimited("Browser audio client %s sent a frame of %d bytes, which isn't whole samples", client.id, len(pcm))
+            pcm = pcm[:len(pcm) - len(pcm) % AUDIO_DATA_TYPE.itemsize]
+            if len(pcm) == 0:
+                return
+        if client.route != ROUTE_MUMBLE:
+            self._sound.playLocal(("web", client.id), f"browser {client.id}", pcm)
+        if client.route != ROUTE_LOCAL:
+            source.push(np.frombuffer(pcm, dtype=AUDIO_DATA_TYPE).astype(float) / 32768)
+
+    def _receiveMessage(self, client: AudioClient, message):
+        data_type = message.get("type")
+        if data_type == "listen":
+            client.listening = bool(message.get("active"))
+            if not client.listening:
+                client.queue.clear()
+                client.queued_samples = 0
+            self._updateListeners()
+        elif data_type == "talk":
+            active = bool(message.get("active"))
+            route = message.get("route", client.route)
+            if route not in [ROUTE_MUMBLE, ROUTE_LOCAL, ROUTE_BOTH]:
+                route = ROUTE_MUMBLE
+            client.talking = active
+            client.route = route
+            self._sound.holdTransmit(("web", client.id), active and route != ROUTE_LOCAL)
+        elif data_type == "pong" and message.get("t") is not None:
+            sent = message.get("t")
+            if not _isNumber(sent):
+                logger.warningLimited("Browser audio client %s sent a bad pong: %s", client.id, message)
+                return
+            buffered = message.get("buffered")
+            client.rtt = monotonic() - sent
+            client.client_buffer = buffered if _isNumber(buffered) else None
+            self._publishStats()
+
+    async def _writeLoop(self, client: AudioClient):
+        while True:
+            await client.wake.wait()
+            client.wake.clear()
+            while len(client.queue) > 0:
+                frame = client.queue.popleft()
+                client.queued_samples -= (len(frame) - HEADER.size) // 2
+                await client.ws.send_bytes(frame)
+
+    async def _pingLoop(self, client: AudioClient):
+        while True:
+            await client.ws.send_str(json.dumps({'type': 'ping', 't': monotonic()}))
+            await asyncio.sleep(PING_INTERVAL_SECONDS)
+
+
+def _isNumber(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
@@ -1,41 +1,217 @@
-import queue
-from threading import Event, Lock, Thread
+import asyncio
+import heapq
+import itertools
+from threading import Condition, Thread
+from time import monotonic
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set, Tuple
 from .logger import getLogger
 
 logger = getLogger(__name__)
 
+
+class Task():
+    '''
+    A handle to work scheduled on a Worker.  One-shot tasks run once, periodic tasks run
+    every `interval` seconds (measured from when the last run started) until cancelled.
+    '''
+    def __init__(self, worker: 'Worker', work: Callable[[], Any], key: Optional[Hashable], interval: Optional[float], loop: Optional[asyncio.AbstractEventLoop]):
+        self._worker = worker
+        self._work = work
+        self._key = key
+        self._interval = interval
+        self._loop = loop
+        self._due: Optional[float] = None
+        self._running = False
+        self._rerun = False
+        self._cancelled = False
+
+    @property
+    def key(self) -> Optional[Hashable]:
+        return self._key
+
+    @property
+    def interval(self) -> Optional[float]:
+        return self._interval
+
+    @property
+    def due(self) -> Optional[float]:
+        '''When the task will next run, on the monotonic clock, None if it isn't waiting'''
+        return self._due
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def cancel(self):
+        self._worker._cancel(self)
+
+    def trigger(self):
+        '''Runs the task as soon as possible instead of waiting for it to be due'''
+        self._worker._wake([self])
+
+
 class Worker:
+    '''
+    Runs scheduled work from a heap of timers on one thread.  Every task waits for its
+    own due time, so a task with a long delay never holds up the ones behind it.
+
+    Tasks can be given a key, and trigger(key) runs every task with that key right away,
+    or straight after its current run if it's running.
+
+    A task given an event loop runs on that loop instead of the worker thread, and may be
+    a coroutine function.  A periodic task is never run twice at the same time, it's
+    rescheduled once its current run has finished.
+    '''
     def __init__(self, name="Worker"):
         self._name = name
-        self._queue = queue.Queue()
         self._thread = Thread(target=self._work, name=name, daemon=True)
         self._active = False
-        self._wake_event = Event()
+        self._condition = Condition()
+        # (due, tie breaker, task), tasks whose due time changed are left in place and
+        # skipped when they come up
+        self._heap: List[Tuple[float, int, Task]] = []
+        self._counter = itertools.count()
+        self._keys: Dict[Hashable, Set[Task]] = {}
 
     def start(self):
         self._active = True
         self._thread.start()
 
-    def trigger(self):
-        self._wake_event.set()
-
     def stop(self):
-        self._active = False
+        with self._condition:
+            self._active = False
+            self._condition.notify()
 
-    def submit(self, delay: float, work):
-        self._queue.put((delay,work))
+    def schedule(self, delay: float, work: Callable[[], Any], key: Optional[Hashable] = None, interval: Optional[float] = None, loop: Optional[asyncio.AbstractEventLoop] = None) -> Task:
+        '''Runs work after delay seconds, then every interval seconds if one is given'''
+        task = Task(self, work, key, interval, loop)
+        with self._condition:
+            if key is not None:
+                self._keys.setdefault(key, set()).add(task)
+            self._push(task, monotonic() + delay)
+        return task
 
-    def _work(self):
-        while self._active:
+    def every(self, interval: float, work: Callable[[], Any], key: Optional[Hashable] = None, delay: float = 0, loop: Optional[asyncio.AbstractEventLoop] = None) -> Task:
+        return self.schedule(delay, work, key=key, interval=interval, loop=loop)
+
+    def submit(self, delay: float, work: Callable[[], Any]) -> Task:
+        return self.schedule(delay, work)
+
+    def trigger(self, key: Optional[Hashable] = None):
+        '''Runs the tasks with the given key now, or every waiting task if no key is given'''
+        with self._condition:
+            if key is None:
+                tasks = [task for _due, _count, task in self._heap]
+            else:
+                tasks = list(self._keys.get(key, []))
+        self._wake(tasks)
+
+    def cancel(self, key: Hashable):
+        '''Cancels every task with the given key'''
+        with self._condition:
+            tasks = list(self._keys.get(key, []))
+        for task in tasks:
+            task.cancel()
+
+    def pending(self) -> int:
+        with self._condition:
+            return len(set(task for _due, _count, task in self._heap if task._due is not None))
+
+    def _push(self, task: Task, due: float):
+        # Must hold the condition
+        task._due = due
+        heapq.heappush(self._heap, (due, next(self._counter), task))
+        if self._heap[0][2] is task:
+            self._condition.notify()
+
+    def _wake(self, tasks: List[Task]):
+        now = monotonic()
+        with self._condition:
+            for task in tasks:
+                if task._cancelled:
+                    continue
+                if task._running:
+                    # Run it again as soon as this run is done
+                    task._rerun = True
+                elif task._due is not None and task._due > now:
+                    self._push(task, now)
+
+    def _cancel(self, task: Task):
+        with self._condition:
+            task._cancelled = True
+            task._due = None
+            self._forget(task)
+
+    def _forget(self, task: Task):
+        # Must hold the condition
+        if task._key is not None and task._key in self._keys:
+            self._keys[task._key].discard(task)
+            if len(self._keys[task._key]) == 0:
+                del self._keys[task._key]
+
+    def _next(self) -> Optional[Task]:
+        '''Waits for the next due task, None once the worker is stopped'''
+        with self._condition:
+            while self._active:
+                while len(self._heap) > 0 and self._heap[0][2]._due != self._heap[0][0]:
+                    heapq.heappop(self._heap)
+                if len(self._heap) == 0:
+                    self._condition.wait()
+                    continue
+                wait = self._heap[0][0] - monotonic()
+                if wait > 0:
+                    self._condition.wait(wait)
+                    continue
+                _due, _count, task = heapq.heappop(self._heap)
+                task._due = None
+                task._running = True
+                return task
+            return None
+
+    def _finished(self, task: Task, started: float):
+        with self._condition:
+            task._running = False
+            rerun = task._rerun
+            task._rerun = False
+            if task._cancelled:
+                self._forget(task)
+            elif rerun:
+                self._push(task, monotonic())
+            elif task._interval is None:
+                self._forget(task)
+            else:
+                self._push(task, max(started + task._interval, monotonic()))
+
+    def _run(self, task: Task):
+        started = monotonic()
+        if task._loop is None:
+            try:
+                task._work()
+            except BaseException as e:
+                logger.error(f"Worker {self._name} got an exception")
+                logger.printException(e)
+            self._finished(task, started)
+            return
+
+        async def run():
             try:
-                delay, work = self._queue.get(timeout=1)
-                if delay != 0:
-                    self._wake_event.wait(delay)
-                self._wake_event.clear()
-                work()
-            except queue.Empty:
-                # Queue just times on "get" out to avoid a locked thread
-                pass
+                result = task._work()
+                if asyncio.iscoroutine(result):
+                    await result
             except BaseException as e:
                 logger.error(f"Worker {self._name} got an exception")
-                logger.printException(e)
\ No newline at end of file
+                logger.printException(e)
+            finally:
+                self._finished(task, started)
+        try:
+            asyncio.run_coroutine_threadsafe(run(), task._loop)
+        except RuntimeError:
+            # The loop has closed
+            self._cancel(task)
+
+    def _work(self):
+        while True:
+            task = self._next()
+            if task is None:
+                return
+            self._run(task)
@@ -18,7 +18,7 @@ setup(
     description='Intercom library for a raspberrypi',
     long_description=long_description,
     long_description_content_type="text/markdown",
-    install_requires=["pymumble", "pyalsaaudio", "gpiozero", "schema", "pyyaml", "pyOpenSSL", "numpy", "psutil", "aiohttp", "colorlog", "samplerate", "aiorun"],
+    install_requires=["pymumble", "pyalsaaudio", "gpiozero", "schema", "pyyaml", "pyOpenSSL", "numpy", "psutil", "aiohttp", "colorlog", "samplerate", "aiorun", "pycryptodome"],
     author="Stephen Beechen",
     author_email="stephen@beechens.com",
     python_requires=">=3.9",
@@ -94,4 +94,14 @@ def test_basic_buffer():
     buffer.push(np.array([14, 15, 16]))
     np.testing.assert_array_equal(buffer.pop(3), [12, 13, 14])
     np.testing.assert_array_equal(buffer.pop(3), [15, 16])
-    assert buffer.length == 0
\ No newline at end of file
+    assert buffer.length == 0
+
+def test_overflow_is_counted():
+    buffer = Buffer(5)
+    buffer.push(np.array([1, 2, 3]))
+    assert buffer.overflowed_samples == 0
+    buffer.push(np.array([4, 5, 6, 7]))
+    assert buffer.overflowed_samples == 2
+    buffer.push(np.array([8, 9, 10, 11, 12, 13]))
+    assert buffer.overflowed_samples == 8
+    np.testing.assert_array_equal(buffer.read(5), [9, 10, 11, 12, 13])
@@ -0,0 +1,119 @@
+import os
+import stat
+
+import pytest
+from schema import SchemaError
+
+from rpi_intercom.config import Config, Options
+
+CONFIG = """# The intercom
+server: mumble.example.com
+volume: 50 # percent
+speaker: "default"
+pins:
+  GPIO12: transmit
+"""
+
+
+def write(tmp_path, text=CONFIG):
+    path = tmp_path / "config.yaml"
+    path.write_text(text)
+    return str(path)
+
+
+def test_from_file(tmp_path):
+    config = Config.fromFile(write(tmp_path))
+    assert config.server == "mumble.example.com"
+    assert config.volume == 50
+    assert config.pins == {"GPIO12": "transmit"}
+    assert config.path == str(tmp_path / "config.yaml")
+    assert config.mtime == os.stat(config.path).st_mtime_ns
+
+
+def test_diff_and_update():
+    config = Config(server="a", volume=10, pins={"GPIO12": "transmit"})
+    other = Config(server="a", volume=20, pins={"GPIO13": "transmit"}, channel="Kitchen")
+    assert config.diff(config) == set()
+    changed = config.diff(other)
+    assert changed == {Options.VOLUME, Options.PINS, Options.CHANNEL}
+    config.update(other, {Options.VOLUME, Options.CHANNEL})
+    assert config.volume == 20
+    assert config.channel == "Kitchen"
+    assert config.pins == {"GPIO12": "transmit"}
+
+
+def test_dirty_keeps_comments(tmp_path):
+    path = write(tmp_path)
+    os.chmod(path, 0o600)
+    config = Config.fromFile(path)
+    config.set_volume(75)
+    config.set_microphone("hw:1")
+    config.dirty()
+    text = open(path).read()
+    assert text.startswith("# The intercom\n")
+    assert "volume: 75 # percent\n" in text
+    assert "microphone: 'hw:1'\n" in text
+    assert Config.fromFile(path).diff(config) == set()
+    assert config.mtime == os.stat(path).st_mtime_ns
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    # Nothing left behind from the atomic write
+    assert os.listdir(tmp_path) == ["config.yaml"]
+
+
+def test_dirty_without_a_file():
+    config = Config(volume=10)
+    config.dirty()
+
+
+ROOMS = CONFIG + """nickname: intercom
+audio_cpus: "2-3"
+endpoints:
+  - name: kitchen
+    speaker: "hw:1"
+  - name: garage
+    nickname: garage
+    volume: 20
+"""
+
+
+def test_endpoint_configs(tmp_path):
+    config = Config.fromFile(write(tmp_path, ROOMS))
+    kitchen, garage = config.endpointConfigs()
+    assert kitchen.name == "kitchen"
+    assert kitchen.nickname == "intercom_kitchen"
+    assert kitchen.speaker == "hw:1"
+    assert kitchen.volume == 50
+    assert garage.nickname == "garage"
+    assert garage.speaker == "default"
+    assert garage.volume == 20
+    assert (kitchen.audio_cpus, garage.audio_cpus) == ("2", "3")
+    assert kitchen.endpoints == []
+    assert config.volume == 50
+
+
+def test_one_endpoint_without_endpoints():
+    config = Config(nickname="intercom")
+    [endpoint] = config.endpointConfigs()
+    assert endpoint.name == "default"
+    assert endpoint.nickname == "intercom"
+
+
+def test_endpoint_dirty_saves_to_its_entry(tmp_path):
+    path = write(tmp_path, ROOMS)
+    garage = Config.fromFile(path).endpointConfigs()[1]
+    garage.set_volume(30)
+    garage.dirty()
+    loaded = Config.fromFile(path)
+    assert loaded.volume == 50
+    assert loaded.endpoints[1]["volume"] == 30
+    assert loaded.endpointConfigs()[1].volume == 30
+
+
+def test_endpoints_need_unique_names(tmp_path):
+    with pytest.raises(SchemaError):
+        Config.fromFile(write(tmp_path, CONFIG + "endpoints:\n  - name: a\n  - name: a\n"))
+    with pytest.raises(SchemaError):
+        Config.fromFile(write(tmp_path, CONFIG + "endpoints:\n  - speaker: hw:1\n"))
+    for name in ["../x", "a/b", ".hidden", "-x", ""]:
+        with pytest.raises(SchemaError):
+            Config.fromFile(write(tmp_path, CONFIG + f"endpoints:\n  - name: '{name}'\n"))
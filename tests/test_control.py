@@ -0,0 +1,25 @@
+from gpiozero import Device
+from gpiozero.pins.mock import MockFactory
+
+from rpi_intercom.config import Config, PinConfig
+from rpi_intercom.control import Control
+from rpi_intercom.status import StatusBus
+
+
+def test_removing_buttons_goes_back_to_the_defaults():
+    Device.pin_factory = MockFactory()
+    config = Config(pins={17: PinConfig.ACTION_HOLD_TO_TRANSMIT.value, 27: PinConfig.ACTION_TOOGLE_DEAFEN.value})
+    status = StatusBus()
+    control = Control(config, status)
+    control._bindPins()
+    assert not control.transmitting
+    control.deafened = True
+
+    config._pins = {}
+    control._rebindPins()
+    assert control.transmitting
+    assert not control.deafened
+    assert control._transmitting_indicator.active
+    assert status.snapshot()['transmitting'] is True
+    assert status.snapshot()['deafened'] is False
+    control._releasePins()
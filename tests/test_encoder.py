@@ -0,0 +1,78 @@
+import pytest
+
+from rpi_intercom.encoder import AdaptiveBitrate, EncoderProfile, MIN_BITRATE, STEP_DOWN_SECONDS, STEP_UP_SECONDS, protocolOverhead
+
+
+def test_steps_down_while_backlogged():
+    profile = EncoderProfile(bitrate=32000, frame_duration=20)
+    adaptive = AdaptiveBitrate(profile, 0.5)
+    assert adaptive.update(0.3, 0) is None
+    assert adaptive.update(0.3, STEP_DOWN_SECONDS / 2) is None
+
+    stepped = adaptive.update(0.3, STEP_DOWN_SECONDS)
+    assert stepped.bitrate < profile.bitrate
+    assert stepped.frame_duration == 40
+    assert adaptive.level == 1
+
+    # Waits again before taking the next step
+    assert adaptive.update(0.3, STEP_DOWN_SECONDS * 1.5) is None
+    assert adaptive.update(0.3, STEP_DOWN_SECONDS * 2).frame_duration == 60
+
+
+def test_bottoms_out():
+    adaptive = AdaptiveBitrate(EncoderProfile(bitrate=32000, frame_duration=10), 0.5)
+    now = 0
+    for _ in range(100):
+        now += STEP_DOWN_SECONDS
+        adaptive.update(1, now)
+    assert adaptive.profile.bitrate == MIN_BITRATE
+    assert adaptive.profile.frame_duration == 60
+    assert adaptive.update(1, now + STEP_DOWN_SECONDS) is None
+
+
+def test_recovers_when_drained():
+    profile = EncoderProfile(bitrate=32000, frame_duration=20, complexity=3)
+    adaptive = AdaptiveBitrate(profile, 0.5)
+    adaptive.update(0.3, 0)
+    adaptive.update(0.3, STEP_DOWN_SECONDS)
+    assert adaptive.level == 1
+    assert adaptive.profile.complexity == 3
+
+    # Backlog in between the watermarks holds the current level
+    assert adaptive.update(0.1, STEP_DOWN_SECONDS + STEP_UP_SECONDS) is None
+    assert adaptive.update(0, STEP_DOWN_SECONDS + STEP_UP_SECONDS * 1.5) is None
+    assert adaptive.update(0, STEP_DOWN_SECONDS + STEP_UP_SECONDS * 2) is None
+    assert adaptive.update(0, STEP_DOWN_SECONDS + STEP_UP_SECONDS * 2.5) == profile
+    assert adaptive.level == 0
+    assert adaptive.update(0, STEP_DOWN_SECONDS + STEP_UP_SECONDS * 10) is None
+
+
+def test_audio_per_packet():
+    assert EncoderProfile(bitrate=32000, frame_duration=40).audio_per_packet == pytest.approx(0.04)
+
+
+def test_dwell_time_starts_when_the_backlog_crosses():
+    adaptive = AdaptiveBitrate(EncoderProfile(bitrate=32000, frame_duration=20), 0.5)
+    # A long quiet spell at the top doesn't count towards stepping down
+    assert adaptive.update(0, 0) is None
+    assert adaptive.update(0, 60) is None
+    assert adaptive.update(0.3, 60.1) is None
+    assert adaptive.update(0.3, 60.1 + STEP_DOWN_SECONDS / 2) is None
+    assert adaptive.update(0.3, 60.1 + STEP_DOWN_SECONDS) is not None
+
+    # Nor does time spent in between the watermarks count towards stepping up
+    assert adaptive.update(0.1, 100) is None
+    assert adaptive.update(0, 100.1) is None
+    assert adaptive.update(0, 100.1 + STEP_UP_SECONDS / 2) is None
+    # Going high again starts the wait over
+    assert adaptive.update(0.3, 100.1 + STEP_UP_SECONDS * 0.75) is None
+    assert adaptive.update(0, 100.1 + STEP_UP_SECONDS) is None
+    assert adaptive.update(0, 100.1 + STEP_UP_SECONDS * 2) is not None
+    assert adaptive.level == 0
+
+
+def test_protocol_overhead():
+    # 20ms packets of one 20ms frame, 49 bytes of headers 50 times a second
+    assert protocolOverhead(0.02, 0.02) == 49 * 8 * 50
+    # Longer packets spread the headers over more audio
+    assert protocolOverhead(0.06, 0.02) < protocolOverhead(0.02, 0.02)
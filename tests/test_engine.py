@@ -0,0 +1,99 @@
+import logging
+import operator
+import time
+from threading import Event, Thread
+
+import numpy as np
+
+from rpi_intercom import engine
+from rpi_intercom.config import Config
+from rpi_intercom.engine import ProcessDevices, SharedRing, _Engine
+
+
+def test_shared_ring_between_handles():
+    owner = SharedRing(5)
+    other = SharedRing(name=owner.name)
+    try:
+        assert owner.max_length == 8
+        assert other.max_length == 8
+        assert owner.push(np.array([1, 2, 3])) == 3
+        assert other.length == 3
+        np.testing.assert_array_equal(other.pop(2), [1, 2])
+        assert owner.length == 1
+    finally:
+        other.close()
+        owner.close()
+
+
+def test_shared_ring_wraps():
+    ring = SharedRing(4)
+    try:
+        for start in range(0, 40, 3):
+            assert ring.push(np.arange(start, start + 3)) == 3
+            np.testing.assert_array_equal(ring.pop(3), np.arange(start, start + 3))
+        assert ring.push(np.arange(6)) == 4
+        assert ring.overflows == 1
+        np.testing.assert_array_equal(ring.pop(6), [0, 1, 2, 3])
+        assert ring.underflows == 1
+    finally:
+        ring.close()
+
+
+class BlockedConnection:
+    def __init__(self):
+        self.unblock = Event()
+        self.sent = []
+
+    def send(self, message):
+        self.unblock.wait()
+        self.sent.append(message)
+
+
+def test_logging_in_the_engine_doesnt_wait_for_the_intercom(monkeypatch):
+    monkeypatch.setattr(engine, "LOG_QUEUE_SIZE", 2)
+    microphone = SharedRing(4)
+    speaker = SharedRing(4)
+    conn = BlockedConnection()
+    audio_engine = _Engine(Config(), None, microphone.name, speaker.name, conn)
+    forwarder = Thread(target=audio_engine._logLoop, daemon=True)
+    forwarder.start()
+    try:
+        for i in range(5):
+            audio_engine.forwardLog(logging.LogRecord("test", logging.INFO, __file__, 1, "message %d", (i,), None))
+        # One is stuck being sent, two are queued and the rest are dropped
+        assert audio_engine._logs_dropped >= 2
+        audio_engine._logs_done = True
+        conn.unblock.set()
+        forwarder.join(5)
+        assert not forwarder.is_alive()
+        assert [record.msg for _, record in conn.sent] == [f"message {i}" for i in range(5 - audio_engine._logs_dropped)]
+    finally:
+        audio_engine._microphone_ring.close()
+        audio_engine._speaker_ring.close()
+        microphone.close()
+        speaker.close()
+
+
+class FakeShutdown:
+    def __init__(self):
+        self.shutting_down = False
+        self.requested = Event()
+
+    def shutdown(self):
+        self.requested.set()
+
+
+def test_engine_dying_shuts_the_intercom_down():
+    shutdown = FakeShutdown()
+    # Creating the devices fails, so the engine process exits straight away
+    devices = ProcessDevices(Config(), shutdown, factory=operator.truediv)
+    devices.start()
+    try:
+        assert shutdown.requested.wait(30)
+        # Writing still takes a period, so the speaker thread doesn't spin
+        started = time.monotonic()
+        devices.speaker_write(np.zeros(devices.chunk_size))
+        assert time.monotonic() - started >= devices._period * 0.9
+        assert devices.microphone_read() == (None, None)
+    finally:
+        devices.stop()
@@ -0,0 +1,66 @@
+from rpi_intercom.indicator import Indicator
+
+
+class FakeLED():
+    def __init__(self):
+        self.calls = []
+
+    def on(self):
+        self.calls.append("on")
+
+    def off(self):
+        self.calls.append("off")
+
+    def blink(self, on_time, off_time):
+        self.calls.append(("blink", on_time, off_time))
+
+    def close(self):
+        self.calls.append("close")
+
+
+def test_hold_keeps_flickering_audio_lit():
+    led = FakeLED()
+    changes = []
+    indicator = Indicator("receiving", [led], hold=0.3, changed=changes.append)
+    indicator.active = True
+    indicator.update(0)
+    for step in range(1, 21):
+        # Audio drops out every other 20ms period
+        indicator.active = step % 2 == 0
+        indicator.update(step * 0.02)
+    assert led.calls == ["on"]
+    indicator.active = False
+    indicator.update(1.0)
+    indicator.update(1.2)
+    assert led.calls == ["on"]
+    indicator.update(1.31)
+    assert led.calls == ["on", "off"]
+    assert changes == [True, False]
+
+
+def test_on_delay_ignores_short_blips():
+    led = FakeLED()
+    indicator = Indicator("receiving", [led], on_delay=0.1)
+    indicator.active = True
+    indicator.update(0)
+    indicator.active = False
+    indicator.update(0.05)
+    indicator.active = True
+    indicator.update(0.06)
+    indicator.update(0.12)
+    assert led.calls == []
+    indicator.update(0.17)
+    assert led.calls == ["on"]
+    assert indicator.shown
+
+
+def test_blink_and_close():
+    led = FakeLED()
+    indicator = Indicator("receiving", [led], blink=0.5)
+    indicator.active = True
+    indicator.update(0)
+    assert led.calls == [("blink", 0.25, 0.25)]
+    indicator.close()
+    indicator.active = False
+    indicator.update(1)
+    assert led.calls == [("blink", 0.25, 0.25), "off", "close"]
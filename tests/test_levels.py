@@ -0,0 +1,49 @@
+import struct
+import numpy as np
+
+from rpi_intercom.levels import LevelMeter, Levels, METER_IDLE_SECONDS, TALKER_PREFIX, pack
+
+
+def test_envelope_spans_pushes():
+    meter = LevelMeter(4)
+    meter.push(np.array([0.5, -1.0, 0.0]))
+    assert len(meter.points) == 0
+    meter.push(np.array([0.5, 0.5, 0.5, 0.5, 0.5]))
+    points = meter.drain()
+    assert len(points) == 2
+    assert points[0] == (1.0, np.sqrt((0.25 + 1 + 0 + 0.25) / 4))
+    assert points[1] == (0.5, 0.5)
+    assert meter.drain() == []
+
+
+def test_inactive_levels_do_nothing():
+    levels = Levels()
+    levels.push("microphone", np.ones(48000))
+    assert levels.drain() == {}
+    levels.setActive(True)
+    levels.push("microphone", (np.ones(960) * 16384).astype(np.int16))
+    assert levels.drain() == {"microphone": [(0.5, 0.5)]}
+
+
+def test_idle_meters_are_removed():
+    now = [0.0]
+    levels = Levels(clock=lambda: now[0])
+    levels.setActive(True)
+    for name in ["microphone", TALKER_PREFIX + "alice"]:
+        levels.push(name, np.ones(960))
+    assert len(levels.drain()) == 2
+    # Alice stops talking, the microphone carries on
+    now[0] = METER_IDLE_SECONDS + 1
+    levels.push("microphone", np.ones(960))
+    assert list(levels.drain()) == ["microphone"]
+    assert list(levels._meters) == ["microphone"]
+    # Talking again makes a new meter
+    levels.push(TALKER_PREFIX + "alice", np.ones(960))
+    assert list(levels.drain()) == [TALKER_PREFIX + "alice"]
+
+
+def test_pack():
+    data = pack({"mic": [(1.0, 0.5)], "output": []})
+    assert data[:3] == struct.pack("<BBB", 1, 50, 2)
+    assert data[3:13] == struct.pack("<B", 3) + b"mic" + struct.pack("<Hhh", 1, 32767, 16384)
+    assert data[13:] == struct.pack("<B", 6) + b"output" + struct.pack("<H", 0)
@@ -0,0 +1,41 @@
+from rpi_intercom.log_ring import LogRing, ENTRY
+
+
+def test_ring_drops_oldest():
+    ring = LogRing(4 * (ENTRY.size + 10))
+    for i in range(10):
+        assert ring.append(f"line {i:05d}") == i + 1
+    assert len(ring) == 4
+    assert list(ring.since(0)) == [(seq, f"line {seq - 1:05d}") for seq in range(7, 11)]
+    assert list(ring.since(8)) == [(9, "line 00008"), (10, "line 00009")]
+    assert list(ring.since(10)) == []
+
+
+def test_ring_wraps_entries():
+    ring = LogRing(100)
+    lines = [("x" * (i % 17)) + str(i) for i in range(200)]
+    for line in lines:
+        ring.append(line)
+    entries = list(ring.since(0))
+    assert [line for _seq, line in entries] == lines[-len(entries):]
+    assert entries[-1][0] == 200
+
+
+def test_ring_survives_reopening(tmp_path):
+    path = str(tmp_path / "history")
+    ring = LogRing(1000, path)
+    for i in range(100):
+        ring.append(f"before {i}")
+    expected = list(ring.since(0))
+    ring.close()
+
+    ring = LogRing(1000, path)
+    assert list(ring.since(0)) == expected
+    assert ring.append("after") == 101
+    ring.close()
+
+    # A different size starts over, but keeps counting
+    ring = LogRing(2000, path)
+    assert len(ring) == 0
+    assert ring.append("resized") == 102
+    ring.close()
@@ -0,0 +1,89 @@
+import time
+from threading import current_thread
+
+from rpi_intercom.logger import getLogger, getHistory, getLast, reset, startQueue, stopQueue, ATTACHABLE
+
+
+def test_queued_logging_keeps_order_and_flushes():
+    reset()
+    threads = []
+    batches = []
+    record_handler = lambda record: threads.append(current_thread().name)
+    batch_handler = batches.append
+    ATTACHABLE.attachRecords(record_handler)
+    ATTACHABLE.attachBatch(batch_handler)
+    try:
+        log = getLogger("test.queued")
+        startQueue()
+        for i in range(50):
+            log.debug("message %d", i)
+        stopQueue()
+    finally:
+        ATTACHABLE.detachRecords(record_handler)
+        ATTACHABLE.detachBatch(batch_handler)
+    messages = [message for _index, message in getHistory(0)]
+    assert len(messages) == 50
+    assert [message.endswith(f"message {i}") for i, message in enumerate(messages)] == [True] * 50
+    assert set(threads) == {"Log Writer"}
+    assert sum(len(batch) for batch in batches) == 50
+    getLogger("test.detached").info("after")
+    assert len(threads) == 50
+
+
+def test_rate_limited_per_call_site():
+    reset()
+    log = getLogger("test.limited")
+
+    def overrun(i):
+        log.warningLimited("overrun %d", i, interval=0.05)
+    for i in range(100):
+        overrun(i)
+        log.infoLimited("other site")
+    time.sleep(0.06)
+    overrun(100)
+    overrun(101)
+    messages = [message for _index, message in getHistory(0)]
+    assert len(messages) == 3
+    assert messages[0].endswith("overrun 0")
+    assert messages[1].endswith("other site")
+    assert messages[2].endswith("overrun 100 (repeated 99 times in the last 0s)")
+    assert getLast().funcName == "overrun"
+
+
+def test_suppressed_messages_are_flushed():
+    reset()
+    log = getLogger("test.flushed")
+
+    def failing(i):
+        log.errorLimited("device error %d", i, interval=0.05)
+    for i in range(10):
+        failing(i)
+    log.flushLimited()
+    assert len(list(getHistory(0))) == 1, "Not until the interval is up"
+    time.sleep(0.06)
+    log.flushLimited()
+    messages = [message for _index, message in getHistory(0)]
+    assert len(messages) == 2
+    assert messages[1].endswith("device error 9 (repeated 9 times in the last 0s)")
+    # Nothing more to report
+    log.flushLimited(force=True)
+    assert len(list(getHistory(0))) == 2
+
+
+def test_limited_exceptions_keep_the_traceback():
+    reset()
+    log = getLogger("test.exceptions")
+
+    def speaker_loop():
+        try:
+            raise ValueError("bad chunk")
+        except ValueError as e:
+            log.printExceptionLimited(e)
+    for _ in range(3):
+        speaker_loop()
+    log.flushLimited(force=True)
+    messages = [message for _index, message in getHistory(0)]
+    assert len(messages) == 2
+    assert "speaker_loop" in messages[0]
+    assert "ValueError: bad chunk" in messages[0]
+    assert messages[1].endswith("ValueError: bad chunk (repeated 2 times in the last 0s)")
@@ -0,0 +1,69 @@
+from threading import Thread
+
+import pytest
+
+from rpi_intercom.config import Config
+from rpi_intercom.metrics import Registry, roomOf
+
+
+def test_counter_from_many_threads():
+    registry = Registry()
+    counter = registry.counter("drops_total", "Drops", room="kitchen")
+
+    def count():
+        for _ in range(10000):
+            counter.inc()
+
+    threads = [Thread(target=count) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counter.inc(5)
+    assert counter.value == 40005
+    assert registry.counter("drops_total", "Drops", room="kitchen") is counter
+    assert registry.counter("drops_total", "Drops", room="garage") is not counter
+
+
+def test_render():
+    registry = Registry()
+    registry.counter("drops_total", "Audio \\ dropped\nsomewhere", room='say "hi"').inc(3)
+    registry.gauge("backlog_seconds", "Backlog", source=lambda: 0.25, room="kitchen")
+    registry.gauge("connected", "Connected").set(True)
+    registry.gauge("missing", "Not known yet", source=lambda: None)
+    assert registry.render() == "\n".join([
+        "# HELP backlog_seconds Backlog",
+        "# TYPE backlog_seconds gauge",
+        'backlog_seconds{room="kitchen"} 0.25',
+        "# HELP connected Connected",
+        "# TYPE connected gauge",
+        "connected 1",
+        "# HELP drops_total Audio \\\\ dropped\\nsomewhere",
+        "# TYPE drops_total counter",
+        'drops_total{room="say \\"hi\\""} 3',
+        "# HELP missing Not known yet",
+        "# TYPE missing gauge",
+        "",
+    ])
+
+
+def test_sources():
+    registry = Registry()
+    stats = {'overruns': 2}
+    counter = registry.counter("overruns_total", "Overruns", source=lambda: stats['overruns'])
+    stats['overruns'] = 4
+    assert counter.value == 4
+    # A new source takes over from the old one
+    replaced = registry.counter("overruns_total", "Overruns", source=lambda: 7)
+    assert replaced.value == 7
+    assert "overruns_total 7\n" in registry.render()
+    # A broken source is left out rather than breaking the scrape
+    registry.gauge("broken", "Broken", source=lambda: 1 / 0)
+    assert "\nbroken " not in registry.render()
+    with pytest.raises(ValueError):
+        registry.gauge("overruns_total", "Overruns")
+
+
+def test_room_of():
+    assert roomOf(Config()) == "default"
+    assert roomOf(Config(endpoints=[{"name": "kitchen"}]).endpointConfigs()[0]) == "kitchen"
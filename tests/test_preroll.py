@@ -0,0 +1,53 @@
+import numpy as np
+
+from rpi_intercom.preroll import PreRoll
+from rpi_intercom.rechunk import AUDIO_DATA_TYPE
+
+CHUNK = 480
+
+
+def chunk(value: int) -> bytes:
+    return np.full(CHUNK, value, dtype=AUDIO_DATA_TYPE).tobytes()
+
+
+def samples(pcm: bytes) -> np.ndarray:
+    return np.frombuffer(pcm, dtype=AUDIO_DATA_TYPE)
+
+
+def test_closed_gate_sends_nothing():
+    preroll = PreRoll(0.02, rate=48000)
+    for i in range(5):
+        assert preroll.process(chunk(i + 1), False) is None
+
+
+def test_opening_sends_the_preroll_first_then_catches_up():
+    # 960 samples of pre-roll, two chunks
+    preroll = PreRoll(0.02, catchup=1.5, rate=48000)
+    for i in range(1, 6):
+        preroll.process(chunk(i), False)
+    out = samples(preroll.process(chunk(6), True))
+    assert len(out) == CHUNK
+    # Starts with the two chunks from before the gate opened
+    assert out[0] == 4
+    assert preroll.behind > 0
+    sent = [out]
+    for i in range(7, 20):
+        sent.append(samples(preroll.process(chunk(i), True)))
+    assert preroll.behind == 0
+    # Caught up, so chunks pass through untouched
+    assert np.array_equal(sent[-1], samples(chunk(19)))
+    # Nothing was skipped on the way
+    values = np.concatenate(sent)
+    assert set(range(4, 20)) <= set(values.tolist())
+
+
+def test_backlog_drains_after_closing():
+    preroll = PreRoll(0.02, catchup=1.1, rate=48000)
+    for i in range(1, 4):
+        preroll.process(chunk(i), False)
+    preroll.process(chunk(4), True)
+    out = preroll.process(chunk(5), False)
+    assert out is not None and len(samples(out)) == CHUNK
+    while out is not None:
+        out = preroll.process(chunk(0), False)
+    assert preroll.behind == 0
@@ -0,0 +1,92 @@
+import time
+from threading import Event, Thread
+
+from rpi_intercom import profiler
+from rpi_intercom.profiler import Profiler
+
+
+def busy_speaker(stop: Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def run_thread(name, target):
+    stop = Event()
+    thread = Thread(target=target, args=(stop,), name=name, daemon=True)
+    thread.start()
+    return stop, thread
+
+
+def test_samples_named_threads_as_collapsed_stacks():
+    stop, thread = run_thread("Speaker Thread", busy_speaker)
+    other_stop, other = run_thread("Something Else", busy_speaker)
+    changes = []
+    profile = Profiler(changes.append)
+    try:
+        assert profile.start(seconds=0.3, interval=0.005)
+        assert not profile.start()
+        profile._thread.join(5)
+    finally:
+        stop.set()
+        other_stop.set()
+    assert not profile.running
+    status = profile.status()
+    assert status['samples'] > 0
+    assert status['available']
+    assert changes[0]['running']
+    assert not changes[-1]['running']
+
+    lines = profile.collapsed().splitlines()
+    assert len(lines) > 0
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
+        frames = stack.split(";")
+        # Root first, starting with the thread's name
+        assert frames[0] == "Speaker Thread"
+        assert frames[1].startswith("_bootstrap (threading.py:")
+    assert any("busy_speaker (test_profiler.py:" in line for line in lines)
+
+
+def test_stop_ends_early():
+    profile = Profiler()
+    profile.start(["Nobody"], seconds=60)
+    started = time.monotonic()
+    profile.stop()
+    assert time.monotonic() - started < 1
+    assert not profile.running
+    assert profile.collapsed() == ""
+    assert not profile.status()['available']
+
+
+def test_sessions_are_time_boxed():
+    profile = Profiler()
+    profile.start(["Nobody"], seconds=10 * profiler.MAX_SECONDS)
+    profile.stop()
+    assert profile.status()['seconds'] == profiler.MAX_SECONDS
+    for seconds in [float("nan"), float("inf"), "nan"]:
+        profile.start(["Nobody"], seconds=seconds, interval=float("nan"))
+        profile.stop()
+        assert profile.status()['seconds'] == profiler.DEFAULT_SECONDS
+        assert profile.status()['interval_ms'] == profiler.DEFAULT_INTERVAL * 1000
+
+
+def test_distinct_stacks_are_capped(monkeypatch):
+    monkeypatch.setattr(profiler, "MAX_STACKS", 1)
+
+    def recurse(stop, depth=0):
+        # A different stack every time it's sampled
+        if not stop.is_set():
+            time.sleep(0.001)
+            recurse(stop, (depth + 1) % 50)
+
+    stop, thread = run_thread("Transmit Thread", recurse)
+    profile = Profiler()
+    try:
+        profile.start(seconds=0.3, interval=0.005)
+        profile._thread.join(5)
+    finally:
+        stop.set()
+    lines = profile.collapsed().splitlines()
+    assert len(lines) <= 2
+    assert any(line.startswith(f"Transmit Thread;{profiler.OTHER_STACKS} ") for line in lines)
@@ -0,0 +1,24 @@
+import pytest
+
+from rpi_intercom.realtime import parseCpus, spreadCpus
+
+
+def test_parse_cpus():
+    assert parseCpus("3") == {3}
+    assert parseCpus("0-2") == {0, 1, 2}
+    assert parseCpus("0-1, 3") == {0, 1, 3}
+
+
+def test_parse_bad_cpus():
+    with pytest.raises(ValueError):
+        parseCpus("")
+    with pytest.raises(ValueError):
+        parseCpus("3-1")
+    with pytest.raises(ValueError):
+        parseCpus("a")
+
+
+def test_spread_cpus():
+    assert spreadCpus("2-3", 2) == ["2", "3"]
+    assert spreadCpus("3, 1", 3) == ["1", "3", "1"]
+    assert spreadCpus("3", 2) == ["3", "3"]
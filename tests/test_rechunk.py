@@ -0,0 +1,40 @@
+import numpy as np
+
+from rpi_intercom.rechunk import Rechunker, AUDIO_DATA_TYPE
+
+
+def pcm(values):
+    return np.array(values, dtype=AUDIO_DATA_TYPE).tobytes()
+
+
+def samples(data: bytes):
+    return list(np.frombuffer(data, dtype=AUDIO_DATA_TYPE))
+
+
+def test_aligns_frames():
+    rechunker = Rechunker(4, 100)
+    assert rechunker.push(pcm([1, 2, 3])) == []
+    assert rechunker.pending == 3
+
+    frames = rechunker.push(pcm([4, 5, 6, 7, 8, 9, 10]))
+    assert [samples(frame) for frame in frames] == [[1, 2, 3, 4], [5, 6, 7, 8]]
+    assert rechunker.pending == 2
+
+
+def test_flush_pads_with_silence():
+    rechunker = Rechunker(4, 100)
+    assert rechunker.flush() == b''
+    rechunker.push(pcm([-1, 2, -3, 4, 5]))
+    assert samples(rechunker.flush()) == [5, 0, 0, 0]
+    assert rechunker.pending == 0
+
+
+def test_frame_size_change():
+    rechunker = Rechunker(4, 100)
+    rechunker.push(pcm([1, 2, 3]))
+    rechunker.set_frame_samples(2)
+    frames = rechunker.push(pcm([4]))
+    assert [samples(frame) for frame in frames] == [[1, 2], [3, 4]]
+    rechunker.push(pcm([5]))
+    rechunker.clear()
+    assert rechunker.pending == 0
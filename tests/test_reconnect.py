@@ -0,0 +1,34 @@
+import time
+
+from rpi_intercom.reconnect import Backoff, PhaseTimer
+
+
+def test_first_retry_is_immediate_then_backs_off():
+    backoff = Backoff(initial=0.5, maximum=4, jitter=0)
+    assert [backoff.next() for _ in range(7)] == [0, 0.5, 1, 2, 4, 4, 4]
+    assert backoff.attempts == 7
+    backoff.reset()
+    assert backoff.next() == 0
+
+
+def test_jitter_only_shortens_the_delay():
+    backoff = Backoff(initial=1, maximum=1, jitter=0.5)
+    backoff.next()
+    delays = [backoff.next() for _ in range(100)]
+    assert all(0.5 <= delay <= 1 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+def test_phase_timer():
+    timer = PhaseTimer()
+    timer.mark("ignored")
+    assert timer.timings == {}
+    timer.start()
+    time.sleep(0.01)
+    timer.mark("tcp")
+    timer.mark("tls")
+    timings = timer.timings
+    assert list(timings) == ["tcp", "tls"]
+    assert timings["tcp"] >= 0.01
+    assert timer.total >= timings["tcp"]
+    assert timer.describe().startswith("tcp ")
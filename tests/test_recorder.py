@@ -0,0 +1,155 @@
+import os
+import struct
+
+import numpy as np
+
+from rpi_intercom.config import Config
+from rpi_intercom.recorder import OGG_BOS, OGG_EOS, PRE_SKIP, RECORD_FRAME, OggOpusWriter, Recorder, oggCrc
+
+
+class FakeEncoder:
+    '''Stands in for opus, each packet is the first sample of its frame'''
+    def encode(self, pcm: bytes, samples: int) -> bytes:
+        assert len(pcm) == samples * 2
+        return pcm[:2] * 20
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000000.0
+
+    def __call__(self):
+        return self.now
+
+
+def pages(data: bytes):
+    '''Parses Ogg pages, checking each one's CRC'''
+    found = []
+    offset = 0
+    while offset < len(data):
+        assert data[offset:offset + 4] == b"OggS"
+        _, flags, granule, _serial, sequence, crc, count = struct.unpack_from("<BBqIIIB", data, offset + 4)
+        lacing = data[offset + 27:offset + 27 + count]
+        end = offset + 27 + count + sum(lacing)
+        page = bytearray(data[offset:end])
+        page[22:26] = b"\0\0\0\0"
+        assert oggCrc(bytes(page)) == crc
+        packets = []
+        start = offset + 27 + count
+        length = 0
+        for value in lacing:
+            length += value
+            if value < 255:
+                packets.append(data[start:start + length])
+                start += length
+                length = 0
+        found.append((flags, granule, sequence, packets))
+        offset = end
+    return found
+
+
+def test_ogg_crc():
+    assert oggCrc(b"123456789") == 0x89A1897F
+
+
+def test_ogg_opus_pages(tmp_path):
+    path = tmp_path / "test.opus"
+    with open(path, "wb") as f:
+        writer = OggOpusWriter(f, serial=7)
+        writer.add(b"a" * 300, 960)
+        writer.add(b"b", 960)
+        writer.flush()
+        writer.add(b"c", 960)
+        writer.close()
+    found = pages(path.read_bytes())
+    assert [flags for flags, _, _, _ in found] == [OGG_BOS, 0, 0, OGG_EOS]
+    assert [sequence for _, _, sequence, _ in found] == [0, 1, 2, 3]
+    assert found[0][3][0][:8] == b"OpusHead"
+    assert struct.unpack_from("<H", found[0][3][0], 10)[0] == PRE_SKIP
+    assert found[1][3][0][:8] == b"OpusTags"
+    assert found[2][3] == [b"a" * 300, b"b"]
+    assert found[2][1] == 2 * 960
+    assert found[3][3] == [b"c"]
+    assert found[3][1] == 3 * 960
+
+
+def test_ogg_flush_over_several_pages(tmp_path):
+    path = tmp_path / "test.opus"
+    with open(path, "wb") as f:
+        writer = OggOpusWriter(f, serial=7)
+        # Packets needing 2 lacing values each only fit 127 to a page
+        for i in range(300):
+            writer.add(bytes([i % 256]) * 300, 960)
+        writer.flush()
+        writer.close()
+    found = pages(path.read_bytes())[2:]
+    assert [len(packets) for _, _, _, packets in found] == [127, 127, 46, 0]
+    # Each page ends at its own last packet
+    assert [granule for _, granule, _, _ in found] == [127 * 960, 254 * 960, 300 * 960, 300 * 960]
+
+
+def frame(value, samples=RECORD_FRAME):
+    return np.full(samples, value, dtype=np.int16).tobytes()
+
+
+def recorder(tmp_path, clock, **options):
+    config = Config(record_dir=str(tmp_path), record_segment=60, **options)
+    return Recorder(config, encoder_factory=FakeEncoder, clock=clock, queue_seconds=1)
+
+
+def test_records_and_rotates(tmp_path):
+    clock = Clock()
+    rec = recorder(tmp_path, clock)
+    rec.transmitted(frame(1, RECORD_FRAME + 100))
+    rec.played(np.zeros(512))
+    rec.played(np.full(RECORD_FRAME, 0.5))
+    rec.write()
+    names = sorted(os.listdir(tmp_path))
+    assert len(names) == 2
+    assert names[0].startswith("default-playback-") and names[1].startswith("default-transmit-")
+
+    clock.now += 61
+    rec.transmitted(frame(2))
+    rec.write()
+    transmit = sorted(name for name in os.listdir(tmp_path) if "transmit" in name)
+    assert len(transmit) == 2
+    # The first file was finished off with the rest of its audio padded out to a frame
+    found = pages((tmp_path / transmit[0]).read_bytes())
+    assert found[-1][0] == OGG_EOS
+    assert sum(len(packets) for _, _, _, packets in found[2:]) == 2
+    rec._close(rec._streams["transmit"])
+    found = pages((tmp_path / transmit[1]).read_bytes())
+    assert [packets for _, _, _, packets in found[2:]] == [[frame(2)[:2] * 20], []]
+
+
+def test_drops_when_the_writer_falls_behind(tmp_path):
+    rec = recorder(tmp_path, Clock())
+    for _ in range(60):
+        rec.transmitted(frame(1))
+    assert rec._streams["transmit"].buffer.overflowed_samples == 60 * RECORD_FRAME - 48000
+
+
+def test_old_recordings_are_deleted(tmp_path):
+    clock = Clock()
+    for i, age in enumerate([10, 5, 1]):
+        path = tmp_path / f"default-transmit-20260101-00000{i}.opus"
+        path.write_bytes(b"x" * 100)
+        os.utime(path, (clock.now - age * 24 * 60 * 60, clock.now - age * 24 * 60 * 60))
+    (tmp_path / "kitchen-transmit-20260101-000000.opus").write_bytes(b"x" * 1000)
+    rec = recorder(tmp_path, clock, record_max_age=7, record_max_size=150)
+    rec._expire()
+    assert sorted(os.listdir(tmp_path)) == ["default-transmit-20260101-000002.opus", "kitchen-transmit-20260101-000000.opus"]
+
+
+def test_rooms_only_expire_their_own_recordings(tmp_path):
+    clock = Clock()
+    old = clock.now - 30 * 24 * 60 * 60
+    for name in ["front-door-transmit-20260101-000000.opus", "front-playback-20260101-000000.opus", "front-notes.opus"]:
+        (tmp_path / name).write_bytes(b"x" * 100)
+        os.utime(tmp_path / name, (old, old))
+    config = Config(record_dir=str(tmp_path), record_max_age=7)
+    config._name = "front"
+    rec = Recorder(config, encoder_factory=FakeEncoder, clock=clock)
+    assert [os.path.basename(path) for _, _, path in rec.recordings()] == ["front-playback-20260101-000000.opus"]
+    rec._expire()
+    assert sorted(os.listdir(tmp_path)) == ["front-door-transmit-20260101-000000.opus", "front-notes.opus"]
@@ -0,0 +1,105 @@
+import os
+import time
+
+from rpi_intercom.config import Config, Options
+from rpi_intercom.reload import ConfigReloader
+
+
+def write(path, text):
+    path.write_text(text)
+    # So the change shows up even within the file system's timestamp resolution
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_applies_live_changes(tmp_path):
+    path = tmp_path / "config.yaml"
+    write(path, "server: a\nvolume: 10\n")
+    config = Config.fromFile(str(path))
+    applied = []
+    reloader = ConfigReloader(config, applied.append)
+
+    reloader._check()
+    assert applied == []
+
+    write(path, "server: b\nvolume: 20\nchannel: Kitchen\n")
+    reloader._check()
+    assert applied == [{Options.VOLUME, Options.CHANNEL}]
+    assert config.volume == 20
+    assert config.channel == "Kitchen"
+    # The server needs a restart
+    assert config.server == "a"
+
+    reloader._check()
+    assert len(applied) == 1
+
+
+def test_keeps_running_config_when_the_file_is_bad(tmp_path):
+    path = tmp_path / "config.yaml"
+    write(path, "server: a\nvolume: 10\n")
+    config = Config.fromFile(str(path))
+    applied = []
+    reloader = ConfigReloader(config, applied.append)
+
+    write(path, "server: a\nvolume: loud\n")
+    reloader._check()
+    write(path, "server: [a\n")
+    reloader._check()
+    assert applied == []
+    assert config.volume == 10
+
+
+def test_reload_on_signal(tmp_path):
+    path = tmp_path / "config.yaml"
+    write(path, "server: a\nvolume: 10\n")
+    config = Config.fromFile(str(path))
+    applied = []
+    reloader = ConfigReloader(config, applied.append, interval=60)
+    reloader.start()
+    try:
+        # Changed without the modification time changing, so only the signal catches it
+        path.write_text("server: a\nvolume: 30\n")
+        os.utime(path, ns=(config.mtime, config.mtime))
+        reloader.reload()
+        for _ in range(100):
+            if applied:
+                break
+            time.sleep(0.01)
+    finally:
+        reloader.stop()
+    assert applied == [{Options.VOLUME}]
+
+
+def test_own_saves_arent_reloaded(tmp_path):
+    path = tmp_path / "config.yaml"
+    write(path, "server: a\nvolume: 10\nendpoints:\n  - name: front\n  - name: back\n")
+    config = Config.fromFile(str(path))
+    applied = []
+    reloader = ConfigReloader(config, applied.append)
+
+    front, back = config.endpointConfigs()
+    front._volume = 70
+    front.dirty()
+    reloader._check()
+    assert applied == []
+    assert config.endpoints[0]["volume"] == 70
+
+    # Edits made after that are still picked up, without the saved volume
+    write(path, path.read_text().replace("server: a", "server: a\nchannel: Kitchen"))
+    reloader._check()
+    assert applied == [{Options.CHANNEL}]
+
+
+def test_own_saves_arent_reloaded_without_endpoints(tmp_path):
+    path = tmp_path / "config.yaml"
+    write(path, "server: a\nvolume: 10\n")
+    config = Config.fromFile(str(path))
+    applied = []
+    reloader = ConfigReloader(config, applied.append)
+
+    endpoint, = config.endpointConfigs()
+    endpoint._volume = 70
+    endpoint.dirty()
+    reloader._check()
+    assert applied == []
+    assert config.volume == 70
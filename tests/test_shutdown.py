@@ -0,0 +1,19 @@
+import asyncio
+from threading import Thread
+
+from rpi_intercom.config import Config
+from rpi_intercom.shutdown import Shutdown
+
+
+def test_shutdown_from_another_thread():
+    async def main():
+        shutdown = Shutdown(Config())
+        shutdown.start()
+        try:
+            Thread(target=shutdown.shutdown).start()
+            await asyncio.wait_for(shutdown.wait_for_shutdown(), 5)
+            assert shutdown.shutting_down
+        finally:
+            # Don't let it kill the test run after its grace period
+            shutdown._shutdown_task.cancel()
+    asyncio.run(main())
@@ -0,0 +1,59 @@
+from threading import Thread
+import numpy as np
+
+from rpi_intercom.spsc import SpscBuffer
+
+
+def test_basic_spsc():
+    buffer = SpscBuffer(5)
+    assert buffer.push(np.array([0, 1, 2])) == 3
+    assert buffer.length == 3
+    np.testing.assert_array_equal(buffer.pop(2), [0, 1])
+    assert buffer.push(np.array([3, 4, 5, 6])) == 4
+    np.testing.assert_array_equal(buffer.pop(5), [2, 3, 4, 5, 6])
+    assert buffer.underflows == 0
+    assert buffer.overflows == 0
+
+
+def test_overflow_drops_newest():
+    buffer = SpscBuffer(4)
+    buffer.push(np.array([1, 2, 3]))
+    assert buffer.push(np.array([4, 5, 6])) == 1
+    assert buffer.overflows == 1
+    assert buffer.overflowed_samples == 2
+    assert buffer.push(np.array([7])) == 0
+    np.testing.assert_array_equal(buffer.pop(4), [1, 2, 3, 4])
+
+
+def test_underflow():
+    buffer = SpscBuffer(4)
+    buffer.push(np.array([1, 2]))
+    np.testing.assert_array_equal(buffer.pop(3), [1, 2])
+    assert buffer.underflows == 1
+    assert buffer.underflowed_samples == 1
+    assert len(buffer.pop(1)) == 0
+    buffer.push(np.array([3]))
+    buffer.clear()
+    assert buffer.length == 0
+
+
+def test_concurrent_producer_consumer():
+    buffer = SpscBuffer(257)
+    total = 20000
+    received = []
+
+    def produce():
+        sent = 0
+        while sent < total:
+            chunk = np.arange(sent, min(total, sent + 97))
+            sent += buffer.push(chunk)
+
+    producer = Thread(target=produce)
+    producer.start()
+    count = 0
+    while count < total:
+        chunk = buffer.pop(61)
+        received.append(chunk)
+        count += len(chunk)
+    producer.join()
+    np.testing.assert_array_equal(np.concatenate(received), np.arange(total))
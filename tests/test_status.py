@@ -0,0 +1,51 @@
+import asyncio
+from threading import Thread
+
+from rpi_intercom.status import StatusBus
+
+
+def test_only_changes_are_delivered():
+    async def run():
+        bus = StatusBus(min_interval=0)
+        delivered = []
+
+        async def listener(changes):
+            delivered.append(changes)
+        bus.attach(listener)
+        bus.publish(vad=1, volume=50)
+        bus.start()
+        await asyncio.sleep(0.01)
+        bus.publish(vad=1, volume=60)
+        await asyncio.sleep(0.01)
+        bus.publish(vad=1)
+        await asyncio.sleep(0.01)
+        bus.stop()
+        return bus, delivered
+    bus, delivered = asyncio.run(run())
+    assert delivered == [{'vad': 1, 'volume': 50}, {'volume': 60}]
+    assert bus.snapshot() == {'vad': 1, 'volume': 60}
+
+
+def test_changes_are_coalesced():
+    async def run():
+        bus = StatusBus(min_interval=0.1)
+        delivered = []
+
+        async def listener(changes):
+            delivered.append(changes)
+        bus.attach(listener)
+        bus.start()
+        bus.publish(vad=0)
+        await asyncio.sleep(0.01)
+
+        def publisher():
+            for vad in range(1, 100):
+                bus.publish(vad=vad, transmitting=vad > 50)
+        thread = Thread(target=publisher)
+        thread.start()
+        thread.join()
+        await asyncio.sleep(0.2)
+        bus.stop()
+        return delivered
+    delivered = asyncio.run(run())
+    assert delivered == [{'vad': 0}, {'vad': 99, 'transmitting': True}]
@@ -0,0 +1,73 @@
+import numpy as np
+
+from rpi_intercom.talkers import TalkerPool
+
+
+def frame(samples=4, value=1000):
+    return np.full(samples, value, dtype=np.int16).tobytes()
+
+
+def test_only_active_talkers_are_read():
+    pool = TalkerPool(2, 100, 4)
+    assert pool.active() == []
+    pool.buffer(1, "alice", frame())
+    pool.buffer(2, "bob", frame())
+    assert sorted(speaker.name for speaker in pool.active()) == ["alice", "bob"]
+
+    for speaker in pool.active():
+        assert speaker.read(4) is not None
+    for speaker in pool.active():
+        assert speaker.read(4) is None
+        pool.idle(speaker)
+    assert pool.active() == []
+    assert len(pool) == 2
+
+
+def test_prebuffering_talker_stays_active():
+    pool = TalkerPool(1, 100, 8)
+    pool.buffer(1, "alice", frame())
+    speaker = pool.active()[0]
+    assert speaker.read(4) is None
+    pool.idle(speaker)
+    assert pool.active() == [speaker]
+
+
+def test_keyed_by_session():
+    pool = TalkerPool(2, 100, 4)
+    pool.buffer(1, "alice", frame())
+    pool.buffer(1, "alice (renamed)", frame())
+    assert len(pool) == 1
+    assert pool.active()[0].length == 8
+
+
+def test_idle_talkers_are_evicted():
+    pool = TalkerPool(1, 100, 4, idle_timeout=10)
+    pool.buffer(1, "alice", frame())
+    speaker = pool.active()[0]
+    pool.evict(speaker.last_buffered + 5)
+    assert len(pool) == 1
+    pool.evict(speaker.last_buffered + 11)
+    assert len(pool) == 0
+    assert pool.active() == []
+
+    # The same Speaker gets handed out again, empty
+    pool.buffer(2, "bob", frame())
+    assert pool.active() == [speaker]
+    assert speaker.session == 2
+    assert speaker.length == 4
+
+
+def test_full_pool():
+    pool = TalkerPool(1, 100, 4)
+    pool.buffer(1, "alice", frame())
+    pool.buffer(2, "bob", frame())
+    assert pool.dropped == 1
+    assert [speaker.name for speaker in pool.active()] == ["alice"]
+
+    # Once alice goes quiet bob can take her place
+    speaker = pool.active()[0]
+    speaker.read(4)
+    speaker.read(4)
+    pool.idle(speaker)
+    pool.buffer(2, "bob", frame())
+    assert [speaker.name for speaker in pool.active()] == ["bob"]
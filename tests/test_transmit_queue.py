@@ -0,0 +1,68 @@
+import queue
+from threading import Thread
+
+import numpy as np
+import pytest
+
+from rpi_intercom.transmit_queue import TransmitQueue
+
+RATE = 1000
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def chunk(value, samples=100):
+    '''100ms of audio at 1kHz'''
+    return np.full(samples, value, dtype=np.int16).tobytes()
+
+
+def test_drops_the_oldest_audio():
+    transmit = TransmitQueue(0.3, 1, rate=RATE, clock=Clock())
+    for i in range(5):
+        transmit.put(chunk(i))
+    assert len(transmit) == 3
+    assert transmit.duration == pytest.approx(0.3)
+    assert transmit.overflowed == pytest.approx(0.2)
+    assert [transmit.get(0)[0] for _ in range(3)] == [chunk(2), chunk(3), chunk(4)]
+    assert transmit.duration == 0
+
+
+def test_stale_audio_expires():
+    clock = Clock()
+    transmit = TransmitQueue(1, 0.25, rate=RATE, clock=clock)
+    transmit.put(chunk(1))
+    clock.now = 0.2
+    transmit.put(chunk(2))
+    clock.now = 0.3
+    assert transmit.get(0) == (chunk(2), pytest.approx(0.1))
+    assert transmit.expired == pytest.approx(0.1)
+    with pytest.raises(queue.Empty):
+        transmit.get(0)
+
+
+def test_get_waits_for_audio():
+    transmit = TransmitQueue(1, 1, rate=RATE)
+    with pytest.raises(queue.Empty):
+        transmit.get(0.01)
+    putter = Thread(target=transmit.put, args=(chunk(1),))
+    putter.start()
+    assert transmit.get(1)[0] == chunk(1)
+    putter.join()
+
+
+def test_limits_change():
+    transmit = TransmitQueue(1, 1, rate=RATE, clock=Clock())
+    for i in range(5):
+        transmit.put(chunk(i))
+    transmit.setLimits(0.1, 1)
+    transmit.put(chunk(5))
+    assert len(transmit) == 1
+    transmit.clear()
+    assert len(transmit) == 0
+    assert transmit.duration == 0
@@ -0,0 +1,153 @@
+import socket
+import time
+
+import pytest
+
+from rpi_intercom.udp import AUDIO_TYPE_PING, CryptStateOCB2, UdpVoice, decodeVarint, encodeVarint, udpAvailable
+
+pytestmark = pytest.mark.skipif(not udpAvailable(), reason="pycryptodome isn't installed")
+
+KEY = bytes(range(16))
+
+
+def pair():
+    '''A client and server crypt state, as set up by the server's CryptSetup'''
+    client_nonce = bytes(range(16, 32))
+    server_nonce = bytes(range(32, 48))
+    client = CryptStateOCB2()
+    client.setKey(KEY, client_nonce, server_nonce)
+    server = CryptStateOCB2()
+    server.setKey(KEY, server_nonce, client_nonce)
+    return client, server
+
+
+def test_ocb2_vectors():
+    # From mumble's own tests
+    crypt = CryptStateOCB2()
+    crypt.setKey(KEY, KEY, KEY)
+    encrypted, tag = crypt.ocbEncrypt(b"", KEY)
+    assert encrypted == b""
+    assert tag.hex().upper() == "BF3108130773AD5EC70EC69E7875A7B0"
+
+    encrypted, tag = crypt.ocbEncrypt(bytes(range(40)), KEY)
+    assert encrypted.hex().upper() == "F75D6BC8B4DC8D66B836A2B08B32A6369F1CD3C5228D79FD6C267F5F6AA7B231C7DFB9D59951AE9C"
+    assert tag.hex().upper() == "9DB0CDF880F73E3E10D4EB3217766688"
+    plain, decrypted_tag = crypt.ocbDecrypt(encrypted, KEY)
+    assert plain == bytes(range(40))
+    assert decrypted_tag == tag
+
+
+def test_round_trip():
+    client, server = pair()
+    for size in (0, 1, 15, 16, 17, 100):
+        message = bytes(range(size))
+        assert server.decrypt(client.encrypt(message)) == message
+        assert client.decrypt(server.encrypt(message)) == message
+    assert server.good == 6
+    assert server.late == 0
+    assert server.lost == 0
+
+
+def test_tampered_and_replayed_packets_are_rejected():
+    client, server = pair()
+    packet = client.encrypt(b"voice")
+    tampered = bytearray(packet)
+    tampered[-1] ^= 1
+    assert server.decrypt(bytes(tampered)) is None
+    assert server.decrypt(packet) == b"voice"
+    assert server.decrypt(packet) is None
+    assert server.good == 1
+
+
+def test_lost_and_late_packets():
+    client, server = pair()
+    packets = [client.encrypt(i.to_bytes(2, "big")) for i in range(300)]
+    assert server.decrypt(packets[0]) == (0).to_bytes(2, "big")
+    # 1 and 2 lost on the way, then 1 turns up late
+    assert server.decrypt(packets[3]) == (3).to_bytes(2, "big")
+    assert server.lost == 2
+    assert server.decrypt(packets[1]) == (1).to_bytes(2, "big")
+    assert server.late == 1
+    assert server.lost == 1
+    assert server.decrypt(packets[1]) is None
+    # Across the low nonce byte wrapping around
+    for i in range(4, 300):
+        if i != 256:
+            assert server.decrypt(packets[i]) == i.to_bytes(2, "big")
+    assert server.lost == 2
+    assert server.good == 298
+
+
+def test_varint():
+    for value in (0, 0x7F, 0x80, 0x3FFF, 0x4000, 0x1FFFFF, 0x200000, 0xFFFFFFF, 0x10000000, 2**40):
+        encoded = encodeVarint(value)
+        assert decodeVarint(encoded + b"\xff") == (value, len(encoded))
+
+
+class EchoServer:
+    '''Stands in for a mumble server's UDP port, answering pings and optionally going quiet'''
+    def __init__(self, crypt: CryptStateOCB2):
+        self.crypt = crypt
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(("127.0.0.1", 0))
+        self.socket.settimeout(0.01)
+        self.address = self.socket.getsockname()
+        self.answering = True
+        self.voice = []
+
+    def serve(self):
+        try:
+            data, address = self.socket.recvfrom(1024)
+        except socket.timeout:
+            return
+        plain = self.crypt.decrypt(data)
+        if plain is None:
+            return
+        if plain[0] >> 5 == AUDIO_TYPE_PING:
+            if self.answering:
+                self.socket.sendto(self.crypt.encrypt(plain), address)
+        else:
+            self.voice.append(plain)
+            self.socket.sendto(self.crypt.encrypt(plain), address)
+
+    def close(self):
+        self.socket.close()
+
+
+def drive(udp: UdpVoice, server: EchoServer, seconds: float):
+    received = []
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        udp.poll()
+        server.serve()
+        received.extend(udp.receive())
+    return received
+
+
+def test_udp_voice_falls_back_when_pings_stop():
+    client, server_crypt = pair()
+    server = EchoServer(server_crypt)
+    udp = UdpVoice(server.address, client, ping_interval=0.02, timeout=0.1)
+    try:
+        assert not udp.send(b"\x80tunnelled")
+        assert udp.tunnelled == 1
+
+        drive(udp, server, 0.1)
+        assert udp.active
+        assert udp.send(b"\x80voice")
+        assert drive(udp, server, 0.05) == [b"\x80voice"]
+        assert server.voice == [b"\x80voice"]
+        assert udp.stats()['rtt_ms'] is not None
+
+        server.answering = False
+        drive(udp, server, 0.2)
+        assert not udp.active
+        assert not udp.send(b"\x80tunnelled")
+        assert udp.tunnelled == 2
+
+        server.answering = True
+        drive(udp, server, 0.1)
+        assert udp.active
+    finally:
+        udp.close()
+        server.close()
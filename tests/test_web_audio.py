@@ -0,0 +1,135 @@
+import struct
+from types import SimpleNamespace
+
+import numpy as np
+
+from rpi_intercom.config import Config
+from rpi_intercom.sound import Sound
+from rpi_intercom.status import StatusBus
+from rpi_intercom import web_audio
+from rpi_intercom.web_audio import AudioClient, HEADER, WebAudio, ROUTE_BOTH, ROUTE_LOCAL, ROUTE_MUMBLE
+
+CHUNK = 4
+
+
+def make_sound(transmitting=True):
+    devices = SimpleNamespace(chunk_size=CHUNK)
+    mumble = SimpleNamespace(_sound_callback=None)
+    control = SimpleNamespace(transmitting=transmitting, deafened=False)
+    return Sound(devices, mumble, control, Config())
+
+
+def connect(web: WebAudio, sound: Sound, id: int) -> AudioClient:
+    client = AudioClient(None, id, 4)
+    web._clients[id] = client
+    source = sound.addTransmitSource(("web", id), 100)
+    return client, source
+
+
+def frame(sequence, value=1000):
+    return HEADER.pack(sequence) + np.full(CHUNK, value, dtype=np.int16).tobytes()
+
+
+def test_talking_holds_transmit_per_client():
+    sound = make_sound(transmitting=False)
+    web = WebAudio(sound, StatusBus(), CHUNK)
+    first, _ = connect(web, sound, 1)
+    second, _ = connect(web, sound, 2)
+
+    web._receiveMessage(first, {'type': 'talk', 'active': True})
+    web._receiveMessage(second, {'type': 'talk', 'active': True, 'route': ROUTE_BOTH})
+    assert sound.transmit_held
+    web._receiveMessage(first, {'type': 'talk', 'active': False})
+    # The other client is still talking
+    assert sound.transmit_held
+    sound.removeTransmitSource(("web", 2))
+    assert not sound.transmit_held
+    # The room's own transmit state is never touched
+    assert sound._control.transmitting is False
+
+
+def test_local_talk_doesnt_hold_transmit():
+    sound = make_sound()
+    web = WebAudio(sound, StatusBus(), CHUNK)
+    client, _ = connect(web, sound, 1)
+    web._receiveMessage(client, {'type': 'talk', 'active': True, 'route': ROUTE_LOCAL})
+    assert client.route == ROUTE_LOCAL
+    assert not sound.transmit_held
+    web._receiveMessage(client, {'type': 'talk', 'active': True, 'route': "nowhere"})
+    assert client.route == ROUTE_MUMBLE
+    assert sound.transmit_held
+
+
+def test_routes_talk_audio():
+    sound = make_sound()
+    web = WebAudio(sound, StatusBus(), CHUNK)
+    client, source = connect(web, sound, 1)
+    web._receiveAudio(client, source, frame(0))
+    assert source.length == 0, "Not talking yet"
+    web._receiveMessage(client, {'type': 'talk', 'active': True, 'route': ROUTE_MUMBLE})
+    web._receiveAudio(client, source, frame(1))
+    assert source.length == CHUNK
+    assert len(sound._talkers) == 0
+    web._receiveMessage(client, {'type': 'talk', 'active': True, 'route': ROUTE_LOCAL})
+    web._receiveAudio(client, source, frame(2))
+    assert source.length == CHUNK
+    assert len(sound._talkers) == 1
+
+
+def test_held_transmit_leaves_out_the_microphone():
+    sound = make_sound(transmitting=False)
+    source = sound.addTransmitSource("web", 100)
+    microphone = np.full(CHUNK, 16384, dtype=np.int16).tobytes()
+    assert sound._mixTransmitSources(microphone, microphone=False) == bytes(CHUNK * 2)
+    source.push(np.full(CHUNK, 0.25))
+    mixed = np.frombuffer(sound._mixTransmitSources(microphone, microphone=False), dtype=np.int16)
+    assert np.allclose(mixed, 0.25 * 32767, atol=1)
+    source.push(np.full(CHUNK, 0.25))
+    mixed = np.frombuffer(sound._mixTransmitSources(microphone), dtype=np.int16)
+    assert np.all(mixed > 0.5 * 32767)
+
+
+def test_client_counts_dropped_and_missed_frames():
+    sound = make_sound()
+    web = WebAudio(sound, StatusBus(), CHUNK)
+    client, source = connect(web, sound, 1)
+    for i in range(6):
+        client.queue_audio(bytes(CHUNK * 2))
+    assert client.dropped == 2
+    assert client.queued_samples == 4 * CHUNK
+    assert [struct.unpack_from("<I", f)[0] for f in client.queue] == [2, 3, 4, 5]
+
+    for sequence in [0, 1, 4, 5]:
+        web._receiveAudio(client, source, frame(sequence))
+    assert client.received == 4
+    assert client.missed == 2
+    # The sequence number wraps around
+    client.last_received_sequence = 0xFFFFFFFF
+    web._receiveAudio(client, source, frame(0))
+    assert client.missed == 2
+
+
+def test_bad_pongs_are_ignored():
+    sound = make_sound()
+    web = WebAudio(sound, StatusBus(), CHUNK)
+    client, _ = connect(web, sound, 1)
+    for t in ["x", [1], {}, True, float("nan")]:
+        web._receiveMessage(client, {'type': 'pong', 't': t})
+    assert client.rtt is None
+    web._receiveMessage(client, {'type': 'pong', 't': 0, 'buffered': "lots"})
+    assert client.rtt is not None
+    assert client.client_buffer is None
+    web_audio.logger.flushLimited(force=True)
+
+
+def test_odd_length_frames_drop_the_trailing_byte():
+    sound = make_sound()
+    web = WebAudio(sound, StatusBus(), CHUNK)
+    client, source = connect(web, sound, 1)
+    web._receiveMessage(client, {'type': 'talk', 'active': True, 'route': ROUTE_MUMBLE})
+    web._receiveAudio(client, source, frame(0) + b"\x01")
+    assert source.length == CHUNK
+    web._receiveAudio(client, source, HEADER.pack(1) + b"\x01")
+    assert source.length == CHUNK
+    assert client.received == 2
+    web_audio.logger.flushLimited(force=True)
@@ -0,0 +1,100 @@
+import asyncio
+import time
+from threading import Event
+
+from rpi_intercom.worker import Worker
+
+
+def test_tasks_run_in_due_order_not_submission_order():
+    worker = Worker("test")
+    ran = []
+    done = Event()
+    worker.submit(0.2, lambda: (ran.append("slow"), done.set()))
+    worker.submit(0.05, lambda: ran.append("fast"))
+    worker.start()
+    assert done.wait(2)
+    worker.stop()
+    assert ran == ["fast", "slow"]
+
+
+def test_periodic_task_and_cancel():
+    worker = Worker("test")
+    runs = []
+    task = worker.every(0.02, lambda: runs.append(time.monotonic()))
+    worker.start()
+    time.sleep(0.15)
+    task.cancel()
+    count = len(runs)
+    time.sleep(0.1)
+    worker.stop()
+    assert count >= 4
+    assert len(runs) == count
+    assert task.cancelled
+    assert worker.pending() == 0
+
+
+def test_trigger_by_key_only_wakes_that_key():
+    worker = Worker("test")
+    ran = []
+    check = Event()
+    worker.every(10, lambda: (ran.append("check"), check.set()), key="check", delay=10)
+    worker.every(10, lambda: ran.append("volume"), key="volume", delay=10)
+    worker.start()
+    worker.trigger("check")
+    assert check.wait(2)
+    time.sleep(0.05)
+    worker.stop()
+    assert ran == ["check"]
+
+
+def test_trigger_while_running_runs_again():
+    worker = Worker("test")
+    runs = []
+    started = Event()
+    twice = Event()
+
+    def work():
+        runs.append(1)
+        started.set()
+        if len(runs) == 1:
+            time.sleep(0.1)
+        else:
+            twice.set()
+    worker.every(10, work, key="check")
+    worker.start()
+    assert started.wait(2)
+    worker.trigger("check")
+    assert twice.wait(2)
+    worker.stop()
+    assert len(runs) == 2
+
+
+def test_exceptions_do_not_stop_the_worker():
+    worker = Worker("test")
+    done = Event()
+
+    def fail():
+        raise ValueError("expected")
+    worker.submit(0, fail)
+    worker.submit(0.01, done.set)
+    worker.start()
+    assert done.wait(2)
+    worker.stop()
+
+
+def test_tasks_can_run_on_the_event_loop():
+    async def run():
+        worker = Worker("test")
+        loop = asyncio.get_running_loop()
+        threads = []
+
+        async def work():
+            threads.append(asyncio.current_task() is not None)
+        worker.every(0.02, work, loop=loop)
+        worker.start()
+        await asyncio.sleep(0.1)
+        worker.stop()
+        return threads
+    threads = asyncio.run(run())
+    assert len(threads) >= 3
+    assert all(threads)